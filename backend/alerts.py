@@ -0,0 +1,233 @@
+import json
+import threading
+import time
+import traceback
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+OPERATORS = {
+    '>': lambda value, threshold: value > threshold,
+    '>=': lambda value, threshold: value >= threshold,
+    '<': lambda value, threshold: value < threshold,
+    '<=': lambda value, threshold: value <= threshold
+}
+SEVERITIES = ('info', 'warning', 'critical')
+
+DEFAULT_RULES = [
+    {'name': 'High CPU usage', 'metric': 'cpu', 'operator': '>', 'threshold': 80,
+     'duration': 300, 'clear_threshold': 70, 'severity': 'warning'},
+    {'name': 'High memory usage', 'metric': 'memory', 'operator': '>', 'threshold': 80,
+     'duration': 300, 'clear_threshold': 75, 'severity': 'warning'},
+    {'name': 'System disk filling up', 'metric': 'disk', 'operator': '>', 'threshold': 80,
+     'duration': 0, 'clear_threshold': 78, 'severity': 'warning'},
+    {'name': 'System disk almost full', 'metric': 'disk', 'operator': '>', 'threshold': 90,
+     'duration': 600, 'clear_threshold': 88, 'severity': 'critical'}
+]
+
+
+class RollingWindow:
+    # Running sum over a time span, so avg() is O(1) whatever the history
+
+    def __init__(self, span):
+        self.span = span
+        self.points = deque()
+        self.total = 0.0
+
+    def add(self, ts, value):
+        self.points.append((ts, value))
+        self.total += value
+        while self.points and self.points[0][0] < ts - self.span:
+            self.total -= self.points.popleft()[1]
+
+    def last(self):
+        return self.points[-1][1] if self.points else None
+
+    def avg(self):
+        return self.total / len(self.points) if self.points else None
+
+
+class Rule:
+    def __init__(self, row):
+        self.id = row['id']
+        self.name = row['name']
+        self.metric = row['metric']
+        self.operator = row['operator']
+        self.threshold = row['threshold']
+        self.duration = row['duration'] or 0
+        self.clear_threshold = row['clear_threshold']
+        self.aggregate = row['aggregate'] or 'last'
+        self.window = row['window'] or 0
+        self.severity = row['severity']
+        self.notifiers = json.loads(row['notifiers']) if row['notifiers'] else ['log']
+        # Rules averaging one metric over the same span share a window
+        self.window_key = (self.metric, self.window if self.aggregate == 'avg' else 0)
+        self.definition = tuple(row[name] for name in row.keys() if name not in ('enabled', 'created_at'))
+        # Evaluation state
+        self.pending_since = None
+        self.alert_id = None
+
+    def breached(self, value):
+        return OPERATORS[self.operator](value, self.threshold)
+
+    def cleared(self, value):
+        # Hysteresis: a firing alert only resolves once the value is back
+        # past the clear threshold, not merely under the trigger threshold
+        clear = self.clear_threshold if self.clear_threshold is not None else self.threshold
+        return not OPERATORS[self.operator](value, clear)
+
+
+class LogNotifier:
+    def __init__(self, log_activity):
+        self.log_activity = log_activity
+
+    def notify(self, event, alert):
+        self.log_activity(None, f'alert_{event}', alert['message'])
+
+
+class StubNotifier:
+    # Records notifications in memory; for tests and local development
+
+    def __init__(self):
+        self.sent = []
+        self._changed = threading.Condition()
+
+    def notify(self, event, alert):
+        with self._changed:
+            self.sent.append((event, alert))
+            self._changed.notify_all()
+
+    def wait(self, count, timeout=5):
+        # Delivery happens on the notify thread; True once count have arrived
+        with self._changed:
+            return self._changed.wait_for(lambda: len(self.sent) >= count, timeout)
+
+
+class WebhookNotifier:
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def notify(self, event, alert):
+        body = json.dumps({'event': event, 'alert': alert}).encode('utf-8')
+        req = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+        urllib.request.urlopen(req, timeout=self.timeout).close()
+
+
+class AlertEngine:
+    def __init__(self, get_db, notifiers=None):
+        self.get_db = get_db
+        self.notifiers = notifiers or {}
+        self.rules = []
+        self.windows = {}
+        self._lock = threading.Lock()
+        self._notify_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='notify')
+
+    def load(self):
+        with self.get_db() as db:
+            rows = db.execute('SELECT * FROM alert_rules WHERE enabled = 1').fetchall()
+            firing = {row['rule_id']: row['id'] for row in
+                      db.execute("SELECT id, rule_id FROM alerts WHERE status = 'firing'").fetchall()}
+        with self._lock:
+            # Rules whose definition is unchanged keep their pending state,
+            # and windows still in use keep their samples
+            current = {rule.id: rule for rule in self.rules}
+            rules = []
+            for row in rows:
+                rule = Rule(row)
+                old = current.get(rule.id)
+                if old is not None and old.definition == rule.definition:
+                    rule = old
+                rule.alert_id = firing.get(rule.id)
+                rules.append(rule)
+            windows = {}
+            for rule in rules:
+                if rule.window_key not in windows:
+                    windows[rule.window_key] = self.windows.get(rule.window_key) or RollingWindow(rule.window_key[1])
+            self.rules = rules
+            self.windows = windows
+
+    def on_sample(self, ts, samples):
+        with self._lock:
+            for (metric, _), window in self.windows.items():
+                if metric in samples:
+                    window.add(ts, samples[metric])
+            # One O(1) check per rule per tick
+            for rule in self.rules:
+                self._evaluate(rule, ts)
+
+    def _evaluate(self, rule, now):
+        window = self.windows.get(rule.window_key)
+        value = None
+        if window is not None:
+            value = window.avg() if rule.aggregate == 'avg' else window.last()
+        if value is None:
+            return
+
+        if rule.alert_id is not None:
+            if rule.cleared(value):
+                self._resolve(rule, value)
+            return
+
+        if rule.breached(value):
+            if rule.pending_since is None:
+                rule.pending_since = now
+            if now - rule.pending_since >= rule.duration:
+                self._fire(rule, value)
+        else:
+            rule.pending_since = None
+
+    def _message(self, rule, value):
+        label = f"{rule.aggregate} " if rule.aggregate == 'avg' else ''
+        return f"{rule.name}: {label}{rule.metric} = {value:.1f} ({rule.operator} {rule.threshold})"
+
+    def _fire(self, rule, value):
+        message = self._message(rule, value)
+        with self.get_db() as db:
+            cursor = db.cursor()
+            cursor.execute('''
+                INSERT INTO alerts (rule_id, status, severity, value, message)
+                VALUES (?, 'firing', ?, ?, ?)
+            ''', (rule.id, rule.severity, value, message))
+            db.commit()
+            rule.alert_id = cursor.lastrowid
+        rule.pending_since = None
+        self._notify(rule, 'firing', {'id': rule.alert_id, 'rule': rule.name, 'metric': rule.metric,
+                                      'severity': rule.severity, 'value': value, 'message': message})
+
+    def _resolve(self, rule, value):
+        message = f"Resolved: {self._message(rule, value)}"
+        with self.get_db() as db:
+            db.execute('''
+                UPDATE alerts SET status = 'resolved', resolved_at = CURRENT_TIMESTAMP, resolved_value = ?
+                WHERE id = ?
+            ''', (value, rule.alert_id))
+            db.commit()
+        alert_id, rule.alert_id = rule.alert_id, None
+        self._notify(rule, 'resolved', {'id': alert_id, 'rule': rule.name, 'metric': rule.metric,
+                                        'severity': rule.severity, 'value': value, 'message': message})
+
+    def _notify(self, rule, event, alert):
+        # Off the sampler thread, so a slow webhook can't delay evaluation
+        for name in rule.notifiers:
+            notifier = self.notifiers.get(name)
+            if notifier is not None:
+                self._notify_pool.submit(self._send, notifier, event, alert)
+
+    def _send(self, notifier, event, alert):
+        try:
+            notifier.notify(event, alert)
+        except Exception:
+            traceback.print_exc()
+
+    def firing(self):
+        with self._lock:
+            return [rule for rule in self.rules if rule.alert_id is not None]
+
+    def status(self):
+        severities = [rule.severity for rule in self.firing()]
+        if 'critical' in severities:
+            return 'critical'
+        if 'warning' in severities:
+            return 'warning'
+        return 'healthy'
@@ -1,34 +1,140 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import create_access_token, create_refresh_token, decode_token, jwt_required, get_jwt, get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
 from datetime import timedelta
-import bcrypt
 import os
-import psutil
+import shutil
 import sqlite3
 import json
+import threading
+import time
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.test import EnvironBuilder
 import pathlib
 from datetime import datetime
 import platform
-import subprocess
+from urllib.parse import quote
+from thumbnails import ThumbnailCache, THUMBNAIL_SIZES, cache_key, media_kind
+from jobs import JobManager
+from throttle import Throttle, validate_policy
+from smart import DiskHealthMonitor, FixtureCollector, SmartctlCollector
+from raid import ArrayMonitor
+from metrics import MetricsSampler
+from rrd import RoundRobinStore, FIELDS as RRD_FIELDS
+from sharing import ConfigApplier, PROTOCOLS, check_service_config, check_share_name, check_share_settings
+from commands import CommandExecutor, StubRunner, SubprocessRunner, systemctl
+from sessions import SessionMonitor, CommandSource, FixtureSource as SessionFixtureSource, PORTS as SESSION_PORTS
+from alerts import AlertEngine, LogNotifier, WebhookNotifier, DEFAULT_RULES, OPERATORS, SEVERITIES
+import dedupe
+import backup as backup_engine
+import repository
+import responses
+from responses import stream_json
+import users as user_directory
+import permissions as share_permissions
+from recycle import RecycleBin, TRASH_DIR
+import diagnostics
+import archives
+import profiling
+from federation import Federation, NodeError, VIEWS as FEDERATION_VIEWS
+import config_snapshot
+from tokens import CachingJWTManager, RevocationList
 
 app = Flask(__name__)
 # Configure CORS to allow requests from any origin
-CORS(app, resources={r"/api/*": {"origins": "*"}})
+CORS(app, resources={r"/api/*": {"origins": "*", "expose_headers": ["X-Next-Cursor"]}})
 
 # Configuration
+app.config['DATABASE'] = os.environ.get('DATABASE', 'nas.db')
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
 app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'your-jwt-secret-key-here')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)
+app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=int(os.environ.get('JWT_REFRESH_TOKEN_DAYS', 30)))
+# How often each worker picks up tokens revoked by the others
+app.config['TOKEN_REVOCATION_SYNC'] = float(os.environ.get('TOKEN_REVOCATION_SYNC', 2.0))
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+app.config['THUMBNAIL_CACHE_DIR'] = os.environ.get('THUMBNAIL_CACHE_DIR', 'thumbnail-cache')
+app.config['THUMBNAIL_CACHE_BYTES'] = int(os.environ.get('THUMBNAIL_CACHE_BYTES', 512 * 1024**2))
+# Point SMART_FIXTURE_DIR at saved smartctl -j output to run without real disks
+app.config['SMART_FIXTURE_DIR'] = os.environ.get('SMART_FIXTURE_DIR')
+app.config['SMART_POLL_INTERVAL'] = int(os.environ.get('SMART_POLL_INTERVAL', 1800))
+app.config['SESSIONS_FIXTURE_DIR'] = os.environ.get('SESSIONS_FIXTURE_DIR')
+app.config['MDSTAT_PATH'] = os.environ.get('MDSTAT_PATH', '/proc/mdstat')
+app.config['METRICS_INTERVAL'] = int(os.environ.get('METRICS_INTERVAL', 10))
+app.config['ALERT_WEBHOOK_URL'] = os.environ.get('ALERT_WEBHOOK_URL')
+app.config['METRICS_HISTORY_DIR'] = os.environ.get('METRICS_HISTORY_DIR', 'metrics-history')
+# When set, rendered protocol configs go under this directory and no daemon is touched
+app.config['PROTOCOL_CONFIG_ROOT'] = os.environ.get('PROTOCOL_CONFIG_ROOT')
+# 'stub' records system commands instead of running them
+app.config['COMMAND_RUNNER'] = os.environ.get('COMMAND_RUNNER', 'subprocess' if platform.system() == 'Linux' else 'stub')
+app.config['COMMAND_TIMEOUT'] = int(os.environ.get('COMMAND_TIMEOUT', 30))
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 0)) or None
+# Default owner and group for share permission applies (names or ids)
+app.config['SHARE_OWNER'] = os.environ.get('SHARE_OWNER')
+# Share paths must lie under one of these volume roots (os.pathsep separated)
+app.config['SHARE_ROOTS'] = [root for root in os.environ.get('SHARE_ROOTS', '/mnt:/srv:/media').split(os.pathsep)
+                             if root]
+app.config['SHARE_GROUP'] = os.environ.get('SHARE_GROUP')
+app.config['RECYCLE_MAX_AGE_DAYS'] = int(os.environ.get('RECYCLE_MAX_AGE_DAYS', 30))
+# Per-share recycle bin size limit in bytes; 0 means only the age limit applies
+app.config['RECYCLE_MAX_BYTES'] = int(os.environ.get('RECYCLE_MAX_BYTES', 0))
+app.config['RECYCLE_PURGE_INTERVAL'] = int(os.environ.get('RECYCLE_PURGE_INTERVAL', 60))
+app.config['PROTOCOL_APPLY_DELAY'] = float(os.environ.get('PROTOCOL_APPLY_DELAY', 1.0))
+# Threads deflating blocks of a .tar.gz; 0 means one per CPU, up to 8
+app.config['COMPRESS_WORKERS'] = int(os.environ.get('COMPRESS_WORKERS', 0)) or None
+# Off unless PROFILING=1; when off, create_app() installs no profiling hooks
+app.config['PROFILING'] = os.environ.get('PROFILING', '0') == '1'
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', 'profiles')
+# Seconds a federated view waits for peers before answering with cached results
+app.config['FEDERATION_TIMEOUT'] = float(os.environ.get('FEDERATION_TIMEOUT', 3.0))
+# How long one request to a peer may run; late replies still refresh the cache
+app.config['FEDERATION_NODE_TIMEOUT'] = float(os.environ.get('FEDERATION_NODE_TIMEOUT', 10.0))
+app.config['FEDERATION_CACHE_TTL'] = float(os.environ.get('FEDERATION_CACHE_TTL', 5.0))
 
 # Initialize JWT
-jwt = JWTManager(app)
+jwt = CachingJWTManager(app)
+responses.init_app(app, app.config['COMPRESS_MIN_SIZE'])
+
+# Background jobs (scans, backups, maintenance) share one I/O throttle
+io_throttle = Throttle()
+jobs = JobManager(max_workers=int(os.environ.get('JOB_WORKERS', 2)), throttle=io_throttle)
+# Runs the independent parts of the dashboard side by side
+request_parts = ThreadPoolExecutor(max_workers=int(os.environ.get('REQUEST_PART_WORKERS', 8)),
+                                   thread_name_prefix='request-part')
+# Whole in-process sub-requests (batch, federation) get a pool of their own:
+# one may be the dashboard, which waits on request_parts, and a worker must
+# never wait on work queued behind it in its own pool
+sub_requests = ThreadPoolExecutor(max_workers=int(os.environ.get('SUB_REQUEST_WORKERS', 8)),
+                                  thread_name_prefix='sub-request')
+MAX_BATCH_REQUESTS = 10
+# Paths that dispatch sub-requests of their own or stream a download
+BATCH_EXCLUDED_PATHS = ('/api/batch', '/api/federation/', '/api/config/export')
+# Benchmarks get their own single worker: one at a time, and outside the
+# job pool's lowered I/O priority and throttle
+diagnostics_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='diagnostics')
+net_benches = {}
+MAX_DISK_BENCH_MB = 4096
+MAX_NET_BENCH_MB = 2048
+# Process-wide sampling runs here, one at a time and unthrottled
+profiling_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='profiler')
+MAX_PROFILE_SECONDS = 300
+
+# Set on a thread while it runs a batch sub-request: (connection, lock)
+_shared_db = threading.local()
 
 # Database helper functions
 @contextmanager
 def get_db():
-    db = sqlite3.connect('nas.db')
+    shared = getattr(_shared_db, 'value', None)
+    if shared is not None:
+        # The batch's one connection, used by its sub-requests in turn
+        with shared[1]:
+            yield shared[0]
+        return
+    db = sqlite3.connect(app.config['DATABASE'])
     db.row_factory = sqlite3.Row
     try:
         yield db
@@ -36,6 +142,7 @@ def get_db():
         db.close()
 
 def init_db():
+    import bcrypt
     with get_db() as db:
         # Create users table
         db.execute('''
@@ -50,6 +157,14 @@ def init_db():
             last_login DATETIME
         )
         ''')
+        # Databases made by reset_db.py predate last_login
+        if 'last_login' not in {row['name'] for row in db.execute('PRAGMA table_info(users)')}:
+            db.execute('ALTER TABLE users ADD COLUMN last_login DATETIME')
+        # username and email already have UNIQUE indexes for sorting; these
+        # serve prefix search (LIKE is case-insensitive) and last-login order
+        db.execute('CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users (username COLLATE NOCASE)')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_users_email_nocase ON users (email COLLATE NOCASE)')
+        db.execute("CREATE INDEX IF NOT EXISTS idx_users_last_login ON users (COALESCE(last_login, ''), id)")
 
         # Create shares table
         db.execute('''
@@ -86,6 +201,21 @@ def init_db():
         )
         ''')
 
+        # Create backup runs table (backup and verify history)
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS backup_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            backup_id INTEGER NOT NULL,
+            kind TEXT NOT NULL DEFAULT 'run',
+            job_id TEXT,
+            started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME,
+            status TEXT NOT NULL DEFAULT 'running',
+            result TEXT,
+            FOREIGN KEY (backup_id) REFERENCES backups (id)
+        )
+        ''')
+
         # Create network settings table
         db.execute('''
         CREATE TABLE IF NOT EXISTS network_settings (
@@ -130,6 +260,10 @@ def init_db():
         )
         ''')
 
+        # Config imports match quotas and backups on these
+        db.execute('CREATE INDEX IF NOT EXISTS idx_quotas_user_path ON quotas (user_id, path)')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_backups_name ON backups (name)')
+
         # Create activity log table
         db.execute('''
         CREATE TABLE IF NOT EXISTS activity_log (
@@ -141,9 +275,219 @@ def init_db():
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
         ''')
+        # The log page reads the newest rows; without this it sorts the whole table
+        db.execute('CREATE INDEX IF NOT EXISTS idx_activity_log_timestamp ON activity_log (timestamp)')
+
+        # Create command audit table
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS command_audit (
+            id TEXT PRIMARY KEY,
+            idempotency_key TEXT,
+            name TEXT NOT NULL,
+            argv TEXT NOT NULL,
+            requested_by TEXT,
+            status TEXT NOT NULL,
+            returncode INTEGER,
+            stdout TEXT,
+            stderr TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+        ''')
+        # Idempotency keys used to be unique across all users; they are now
+        # scoped to the requesting user and operation, so older tables are
+        # rebuilt without the column constraint
+        audit_sql = db.execute("SELECT sql FROM sqlite_master WHERE name = 'command_audit'").fetchone()[0]
+        if 'idempotency_key TEXT UNIQUE' in audit_sql:
+            db.execute('ALTER TABLE command_audit RENAME TO command_audit_old')
+            db.execute(audit_sql.replace('idempotency_key TEXT UNIQUE', 'idempotency_key TEXT'))
+            db.execute('INSERT INTO command_audit SELECT * FROM command_audit_old')
+            db.execute('DROP TABLE command_audit_old')
+            db.commit()
+        db.execute('CREATE INDEX IF NOT EXISTS idx_command_audit_created ON command_audit (created_at)')
+        db.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_command_audit_key
+            ON command_audit (requested_by, name, idempotency_key)
+        ''')
+
+        # Create file hash cache table
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS file_hashes (
+            device INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            algorithm TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            partial_hash TEXT,
+            full_hash TEXT,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (device, inode, algorithm)
+        )
+        ''')
+
+        # Create disk health tables: latest summary plus change-only series
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS disk_health (
+            disk TEXT PRIMARY KEY,
+            status TEXT,
+            summary TEXT NOT NULL,
+            checked_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS disk_health_series (
+            disk TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            value REAL,
+            PRIMARY KEY (disk, metric, ts)
+        ) WITHOUT ROWID
+        ''')
+
+        # Create alerting tables
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS alert_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            operator TEXT NOT NULL DEFAULT '>',
+            threshold REAL NOT NULL,
+            duration INTEGER DEFAULT 0,
+            clear_threshold REAL,
+            aggregate TEXT DEFAULT 'last',
+            window INTEGER DEFAULT 0,
+            severity TEXT DEFAULT 'warning',
+            notifiers TEXT,
+            enabled BOOLEAN DEFAULT 1,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            rule_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'firing',
+            severity TEXT,
+            value REAL,
+            resolved_value REAL,
+            message TEXT,
+            started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            resolved_at DATETIME,
+            FOREIGN KEY (rule_id) REFERENCES alert_rules (id)
+        )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_alerts_status ON alerts (status, id)')
+
+        if not db.execute('SELECT 1 FROM alert_rules LIMIT 1').fetchone():
+            db.executemany('''
+            INSERT INTO alert_rules (name, metric, operator, threshold, duration, clear_threshold, severity)
+            VALUES (:name, :metric, :operator, :threshold, :duration, :clear_threshold, :severity)
+            ''', DEFAULT_RULES)
+
+        # Ownership/mode applies on share trees; pending holds the directory
+        # frontier from the last checkpoint so an interrupted run can resume
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS share_permission_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            share_id INTEGER NOT NULL,
+            job_id TEXT,
+            status TEXT NOT NULL DEFAULT 'running',
+            target TEXT NOT NULL,
+            pending TEXT,
+            scanned INTEGER DEFAULT 0,
+            changed INTEGER DEFAULT 0,
+            errors INTEGER DEFAULT 0,
+            last_error TEXT,
+            created_by INTEGER,
+            started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME,
+            FOREIGN KEY (share_id) REFERENCES shares (id),
+            FOREIGN KEY (created_by) REFERENCES users (id)
+        )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_share_permission_runs_share ON share_permission_runs (share_id, id)')
+
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS recycle_bin (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            share_id INTEGER NOT NULL,
+            trash_path TEXT NOT NULL,
+            original_path TEXT NOT NULL,
+            is_dir BOOLEAN DEFAULT 0,
+            size INTEGER,
+            deleted_by INTEGER,
+            deleted_at REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'trashed',
+            last_error TEXT,
+            FOREIGN KEY (deleted_by) REFERENCES users (id)
+        )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_recycle_bin_share ON recycle_bin (share_id, status, deleted_at)')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_recycle_bin_status ON recycle_bin (status, id)')
+
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS diagnostics_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            target TEXT,
+            job_id TEXT,
+            status TEXT NOT NULL DEFAULT 'running',
+            params TEXT,
+            result TEXT,
+            created_by INTEGER,
+            started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME,
+            FOREIGN KEY (created_by) REFERENCES users (id)
+        )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_diagnostics_runs_kind ON diagnostics_runs (kind, id)')
+
+        # Peer backends this instance fronts; only a rotating refresh token is stored
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS federation_nodes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            url TEXT UNIQUE NOT NULL,
+            refresh_token TEXT NOT NULL,
+            enabled BOOLEAN DEFAULT 1,
+            created_by INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (created_by) REFERENCES users (id)
+        )
+        ''')
+
+        # Create dedupe reports table
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS dedupe_reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            created_by INTEGER,
+            reclaimable_bytes INTEGER,
+            report TEXT NOT NULL,
+            FOREIGN KEY (created_by) REFERENCES users (id)
+        )
+        ''')
         
         db.commit()
 
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            jti TEXT UNIQUE NOT NULL,
+            token_type TEXT NOT NULL,
+            username TEXT,
+            expires_at REAL,
+            revoked_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires ON revoked_tokens (expires_at)')
+        db.commit()
+
         # Create default admin user if not exists
         cursor = db.cursor()
         cursor.execute('SELECT * FROM users WHERE username = ?', ('admin',))
@@ -163,8 +507,26 @@ def init_db():
             ))
             db.commit()
 
-# Initialize database
-init_db()
+# Bump whenever init_db() or init_settings_db() change, so existing databases
+# get the new tables on their next start
+SCHEMA_VERSION = 11
+
+def init_schema():
+    # Runs the CREATE TABLE pass once per schema version instead of at every import
+    with get_db() as db:
+        version = db.execute('PRAGMA user_version').fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return False
+    init_db()
+    init_settings_db()
+    with get_db() as db:
+        db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        db.commit()
+    return True
+
+@app.cli.command('init-db')
+def init_db_command():
+    print('Database schema created' if init_schema() else 'Database schema is up to date')
 
 def log_activity(user_id, action, details=None):
     with get_db() as db:
@@ -174,6 +536,9 @@ def log_activity(user_id, action, details=None):
         ''', (user_id, action, details))
         db.commit()
 
+def can_manage_system(user):
+    return user['role'] == 'admin' or 'manage_system' in user['permissions'].split(',')
+
 # Routes
 @app.route('/api/login', methods=['POST'])
 def login():
@@ -184,8 +549,9 @@ def login():
     
     print(f"Login attempt: Username={username}, Password={'*' * len(password) if password else 'None'}")
     
+    import bcrypt
     # Get the user from the database
-    conn = sqlite3.connect('nas.db')
+    conn = sqlite3.connect(app.config['DATABASE'])
     cursor = conn.cursor()
     cursor.execute('SELECT id, username, password_hash, role FROM users WHERE username = ?', (username,))
     user = cursor.fetchone()
@@ -193,14 +559,19 @@ def login():
     
     if user and bcrypt.checkpw(password.encode('utf-8'), user[2].encode('utf-8')):
         print(f"Login successful for user: {username}")
-        # Create access token
-        access_token = create_access_token(identity=user[0])
+        # Tokens carry the username, which is what every route looks up
+        access_token = create_access_token(identity=user[1])
+        refresh_token = create_refresh_token(identity=user[1])
         
         # Log the activity
         log_activity(user[0], 'login', 'User logged in')
+        with get_db() as db:
+            db.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?', (user[0],))
+            db.commit()
         
         return jsonify({
             'access_token': access_token,
+            'refresh_token': refresh_token,
             'user': user[1],
             'role': user[3]
         }), 200
@@ -208,10 +579,38 @@ def login():
         print(f"Login failed for user: {username}")
         return jsonify({'error': 'Invalid username or password'}), 401
 
-@app.route('/api/logout', methods=['GET'])
+@app.route('/api/token/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh_access_token():
+    # Refresh tokens are single use: each refresh revokes the old one and
+    # hands out a new pair
+    claims = get_jwt()
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT id, status FROM users WHERE username = ?', (current_user,)).fetchone()
+    if not user or user['status'] != 'active':
+        return jsonify({'error': 'User is not active'}), 401
+    token_revocations.revoke(claims['jti'], 'refresh', current_user, claims.get('exp'))
+    return jsonify({
+        'access_token': create_access_token(identity=current_user),
+        'refresh_token': create_refresh_token(identity=current_user)
+    })
+
+@app.route('/api/logout', methods=['GET', 'POST'])
 @jwt_required()
 def logout():
     current_user = get_jwt_identity()
+    claims = get_jwt()
+    token_revocations.revoke(claims['jti'], 'access', current_user, claims.get('exp'))
+    # The client may send its refresh token along so it stops working too
+    data = request.get_json(silent=True) or {}
+    if data.get('refresh_token'):
+        try:
+            refresh = decode_token(data['refresh_token'])
+        except (PyJWTError, JWTExtendedException):
+            refresh = None
+        if refresh and refresh.get('type') == 'refresh' and refresh.get('sub') == current_user:
+            token_revocations.revoke(refresh['jti'], 'refresh', current_user, refresh.get('exp'))
     with get_db() as db:
         cursor = db.cursor()
         cursor.execute('SELECT id FROM users WHERE username = ?', (current_user,))
@@ -227,12 +626,25 @@ def get_users():
         current_user = db.execute('SELECT * FROM users WHERE username = ?', (get_jwt_identity(),)).fetchone()
         if current_user['role'] != 'admin':
             return jsonify({'error': 'Unauthorized'}), 403
-        
-        users = db.execute('''
-            SELECT id, username, email, role, status, permissions, last_login 
-            FROM users
-        ''').fetchall()
-        return jsonify([{
+
+        # The body stays a plain list; the cursor for the next page is in
+        # the X-Next-Cursor header and absent on the last page
+        try:
+            limit = min(max(int(request.args.get('limit', user_directory.DEFAULT_PAGE_SIZE)), 1),
+                        user_directory.MAX_PAGE_SIZE)
+            users, next_cursor = user_directory.page(
+                db,
+                search=request.args.get('search', '').strip() or None,
+                role=request.args.get('role') or None,
+                status=request.args.get('status') or None,
+                sort=request.args.get('sort', 'username'),
+                order=request.args.get('order', 'asc'),
+                limit=limit,
+                cursor=request.args.get('cursor') or None
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        response = jsonify([{
             'id': user['id'],
             'username': user['username'],
             'email': user['email'],
@@ -241,6 +653,9 @@ def get_users():
             'permissions': user['permissions'].split(','),
             'lastLogin': user['last_login']
         } for user in users])
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
 
 @app.route('/api/users', methods=['POST'])
 @jwt_required()
@@ -251,8 +666,7 @@ def create_user():
             return jsonify({'error': 'Unauthorized'}), 403
         
         data = request.get_json()
-        salt = bcrypt.gensalt()
-        password_hash = bcrypt.hashpw(data['password'].encode('utf-8'), salt).decode('utf-8')
+        password_hash = user_directory.hash_password(data['password'])
         
         try:
             cursor = db.cursor()
@@ -272,6 +686,36 @@ def create_user():
         except sqlite3.IntegrityError:
             return jsonify({'error': 'Username or email already exists'}), 400
 
+@app.route('/api/users/bulk', methods=['POST'])
+@jwt_required()
+def create_users_bulk():
+    # Accepts a JSON list of users (or {'users': [...]}) or a CSV body with a
+    # username,email,password[,role][,permissions] header
+    with get_db() as db:
+        current_user = db.execute('SELECT * FROM users WHERE username = ?', (get_jwt_identity(),)).fetchone()
+        if current_user['role'] != 'admin':
+            return jsonify({'error': 'Unauthorized'}), 403
+
+        if request.mimetype == 'text/csv':
+            rows = user_directory.parse_csv(request.get_data(as_text=True))
+        elif 'file' in request.files:
+            rows = user_directory.parse_csv(request.files['file'].read().decode('utf-8-sig'))
+        else:
+            data = request.get_json(silent=True)
+            rows = data.get('users') if isinstance(data, dict) else data
+        if not isinstance(rows, list) or not rows:
+            return jsonify({'error': 'Expected a non-empty list of users'}), 400
+        if len(rows) > user_directory.MAX_BULK_USERS:
+            return jsonify({'error': f"At most {user_directory.MAX_BULK_USERS} users per request"}), 400
+
+        results = user_directory.bulk_create(db, rows, password_hasher)
+        created = sum(1 for result in results if result['status'] == 'created')
+        failed = len(results) - created
+        if created:
+            log_activity(current_user['id'], 'bulk_create_users',
+                         f"Created {created} users" + (f" ({failed} rows failed)" if failed else ''))
+        return jsonify({'created': created, 'failed': failed, 'results': results}), 201 if created else 400
+
 @app.route('/api/activity-log', methods=['GET'])
 @jwt_required()
 def get_activity_log():
@@ -280,42 +724,48 @@ def get_activity_log():
         if 'view_logs' not in current_user['permissions'].split(','):
             return jsonify({'error': 'Unauthorized'}), 403
         
+        # System events (RAID state changes, alerts) have no user
+        # Rows are serialized as-is, so the columns are the response keys
         logs = db.execute('''
-            SELECT al.*, u.username 
+            SELECT al.id, al.timestamp, COALESCE(u.username, 'system') AS username, al.action, al.details
             FROM activity_log al 
-            JOIN users u ON al.user_id = u.id 
+            LEFT JOIN users u ON al.user_id = u.id 
             ORDER BY al.timestamp DESC 
             LIMIT 100
         ''').fetchall()
         
-        return jsonify([{
-            'id': log['id'],
-            'timestamp': log['timestamp'],
-            'username': log['username'],
-            'action': log['action'],
-            'details': log['details']
-        } for log in logs])
+        return jsonify(logs)
 
 @app.route('/api/system-status', methods=['GET'])
 @jwt_required()
 def system_status():
+    return jsonify(system_status_data())
+
+def system_status_data():
+    import psutil
     cpu_usage = psutil.cpu_percent()
     memory = psutil.virtual_memory()
     disk = psutil.disk_usage('/')
     
-    return jsonify({
+    # Status comes from the alert rules, which see history and hysteresis
+    return {
         'cpuUsage': cpu_usage,
         'memoryUsage': memory.percent,
         'storageUsage': disk.percent,
         'totalStorage': f"{disk.total / (1024**3):.2f}GB",
         'usedStorage': f"{disk.used / (1024**3):.2f}GB",
         'freeStorage': f"{disk.free / (1024**3):.2f}GB",
-        'systemStatus': 'healthy' if cpu_usage < 80 and memory.percent < 80 and disk.percent < 80 else 'warning'
-    })
+        'systemStatus': alert_engine.status(),
+        'firingAlerts': len(alert_engine.firing())
+    }
 
 @app.route('/api/volumes', methods=['GET'])
 @jwt_required()
 def get_volumes():
+    return jsonify(volumes_data())
+
+def volumes_data():
+    import psutil
     volumes = []
     for partition in psutil.disk_partitions():
         try:
@@ -331,7 +781,89 @@ def get_volumes():
             })
         except Exception:
             continue
-    return jsonify(volumes)
+    return volumes
+
+@app.route('/api/dashboard', methods=['GET'])
+@jwt_required()
+def get_dashboard():
+    # One round trip for the Dashboard and Storage pages: the token and user
+    # are resolved once, the DB parts share a connection and the slow system
+    # calls (psutil, statfs on every mount, directory listing) run in parallel
+    current_user = get_jwt_identity()
+    path = request.args.get('path')
+    parts = {
+        'status': request_parts.submit(system_status_data),
+        'volumes': request_parts.submit(volumes_data)
+    }
+    if path:
+        parts['files'] = request_parts.submit(list_directory, path)
+    
+    result = {'errors': {}}
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        result['shares'] = shares_data(db, user)
+    
+    for name, future in parts.items():
+        try:
+            result[name] = future.result()
+        except FileNotFoundError:
+            result[name] = None
+            result['errors'][name] = 'Path does not exist'
+        except Exception as e:
+            result[name] = None
+            result['errors'][name] = str(e)
+    return jsonify(result)
+
+def run_sub_request(path, headers, shared_db=None):
+    environ = EnvironBuilder(path=path, method='GET', headers=headers).get_environ()
+    _shared_db.value = shared_db
+    try:
+        with app.request_context(environ):
+            try:
+                response = app.full_dispatch_request()
+            except Exception as e:
+                return 500, {'error': str(e)}
+            return response.status_code, response.get_json(silent=True)
+    finally:
+        _shared_db.value = None
+
+@app.route('/api/batch', methods=['POST'])
+@jwt_required()
+def batch_requests():
+    requests_ = (request.get_json() or {}).get('requests', [])
+    if not isinstance(requests_, list) or not requests_:
+        return jsonify({'error': 'requests must be a non-empty list'}), 400
+    if len(requests_) > MAX_BATCH_REQUESTS:
+        return jsonify({'error': f'At most {MAX_BATCH_REQUESTS} requests per batch'}), 400
+    
+    paths = []
+    for item in requests_:
+        path = item.get('path', '') if isinstance(item, dict) else item
+        if not isinstance(path, str) or not path.startswith('/api/') or path.startswith(BATCH_EXCLUDED_PATHS):
+            return jsonify({'error': f'Invalid batch path: {path}'}), 400
+        paths.append(path)
+    
+    # Sub-requests carry the caller's token, so each one is authorized exactly
+    # as if it had been sent on its own; only GETs are allowed. They share
+    # one read connection instead of opening one each.
+    headers = {'Authorization': request.headers.get('Authorization', '')}
+    db = sqlite3.connect(app.config['DATABASE'], check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    shared = (db, threading.RLock())
+    try:
+        futures = [sub_requests.submit(run_sub_request, path, headers, shared) for path in paths]
+        responses = []
+        for item, path, future in zip(requests_, paths, futures):
+            status, body = future.result()
+            responses.append({
+                'id': item.get('id', path) if isinstance(item, dict) else path,
+                'path': path,
+                'status': status,
+                'body': body
+            })
+    finally:
+        db.close()
+    return jsonify({'responses': responses})
 
 @app.route('/api/files', methods=['GET'])
 @jwt_required()
@@ -341,24 +873,415 @@ def list_files():
         base_path = pathlib.Path(path)
         if not base_path.exists():
             return jsonify({'error': 'Path does not exist'}), 404
-        
-        files = []
-        for item in base_path.iterdir():
+        # Streamed, so huge directories never sit in memory as one list
+        return stream_json(directory_entries(os.scandir(base_path)))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def list_directory(path):
+    base_path = pathlib.Path(path)
+    if not base_path.exists():
+        raise FileNotFoundError(path)
+    return list(directory_entries(os.scandir(base_path)))
+
+def directory_entries(entries):
+    # Takes an os.scandir() iterator, which is opened (and fails) before
+    # the first byte is streamed and carries file types without extra stats
+    with entries:
+        for item in entries:
             try:
                 stat = item.stat()
-                files.append({
+                entry = {
                     'name': item.name,
-                    'path': str(item),
+                    'path': item.path,
                     'type': 'directory' if item.is_dir() else 'file',
                     'size': stat.st_size if item.is_file() else None,
                     'modified': datetime.fromtimestamp(stat.st_mtime).isoformat()
-                })
+                }
+                if entry['type'] == 'file' and media_kind(item.name):
+                    # Versioned URL, so the browser can cache it as immutable
+                    entry['thumbnail'] = thumbnail_url(item.path, cache_key(item.path, stat, 256))
+                yield entry
             except Exception:
                 continue
-        
-        return jsonify(files)
-    except Exception as e:
+
+def share_for_path(db, path, resolved=False):
+    # The innermost share containing path, or None. With resolved, path has
+    # already been resolved as the caller means to use it.
+    if not resolved:
+        path = os.path.realpath(path)
+    best = None
+    for share in db.execute('SELECT * FROM shares').fetchall():
+        root = os.path.realpath(share['path'])
+        if (path == root or path.startswith(root.rstrip(os.sep) + os.sep)) and \
+                (best is None or len(root) > len(os.path.realpath(best['path']))):
+            best = share
+    return best
+
+@app.route('/api/files', methods=['DELETE'])
+@jwt_required()
+def delete_file():
+    current_user = get_jwt_identity()
+    path = request.args.get('path', '')
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if user['role'] != 'admin' and 'delete_files' not in user['permissions'].split(','):
+            return jsonify({'error': 'Unauthorized'}), 403
+        # Resolve the parent only, so deleting a symlink moves the link
+        # itself; the share is picked from that same path
+        name = os.path.basename(path.rstrip(os.sep))
+        if name:
+            path = os.path.join(os.path.realpath(os.path.dirname(path.rstrip(os.sep))), name)
+        share = share_for_path(db, path, resolved=True) if name else None
+    if share is None:
+        return jsonify({'error': 'Only files inside a share can be deleted'}), 400
+    relative = os.path.relpath(path, os.path.realpath(share['path']))
+    if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        return jsonify({'error': 'Only files inside a share can be deleted'}), 400
+    if relative == '.' or relative.split(os.sep)[0] == TRASH_DIR:
+        return jsonify({'error': 'Cannot delete the share root or its recycle bin'}), 400
+    if not os.path.lexists(path):
+        return jsonify({'error': 'Path does not exist'}), 404
+    try:
+        item = recycle_bin.delete(share, path, user['id'])
+    except OSError as e:
+        return jsonify({'error': f"Could not move to the recycle bin: {e.strerror or e}"}), 409
+    log_activity(user['id'], 'delete_file', f"Moved {path} to the recycle bin of share {share['name']}")
+    return jsonify(recycle_item_to_dict(item))
+
+def file_write_target(db, user, path):
+    # (share, error) for a path the user wants to write to
+    if user['role'] != 'admin' and 'write_files' not in user['permissions'].split(','):
+        return None, 'Unauthorized'
+    share = share_for_path(db, path) if path else None
+    if share is None:
+        return None, f"{path or 'Path'} is not inside a share"
+    if share['read_only']:
+        return None, f"Share {share['name']} is read-only"
+    relative = os.path.relpath(os.path.realpath(path), os.path.realpath(share['path']))
+    if relative.split(os.sep)[0] == TRASH_DIR:
+        return None, 'Cannot write into the recycle bin'
+    return share, None
+
+def quota_headroom(db, user_id, path):
+    # (quota ids covering path, bytes left under the tightest hard limit)
+    path = os.path.realpath(path)
+    quotas = []
+    for quota in db.execute('SELECT * FROM quotas WHERE user_id = ?', (user_id,)).fetchall():
+        root = os.path.realpath(quota['path'])
+        if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+            quotas.append(quota)
+    headroom = min((q['hard_limit'] - (q['used_space'] or 0) for q in quotas if q['hard_limit']), default=None)
+    return [q['id'] for q in quotas], headroom
+
+def run_archive_job(job, user_id, quota_ids, action, fn, *args, **kwargs):
+    stats = fn(*args, job=job, **kwargs)
+    if quota_ids and stats['bytes']:
+        with get_db() as db:
+            db.execute(f"UPDATE quotas SET used_space = COALESCE(used_space, 0) + ?, updated_at = CURRENT_TIMESTAMP "
+                       f"WHERE id IN ({','.join('?' * len(quota_ids))})", [stats['bytes'], *quota_ids])
+            db.commit()
+    log_activity(user_id, action, f"{job.params['destination']}: {stats['files']} files, {stats['bytes']} bytes")
+    return stats
+
+def start_archive_job(user, kind, destination, params, fn, *args, **kwargs):
+    # Returns (job, None, None) or (None, error message, HTTP status)
+    with get_db() as db:
+        quota_ids, headroom = quota_headroom(db, user['id'], destination)
+    if headroom is not None and headroom <= 0:
+        return None, 'Quota exceeded', 507
+    if any(job.params.get('destination') == destination for job in jobs.running(kind)):
+        return None, f"{destination} is already being written by another job", 409
+    job = jobs.submit(kind, run_archive_job, user['id'], quota_ids, kind, fn, *args, limit=headroom,
+                      params=dict(params, destination=destination), user_id=user['id'], **kwargs)
+    return job, None, None
+
+@app.route('/api/files/extract', methods=['POST'])
+@jwt_required()
+def extract_archive():
+    data = request.get_json(silent=True) or {}
+    archive = data.get('archive', '')
+    if not archive or not os.path.isfile(archive):
+        return jsonify({'error': 'archive must be an existing file'}), 400
+    if archives.archive_format(archive) is None:
+        return jsonify({'error': 'Only .zip and .tar (gz, bz2, xz) archives can be extracted'}), 400
+    # Defaults to a folder named after the archive, next to it
+    stem = os.path.basename(archive)
+    for suffix in ('.tar.gz', '.tar.bz2', '.tar.xz', '.tgz', '.tbz2', '.txz', '.tar', '.zip'):
+        if stem.lower().endswith(suffix):
+            stem = stem[:-len(suffix)]
+            break
+    destination = os.path.realpath(data.get('destination') or os.path.join(os.path.dirname(archive), stem))
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (get_jwt_identity(),)).fetchone()
+        if share_for_path(db, archive) is None and user['role'] != 'admin':
+            return jsonify({'error': 'archive is not inside a share'}), 400
+        share, error = file_write_target(db, user, destination)
+    if share is None:
+        return jsonify({'error': error}), 403 if error == 'Unauthorized' else 400
+    if os.path.exists(destination) and not os.path.isdir(destination):
+        return jsonify({'error': 'destination exists and is not a directory'}), 409
+    try:
+        declared = archives.declared_size(archive)
+    except (OSError, ValueError) as e:
+        return jsonify({'error': f"Cannot read archive: {e}"}), 400
+    if declared is not None and declared > shutil.disk_usage(share['path']).free:
+        return jsonify({'error': 'Not enough free space to extract the archive'}), 507
+
+    job, error, status = start_archive_job(user, 'extract', destination, {'archive': archive},
+                                           archives.extract, archive, destination,
+                                           overwrite=bool(data.get('overwrite')))
+    if job is None:
+        return jsonify({'error': error}), status
+    log_activity(user['id'], 'extract', f"Extracting {archive} to {destination}")
+    return jsonify(job.to_dict()), 202
+
+@app.route('/api/files/compress', methods=['POST'])
+@jwt_required()
+def compress_files():
+    data = request.get_json(silent=True) or {}
+    paths = data.get('paths')
+    destination = data.get('destination', '')
+    if not isinstance(paths, list) or not paths or not all(isinstance(p, str) and p for p in paths):
+        return jsonify({'error': 'paths must be a non-empty list'}), 400
+    fmt = data.get('format') or next((f for f in archives.FORMATS if destination.lower().endswith('.' + f)), None)
+    if fmt not in archives.FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(archives.FORMATS)}"}), 400
+    if not destination.lower().endswith('.' + fmt):
+        destination += '.' + fmt
+    destination = os.path.join(os.path.realpath(os.path.dirname(destination)), os.path.basename(destination))
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (get_jwt_identity(),)).fetchone()
+        share, error = file_write_target(db, user, destination)
+        if share is not None and user['role'] != 'admin':
+            outside = [p for p in paths if share_for_path(db, p) is None]
+            if outside:
+                return jsonify({'error': f"{outside[0]} is not inside a share"}), 400
+    if share is None:
+        return jsonify({'error': error}), 403 if error == 'Unauthorized' else 400
+    missing = [p for p in paths if not os.path.lexists(p)]
+    if missing:
+        return jsonify({'error': f"{missing[0]} does not exist"}), 404
+    if not os.path.isdir(os.path.dirname(destination)):
+        return jsonify({'error': 'The destination folder does not exist'}), 400
+    if os.path.lexists(destination) and not data.get('overwrite'):
+        return jsonify({'error': 'destination already exists'}), 409
+
+    job, error, status = start_archive_job(user, 'compress', destination, {'paths': paths, 'format': fmt},
+                                           archives.compress, [os.path.realpath(p) for p in paths],
+                                           destination, fmt, workers=app.config['COMPRESS_WORKERS'])
+    if job is None:
+        return jsonify({'error': error}), status
+    log_activity(user['id'], 'compress', f"Compressing {len(paths)} items into {destination}")
+    return jsonify(job.to_dict()), 202
+
+def recycle_item_to_dict(item):
+    return {
+        'id': item['id'],
+        'shareId': item['share_id'],
+        'originalPath': item['original_path'],
+        'isDir': bool(item['is_dir']),
+        'size': item['size'],
+        'deletedBy': item['deleted_by'],
+        'deletedAt': item['deleted_at'],
+        'status': item['status'],
+        'lastError': item['last_error']
+    }
+
+def can_manage_recycle_bin(user):
+    return user['role'] == 'admin' or 'delete_files' in user['permissions'].split(',')
+
+@app.route('/api/recycle-bin', methods=['GET'])
+@jwt_required()
+def get_recycle_bin():
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if not can_manage_recycle_bin(user):
+            return jsonify({'error': 'Unauthorized'}), 403
+        # Newest first, paged by id like the user directory
+        where, params = ["status = 'trashed'"], []
+        if request.args.get('shareId'):
+            where.append('share_id = ?')
+            params.append(request.args.get('shareId', type=int))
+        if request.args.get('cursor'):
+            where.append('id < ?')
+            params.append(request.args.get('cursor', type=int))
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 500)
+        items = db.execute(f'''
+            SELECT * FROM recycle_bin WHERE {' AND '.join(where)} ORDER BY id DESC LIMIT ?
+        ''', params + [limit + 1]).fetchall()
+        usage = db.execute('''
+            SELECT share_id, COUNT(*) AS items, SUM(size) AS bytes FROM recycle_bin
+            WHERE status = 'trashed' GROUP BY share_id
+        ''').fetchall()
+    response = jsonify({
+        'items': [recycle_item_to_dict(item) for item in items[:limit]],
+        'usage': {row['share_id']: {'items': row['items'], 'bytes': row['bytes']} for row in usage}
+    })
+    if len(items) > limit:
+        response.headers['X-Next-Cursor'] = str(items[limit - 1]['id'])
+    return response
+
+@app.route('/api/recycle-bin/<int:item_id>/restore', methods=['POST'])
+@jwt_required()
+def restore_recycle_item(item_id):
+    current_user = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if not can_manage_recycle_bin(user):
+            return jsonify({'error': 'Unauthorized'}), 403
+        item = db.execute("SELECT * FROM recycle_bin WHERE id = ? AND status = 'trashed'", (item_id,)).fetchone()
+        if not item:
+            return jsonify({'error': 'Item not found'}), 404
+        target = data.get('path')
+        if target and share_for_path(db, target) is None:
+            return jsonify({'error': 'Files can only be restored inside a share'}), 400
+    try:
+        target = recycle_bin.restore(item, target)
+    except FileExistsError:
+        return jsonify({'error': 'Something already exists at the original path; restore to another path'}), 409
+    except OSError as e:
         return jsonify({'error': str(e)}), 500
+    log_activity(user['id'], 'restore_file', f"Restored {target} from the recycle bin")
+    return jsonify({'message': 'Restored', 'path': target})
+
+@app.route('/api/recycle-bin/<int:item_id>', methods=['DELETE'])
+@jwt_required()
+def purge_recycle_item(item_id):
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if not can_manage_recycle_bin(user):
+            return jsonify({'error': 'Unauthorized'}), 403
+        item = db.execute("SELECT * FROM recycle_bin WHERE id = ? AND status = 'trashed'", (item_id,)).fetchone()
+        if not item:
+            return jsonify({'error': 'Item not found'}), 404
+    # Removal happens in the background purger
+    recycle_bin.purge(item_id)
+    log_activity(user['id'], 'purge_file', f"Permanently deleting {item['original_path']}")
+    return jsonify({'message': 'Queued for permanent deletion'}), 202
+
+@app.route('/api/jobs', methods=['GET'])
+@jwt_required()
+def get_jobs():
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+    kind = request.args.get('kind')
+    return jsonify([job.to_dict() for job in jobs.list(kind)
+                    if user['role'] == 'admin' or job.user_id == user['id']])
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_job(job_id):
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+    job = jobs.get(job_id)
+    if not job or (user['role'] != 'admin' and job.user_id != user['id']):
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+@jwt_required()
+def cancel_job(job_id):
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+    job = jobs.get(job_id)
+    if not job or (user['role'] != 'admin' and job.user_id != user['id']):
+        return jsonify({'error': 'Job not found'}), 404
+    jobs.cancel(job_id)
+    log_activity(user['id'], 'cancel_job', f"Cancelled {job.kind} job {job_id}")
+    return jsonify(job.to_dict())
+
+_thumbnail_cache = None
+
+def get_thumbnail_cache():
+    global _thumbnail_cache
+    if _thumbnail_cache is None:
+        _thumbnail_cache = ThumbnailCache(
+            app.config['THUMBNAIL_CACHE_DIR'],
+            app.config['THUMBNAIL_CACHE_BYTES']
+        )
+    return _thumbnail_cache
+
+def thumbnail_url(path, key, size=256):
+    return f"/api/thumbnails?path={quote(path)}&size={size}&v={key}"
+
+@app.route('/api/thumbnails', methods=['GET'])
+@jwt_required()
+def get_thumbnail():
+    path = request.args.get('path', '')
+    size = request.args.get('size', 256, type=int)
+    if size not in THUMBNAIL_SIZES:
+        return jsonify({'error': f'Size must be one of {list(THUMBNAIL_SIZES)}'}), 400
+    if not media_kind(path):
+        return jsonify({'error': 'Unsupported media type'}), 400
+    try:
+        key = cache_key(path, os.stat(path), size)
+    except OSError:
+        return jsonify({'error': 'Path does not exist'}), 404
+
+    # Answer revalidation without touching the cache or the pool
+    if request.if_none_match.contains(key):
+        response = app.response_class(status=304)
+    else:
+        try:
+            key, thumb_path = get_thumbnail_cache().get(path, size)
+        except Exception as e:
+            return jsonify({'error': f'Thumbnail generation failed: {e}'}), 500
+        if not thumb_path:
+            return jsonify({'error': 'Thumbnail generation failed'}), 500
+        response = send_file(thumb_path, mimetype='image/jpeg', conditional=False, etag=False)
+
+    response.set_etag(key)
+    if request.args.get('v') == key:
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/thumbnails/prefetch', methods=['POST'])
+@jwt_required()
+def prefetch_thumbnails():
+    data = request.get_json() or {}
+    size = data.get('size', 256)
+    if size not in THUMBNAIL_SIZES:
+        return jsonify({'error': f'Size must be one of {list(THUMBNAIL_SIZES)}'}), 400
+
+    paths = data.get('paths')
+    if paths is not None:
+        if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+            return jsonify({'error': 'paths must be a list of strings'}), 400
+    else:
+        # A page of the directory listing, in name order
+        try:
+            offset = int(data.get('offset', 0))
+            limit = min(int(data.get('limit', 100)), 500)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'offset and limit must be integers'}), 400
+        if offset < 0 or limit < 0:
+            return jsonify({'error': 'offset and limit must not be negative'}), 400
+        directory = pathlib.Path(data.get('path', '/'))
+        if not directory.is_dir():
+            return jsonify({'error': 'Path does not exist'}), 404
+        names = sorted(entry.name for entry in os.scandir(directory)
+                       if entry.is_file() and media_kind(entry.name))
+        paths = [str(directory / name) for name in names[offset:offset + limit]]
+
+    keys = get_thumbnail_cache().prefetch(paths[:500], size)
+    return jsonify({
+        'queued': len(keys),
+        'thumbnails': {path: thumbnail_url(path, key, size) for path, key in keys.items()}
+    }), 202
+
+@app.route('/api/thumbnails/stats', methods=['GET'])
+@jwt_required()
+def thumbnail_stats():
+    return jsonify(get_thumbnail_cache().stats())
 
 @app.route('/api/shares', methods=['GET'])
 @jwt_required()
@@ -366,31 +1289,46 @@ def get_shares():
     current_user = get_jwt_identity()
     with get_db() as db:
         user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
-        if user['role'] == 'admin':
-            shares = db.execute('''
-                SELECT s.*, u.username as creator
-                FROM shares s
-                JOIN users u ON s.created_by = u.id
-            ''').fetchall()
-        else:
-            shares = db.execute('''
-                SELECT s.*, u.username as creator
-                FROM shares s
-                JOIN users u ON s.created_by = u.id
-                WHERE s.is_public = 1 OR s.allowed_users LIKE ?
-            ''', (f'%{current_user}%',)).fetchall()
-        
-        return jsonify([{
-            'id': share['id'],
-            'name': share['name'],
-            'path': share['path'],
-            'description': share['description'],
-            'creator': share['creator'],
-            'createdAt': share['created_at'],
-            'isPublic': bool(share['is_public']),
-            'allowedUsers': share['allowed_users'].split(',') if share['allowed_users'] else [],
-            'readOnly': bool(share['read_only'])
-        } for share in shares])
+        return jsonify(shares_data(db, user))
+
+def shares_data(db, user):
+    if user['role'] == 'admin':
+        shares = db.execute('''
+            SELECT s.*, u.username as creator
+            FROM shares s
+            JOIN users u ON s.created_by = u.id
+        ''').fetchall()
+    else:
+        shares = db.execute('''
+            SELECT s.*, u.username as creator
+            FROM shares s
+            JOIN users u ON s.created_by = u.id
+            WHERE s.is_public = 1 OR s.allowed_users LIKE ?
+        ''', (f"%{user['username']}%",)).fetchall()
+    
+    return [{
+        'id': share['id'],
+        'name': share['name'],
+        'path': share['path'],
+        'description': share['description'],
+        'creator': share['creator'],
+        'createdAt': share['created_at'],
+        'isPublic': bool(share['is_public']),
+        'allowedUsers': share['allowed_users'].split(',') if share['allowed_users'] else [],
+        'readOnly': bool(share['read_only'])
+    } for share in shares]
+
+def share_path_error(path):
+    # Shares are exported and get recursive ownership changes, so they
+    # must sit under a configured volume root, never at / or /etc
+    if not isinstance(path, str) or not os.path.isabs(path):
+        return 'Share path must be an absolute path'
+    real = os.path.realpath(path)
+    for root in app.config['SHARE_ROOTS']:
+        root = os.path.realpath(root)
+        if real == root or real.startswith(os.path.join(root, '')):
+            return None
+    return f"Share path must be under {', '.join(app.config['SHARE_ROOTS'])}"
 
 @app.route('/api/shares', methods=['POST'])
 @jwt_required()
@@ -402,6 +1340,9 @@ def create_share():
         user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
         if user['role'] != 'admin' and 'manage_shares' not in user['permissions'].split(','):
             return jsonify({'error': 'Unauthorized'}), 403
+        error = check_share_name(data.get('name')) or share_path_error(data.get('path'))
+        if error:
+            return jsonify({'error': error}), 400
         
         try:
             cursor = db.cursor()
@@ -419,7 +1360,13 @@ def create_share():
             ))
             db.commit()
             log_activity(user['id'], 'create_share', f"Created share {data['name']}")
-            return jsonify({'message': 'Share created successfully'}), 201
+            protocol_configs.request_apply()
+            response = {'message': 'Share created successfully'}
+            if data.get('applyPermissions'):
+                share = db.execute('SELECT * FROM shares WHERE id = ?', (cursor.lastrowid,)).fetchone()
+                job, error, _ = start_share_permissions(db, share, user, data)
+                response['permissionsJob' if job else 'permissionsError'] = job.to_dict() if job else error
+            return jsonify(response), 201
         except sqlite3.IntegrityError:
             return jsonify({'error': 'Share name already exists'}), 400
 
@@ -439,6 +1386,7 @@ def delete_share(share_id):
         
         db.commit()
         log_activity(user['id'], 'delete_share', f"Deleted share {share_id}")
+        protocol_configs.request_apply()
         return jsonify({'message': 'Share deleted successfully'}), 200
 
 @app.route('/api/shares/<int:share_id>', methods=['PUT'])
@@ -451,6 +1399,9 @@ def update_share(share_id):
         user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
         if user['role'] != 'admin' and 'manage_shares' not in user['permissions'].split(','):
             return jsonify({'error': 'Unauthorized'}), 403
+        error = check_share_name(data.get('name')) or share_path_error(data.get('path'))
+        if error:
+            return jsonify({'error': error}), 400
         
         cursor = db.cursor()
         cursor.execute('''
@@ -472,7 +1423,195 @@ def update_share(share_id):
         
         db.commit()
         log_activity(user['id'], 'update_share', f"Updated share {share_id}")
-        return jsonify({'message': 'Share updated successfully'}), 200
+        protocol_configs.request_apply()
+        response = {'message': 'Share updated successfully'}
+        if data.get('applyPermissions'):
+            share = db.execute('SELECT * FROM shares WHERE id = ?', (share_id,)).fetchone()
+            job, error, _ = start_share_permissions(db, share, user, data)
+            response['permissionsJob' if job else 'permissionsError'] = job.to_dict() if job else error
+        return jsonify(response), 200
+
+def share_permission_run_to_dict(run):
+    target = json.loads(run['target'])
+    return {
+        'id': run['id'],
+        'shareId': run['share_id'],
+        'jobId': run['job_id'],
+        'status': run['status'],
+        'uid': target['uid'],
+        'gid': target['gid'],
+        'dirMode': format(target['dirMode'], '04o'),
+        'fileMode': format(target['fileMode'], '04o'),
+        'pendingDirectories': len(json.loads(run['pending'])) if run['pending'] else None,
+        'scanned': run['scanned'],
+        'changed': run['changed'],
+        'errors': run['errors'],
+        'lastError': run['last_error'],
+        'startedAt': run['started_at'],
+        'updatedAt': run['updated_at'],
+        'finishedAt': run['finished_at']
+    }
+
+def run_share_permissions(job, run_id, user_id):
+    with get_db() as db:
+        run = db.execute('''
+            SELECT r.*, s.name, s.path FROM share_permission_runs r
+            JOIN shares s ON r.share_id = s.id WHERE r.id = ?
+        ''', (run_id,)).fetchone()
+    pending = json.loads(run['pending']) if run['pending'] else None
+    # Counts carry over from earlier attempts of a resumed run
+    base = {'scanned': run['scanned'], 'changed': run['changed'], 'errors': run['errors']}
+
+    def checkpoint(state):
+        with get_db() as db:
+            db.execute('''
+                UPDATE share_permission_runs
+                SET pending = ?, scanned = ?, changed = ?, errors = ?, last_error = COALESCE(?, last_error),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (json.dumps(state['pending']), base['scanned'] + state['scanned'],
+                  base['changed'] + state['changed'], base['errors'] + state['errors'],
+                  state['lastError'], run_id))
+            db.commit()
+
+    status = 'failed'
+    try:
+        state = share_permissions.apply(run['path'], json.loads(run['target']), job, pending, checkpoint=checkpoint)
+        status = 'completed' if not state['errors'] else 'partial'
+        return {key: base[key] + state[key] for key in base}
+    finally:
+        if job.cancelled:
+            status = 'cancelled'
+        with get_db() as db:
+            db.execute('''
+                UPDATE share_permission_runs SET status = ?, finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (status, run_id))
+            db.commit()
+        log_activity(user_id, 'apply_share_permissions', f"Permission apply on share {run['name']} {status}")
+
+def start_share_permissions(db, share, user, data):
+    # Returns (job, None, None) or (None, error message, HTTP status)
+    if any(job.params.get('shareId') == share['id'] for job in jobs.running('share_permissions')):
+        return None, 'A permission apply is already running for this share', 409
+    # Anyone who manages shares gets the configured owner; choosing another
+    # account is for admins
+    if user['role'] != 'admin' and (data.get('owner') is not None or data.get('group') is not None):
+        return None, 'Only admins can choose the owner and group', 403
+    error = share_path_error(share['path'])
+    if error:
+        return None, error, 400
+    try:
+        uid = share_permissions.resolve_user(data.get('owner', app.config['SHARE_OWNER']))
+        gid = share_permissions.resolve_group(data.get('group', app.config['SHARE_GROUP']))
+    except ValueError as e:
+        return None, str(e), 400
+    if not os.path.isdir(share['path']):
+        return None, 'Share path does not exist', 400
+    target = json.dumps(share_permissions.target_for(share, uid, gid), sort_keys=True)
+
+    # Pick up an interrupted run with the same target where it left off
+    run = None
+    if data.get('resume', True):
+        run = db.execute('''
+            SELECT * FROM share_permission_runs
+            WHERE share_id = ? AND status IN ('running', 'failed', 'cancelled') AND pending IS NOT NULL
+            ORDER BY id DESC LIMIT 1
+        ''', (share['id'],)).fetchone()
+        if run is not None and run['target'] != target:
+            run = None
+    if run is not None:
+        run_id = run['id']
+        db.execute("UPDATE share_permission_runs SET status = 'running', finished_at = NULL WHERE id = ?", (run_id,))
+    else:
+        run_id = db.execute('''
+            INSERT INTO share_permission_runs (share_id, target, created_by) VALUES (?, ?, ?)
+        ''', (share['id'], target, user['id'])).lastrowid
+    db.commit()
+
+    job = jobs.submit('share_permissions', run_share_permissions, run_id, user['id'],
+                      params={'shareId': share['id'], 'runId': run_id, 'resumed': run is not None},
+                      user_id=user['id'])
+    db.execute('UPDATE share_permission_runs SET job_id = ? WHERE id = ?', (job.id, run_id))
+    db.commit()
+    log_activity(user['id'], 'apply_share_permissions',
+                 f"{'Resumed' if run is not None else 'Started'} permission apply on share {share['name']}")
+    return job, None, None
+
+@app.route('/api/shares/<int:share_id>/permissions', methods=['GET'])
+@jwt_required()
+def get_share_permissions(share_id):
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if user['role'] != 'admin' and 'manage_shares' not in user['permissions'].split(','):
+            return jsonify({'error': 'Unauthorized'}), 403
+        runs = db.execute('''
+            SELECT * FROM share_permission_runs WHERE share_id = ? ORDER BY id DESC LIMIT 20
+        ''', (share_id,)).fetchall()
+    return jsonify([share_permission_run_to_dict(run) for run in runs])
+
+@app.route('/api/shares/<int:share_id>/permissions/apply', methods=['POST'])
+@jwt_required()
+def apply_share_permissions(share_id):
+    current_user = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if user['role'] != 'admin' and 'manage_shares' not in user['permissions'].split(','):
+            return jsonify({'error': 'Unauthorized'}), 403
+        share = db.execute('SELECT * FROM shares WHERE id = ?', (share_id,)).fetchone()
+        if not share:
+            return jsonify({'error': 'Share not found'}), 404
+        job, error, status = start_share_permissions(db, share, user, data)
+    if job is None:
+        return jsonify({'error': error}), status
+    return jsonify(job.to_dict()), 202
+
+def run_dedupe_scan(job, user_id):
+    with get_db() as db:
+        shares = db.execute('SELECT id, name, path FROM shares ORDER BY id').fetchall()
+        report = dedupe.scan(db, shares, job)
+        db.execute('''
+        INSERT INTO dedupe_reports (created_by, reclaimable_bytes, report)
+        VALUES (?, ?, ?)
+        ''', (user_id, report['reclaimableBytes'], json.dumps(report)))
+        db.commit()
+    log_activity(user_id, 'dedupe_scan',
+                 f"Found {report['duplicateGroups']} duplicate groups, {report['reclaimableBytes']} bytes reclaimable")
+    return {'duplicateGroups': report['duplicateGroups'], 'reclaimableBytes': report['reclaimableBytes']}
+
+@app.route('/api/dedupe/scan', methods=['POST'])
+@jwt_required()
+def start_dedupe_scan():
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if not can_manage_system(user):
+            return jsonify({'error': 'Unauthorized'}), 403
+
+    running = jobs.running('dedupe_scan')
+    if running:
+        return jsonify({'error': 'A dedupe scan is already running', 'job': running[0].to_dict()}), 409
+    job = jobs.submit('dedupe_scan', run_dedupe_scan, user['id'], user_id=user['id'])
+    log_activity(user['id'], 'start_dedupe_scan', f"Started dedupe scan {job.id}")
+    return jsonify(job.to_dict()), 202
+
+@app.route('/api/dedupe/report', methods=['GET'])
+@jwt_required()
+def get_dedupe_report():
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if not can_manage_system(user):
+            return jsonify({'error': 'Unauthorized'}), 403
+
+        row = db.execute('SELECT * FROM dedupe_reports ORDER BY id DESC LIMIT 1').fetchone()
+        if not row:
+            return jsonify({'error': 'No dedupe report yet'}), 404
+        report = json.loads(row['report'])
+        report['createdAt'] = row['created_at']
+        return jsonify(report)
 
 @app.route('/api/backups', methods=['GET'])
 @jwt_required()
@@ -552,36 +1691,109 @@ def delete_backup(backup_id):
         if cursor.rowcount == 0:
             return jsonify({'error': 'Backup not found'}), 404
         
-        db.commit()
-        log_activity(user['id'], 'delete_backup', f"Deleted backup {backup_id}")
-        return jsonify({'message': 'Backup deleted successfully'}), 200
+        db.commit()
+        log_activity(user['id'], 'delete_backup', f"Deleted backup {backup_id}")
+        return jsonify({'message': 'Backup deleted successfully'}), 200
+
+def run_backup_job(job, backup_id, kind, user_id, deep=False, confirm_removals=False):
+    with get_db() as db:
+        backup = db.execute('SELECT * FROM backups WHERE id = ?', (backup_id,)).fetchone()
+        cursor = db.cursor()
+        cursor.execute('''
+        INSERT INTO backup_runs (backup_id, kind, job_id) VALUES (?, ?, ?)
+        ''', (backup_id, kind, job.id))
+        run_id = cursor.lastrowid
+        db.commit()
+
+        # Destinations prefixed with repo: use the deduplicating repository format
+        engine = repository if repository.is_repository(backup['destination_path']) else backup_engine
+        status, result = 'failed', None
+        try:
+            if kind == 'verify':
+                result = engine.verify(db, backup, job, deep=deep)
+                status = 'ok' if result['ok'] else 'drift'
+            else:
+                if engine is backup_engine:
+                    result = engine.run(db, backup, job, confirm_removals=confirm_removals)
+                else:
+                    # Repository snapshots never remove anything
+                    result = engine.run(db, backup, job)
+                status = 'completed' if not result['errors'] else 'partial'
+                db.execute('''
+                UPDATE backups 
+                SET last_run = CURRENT_TIMESTAMP,
+                    next_run = datetime(CURRENT_TIMESTAMP, '+' || retention_days || ' days')
+                WHERE id = ?
+                ''', (backup_id,))
+            return result
+        except Exception as e:
+            result = {'error': str(e)}
+            raise
+        finally:
+            if job.cancelled:
+                status = 'cancelled'
+            db.execute('''
+            UPDATE backup_runs SET finished_at = CURRENT_TIMESTAMP, status = ?, result = ?
+            WHERE id = ?
+            ''', (status, json.dumps(result), run_id))
+            db.commit()
+            log_activity(user_id, f'{kind}_backup', f"Backup {backup_id} {kind} finished: {status}")
+
+def start_backup_job(backup_id, kind, deep=False, confirm_removals=False):
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if user['role'] != 'admin' and 'manage_backups' not in user['permissions'].split(','):
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        backup = db.execute('SELECT * FROM backups WHERE id = ?', (backup_id,)).fetchone()
+        if not backup:
+            return jsonify({'error': 'Backup not found'}), 404
+
+    if any(job.params.get('backupId') == backup_id for job in jobs.running('backup')):
+        return jsonify({'error': 'This backup is already running'}), 409
+    job = jobs.submit('backup', run_backup_job, backup_id, kind, user['id'], deep=deep,
+                      confirm_removals=confirm_removals,
+                      params={'backupId': backup_id, 'mode': kind}, user_id=user['id'])
+    log_activity(user['id'], f'{kind}_backup', f"Started {kind} of backup {backup_id}")
+    return jsonify({'message': f'Backup {kind} started successfully', 'job': job.to_dict()}), 202
 
 @app.route('/api/backups/<int:backup_id>/run', methods=['POST'])
 @jwt_required()
 def run_backup(backup_id):
+    # confirmRemovals mirrors a deletion of most of the source, which a
+    # plain run refuses in case the volume just isn't mounted
+    data = request.get_json(silent=True) or {}
+    return start_backup_job(backup_id, 'run', confirm_removals=bool(data.get('confirmRemovals', False)))
+
+@app.route('/api/backups/<int:backup_id>/verify', methods=['POST'])
+@jwt_required()
+def verify_backup(backup_id):
+    data = request.get_json(silent=True) or {}
+    return start_backup_job(backup_id, 'verify', deep=bool(data.get('deep', False)))
+
+@app.route('/api/backups/<int:backup_id>/runs', methods=['GET'])
+@jwt_required()
+def get_backup_runs(backup_id):
     current_user = get_jwt_identity()
     with get_db() as db:
         user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
         if user['role'] != 'admin' and 'manage_backups' not in user['permissions'].split(','):
             return jsonify({'error': 'Unauthorized'}), 403
         
-        backup = db.execute('SELECT * FROM backups WHERE id = ?', (backup_id,)).fetchone()
-        if not backup:
-            return jsonify({'error': 'Backup not found'}), 404
-        
-        # Here you would implement the actual backup logic
-        # For now, we'll just update the last_run timestamp
-        cursor = db.cursor()
-        cursor.execute('''
-        UPDATE backups 
-        SET last_run = CURRENT_TIMESTAMP,
-            next_run = datetime(CURRENT_TIMESTAMP, '+' || retention_days || ' days')
-        WHERE id = ?
-        ''', (backup_id,))
-        
-        db.commit()
-        log_activity(user['id'], 'run_backup', f"Ran backup {backup_id}")
-        return jsonify({'message': 'Backup started successfully'}), 200
+        runs = db.execute('''
+            SELECT * FROM backup_runs WHERE backup_id = ?
+            ORDER BY id DESC LIMIT 50
+        ''', (backup_id,)).fetchall()
+        return jsonify([{
+            'id': run['id'],
+            'kind': run['kind'],
+            'jobId': run['job_id'],
+            'startedAt': run['started_at'],
+            'finishedAt': run['finished_at'],
+            'status': run['status'],
+            'result': json.loads(run['result']) if run['result'] else None
+        } for run in runs])
 
 @app.route('/api/quotas', methods=['GET'])
 @jwt_required()
@@ -762,6 +1974,10 @@ def get_network_settings():
 def update_network_settings():
     data = request.get_json()
     with get_db() as db:
+        # Renames the host through hostnamectl
+        user = db.execute('SELECT * FROM users WHERE username = ?', (get_jwt_identity(),)).fetchone()
+        if not can_manage_system(user):
+            return jsonify({'error': 'Unauthorized'}), 403
         try:
             cursor = db.cursor()
             cursor.execute('''
@@ -780,14 +1996,14 @@ def update_network_settings():
             ))
             db.commit()
             
-            # Apply hostname change on Linux systems
-            if platform.system() == 'Linux':
-                try:
-                    subprocess.run(['hostnamectl', 'set-hostname', data['hostname']], check=True)
-                except subprocess.CalledProcessError:
-                    pass  # Ignore errors in development environment
+            # Applied in the background; the operation id can be polled
+            operation = commands.submit(
+                'set_hostname', ['hostnamectl', 'set-hostname', data['hostname']],
+                requested_by=get_jwt_identity(),
+                idempotency_key=request.headers.get('Idempotency-Key')
+            )
             
-            return jsonify({'message': 'Network settings updated successfully'})
+            return jsonify({'message': 'Network settings updated successfully', 'operationId': operation['id']})
         except sqlite3.IntegrityError:
             return jsonify({'error': 'Failed to update network settings'}), 400
 
@@ -811,8 +2027,18 @@ def get_services():
 @app.route('/api/services/<int:service_id>', methods=['PUT'])
 @jwt_required()
 def update_service(service_id):
+    current_user = get_jwt_identity()
     data = request.get_json()
     with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if not can_manage_system(user):
+            return jsonify({'error': 'Unauthorized'}), 403
+        service = db.execute('SELECT * FROM services WHERE id = ?', (service_id,)).fetchone()
+        if not service:
+            return jsonify({'error': 'Service not found'}), 404
+        errors = check_service_config(service['name'], data.get('config'))
+        if errors:
+            return jsonify({'error': 'Invalid service configuration', 'errors': errors}), 400
         try:
             cursor = db.cursor()
             cursor.execute('''
@@ -825,10 +2051,26 @@ def update_service(service_id):
                 service_id
             ))
             db.commit()
+            # Turning a service off from here is a request to stop its daemon
+            stop = service['name'] if service['enabled'] and not int(data['isEnabled']) else None
+            protocol_configs.request_apply(stop=stop)
             return jsonify({'message': 'Service updated successfully'})
         except sqlite3.IntegrityError:
             return jsonify({'error': 'Failed to update service'}), 400
 
+def service_unit(name):
+    return PROTOCOLS.get(name, {}).get('unit', name)
+
+def submit_service_action(name, action):
+    operation = commands.submit(
+        f'{name}_{action}', systemctl(action, service_unit(name)),
+        requested_by=get_jwt_identity(),
+        idempotency_key=request.headers.get('Idempotency-Key')
+    )
+    if name in PROTOCOLS and action != 'restart':
+        protocol_configs.set_state(name, action == 'start')
+    return operation
+
 @app.route('/api/services/<int:service_id>/<action>', methods=['POST'])
 @jwt_required()
 def control_service(service_id, action):
@@ -836,17 +2078,21 @@ def control_service(service_id, action):
         return jsonify({'error': 'Invalid action'}), 400
     
     with get_db() as db:
+        # Starts and stops the real daemons through systemctl
+        user = db.execute('SELECT * FROM users WHERE username = ?', (get_jwt_identity(),)).fetchone()
+        if not can_manage_system(user):
+            return jsonify({'error': 'Unauthorized'}), 403
+        service = db.execute('SELECT * FROM services WHERE id = ?', (service_id,)).fetchone()
+        if not service:
+            return jsonify({'error': 'Service not found'}), 404
         try:
-            cursor = db.cursor()
-            if action == 'start':
-                cursor.execute('UPDATE services SET enabled = 1 WHERE id = ?', (service_id,))
-            elif action == 'stop':
-                cursor.execute('UPDATE services SET enabled = 0 WHERE id = ?', (service_id,))
-            elif action == 'restart':
-                cursor.execute('UPDATE services SET enabled = 0 WHERE id = ?', (service_id,))
-                cursor.execute('UPDATE services SET enabled = 1 WHERE id = ?', (service_id,))
-            db.commit()
-            return jsonify({'message': f'Service {action}ed successfully'})
+            # Restart leaves the enabled flag alone; it's a daemon action only
+            if action != 'restart':
+                db.execute('UPDATE services SET enabled = ? WHERE id = ?', (int(action == 'start'), service_id))
+                db.commit()
+            operation = submit_service_action(service['name'], action)
+            protocol_configs.request_apply()
+            return jsonify({'message': f'Service {action} requested', 'operationId': operation['id']}), 202
         except sqlite3.IntegrityError:
             return jsonify({'error': f'Failed to {action} service'}), 400
 
@@ -889,6 +2135,9 @@ def get_settings():
 def update_system_settings():
     data = request.get_json()
     with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (get_jwt_identity(),)).fetchone()
+        if not can_manage_system(user):
+            return jsonify({'error': 'Unauthorized'}), 403
         cursor = db.cursor()
         cursor.execute('''
             INSERT OR REPLACE INTO system_settings (
@@ -903,14 +2152,14 @@ def update_system_settings():
         ))
         db.commit()
         
-        # Apply hostname change
-        if platform.system() == 'Linux':
-            try:
-                subprocess.run(['hostnamectl', 'set-hostname', data['hostname']], check=True)
-            except subprocess.CalledProcessError:
-                pass  # Ignore errors in development environment
+        # Applied in the background; the operation id can be polled
+        operation = commands.submit(
+            'set_hostname', ['hostnamectl', 'set-hostname', data['hostname']],
+            requested_by=get_jwt_identity(),
+            idempotency_key=request.headers.get('Idempotency-Key')
+        )
                 
-        return jsonify({'message': 'System settings updated successfully'})
+        return jsonify({'message': 'System settings updated successfully', 'operationId': operation['id']})
 
 @app.route('/api/settings/storage', methods=['PUT'])
 @jwt_required()
@@ -968,10 +2217,444 @@ def init_settings_db():
                 backup_schedule TEXT DEFAULT '0 0 * * *'
             )
         ''')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS io_throttle_settings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                policy TEXT NOT NULL,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        db.commit()
+
+def load_settings():
+    with get_db() as db:
+        policy = db.execute('SELECT policy FROM io_throttle_settings ORDER BY id DESC LIMIT 1').fetchone()
+    if policy:
+        io_throttle.set_policy(json.loads(policy['policy']))
+
+def smart_monitoring_enabled():
+    with get_db() as db:
+        settings = db.execute('SELECT smart_monitoring FROM storage_settings ORDER BY id DESC LIMIT 1').fetchone()
+        return bool(settings['smart_monitoring']) if settings else True
+
+# Subsystems are built by init_subsystems() from the final config, so
+# importing the app only defines routes
+disk_health = None
+raid_arrays = None
+metrics_sampler = None
+session_monitor = None
+alert_engine = None
+metrics_history = None
+password_hasher = None
+token_revocations = None
+recycle_bin = None
+commands = None
+protocol_configs = None
+federation = None
+
+def log_array_change(array, previous_state):
+    # Don't log a healthy array just because the monitor started
+    if previous_state is None and array['state'] == 'clean':
+        return
+    details = f"Array {array['name']} is {array['state']}"
+    if previous_state:
+        details += f" (was {previous_state})"
+    if array.get('layout'):
+        details += f" [{array['activeDisks']}/{array['raidDisks']}] [{array['layout']}]"
+    log_activity(None, 'raid_state_change', details)
+
+def protocol_enabled(name):
+    with get_db() as db:
+        service = db.execute('SELECT enabled FROM services WHERE name = ?', (name,)).fetchone()
+        return bool(service and service['enabled'])
+
+def share_paths():
+    with get_db() as db:
+        return {share['path'].rstrip('/'): share['name'] for share in db.execute('SELECT name, path FROM shares')}
+
+def log_protocol_apply(result):
+    summary = []
+    for name, entry in result['protocols'].items():
+        if entry['changed'] or entry['action']:
+            summary.append(f"{name}: {entry['action'] or 'no action'} ({len(entry['changed'])} files changed)")
+    summary += result['errors']
+    if summary:
+        log_activity(None, 'apply_protocol_config', '; '.join(summary))
+
+def init_subsystems():
+    global disk_health, raid_arrays, metrics_sampler, session_monitor
+    global alert_engine, metrics_history, password_hasher, token_revocations, recycle_bin
+    global commands, protocol_configs, federation
+
+    disk_health = DiskHealthMonitor(
+        FixtureCollector(app.config['SMART_FIXTURE_DIR']) if app.config['SMART_FIXTURE_DIR'] else SmartctlCollector(),
+        get_db,
+        enabled=smart_monitoring_enabled,
+        interval=app.config['SMART_POLL_INTERVAL']
+    )
+    raid_arrays = ArrayMonitor(app.config['MDSTAT_PATH'], interval=1.0, on_change=log_array_change)
+
+    metrics_sampler = MetricsSampler(interval=app.config['METRICS_INTERVAL'])
+    metrics_sampler.add_source(lambda: {
+        'raid:degraded': sum(1 for array in raid_arrays.arrays if array['degraded']),
+        'smart:failing': sum(1 for disk in disk_health.results.values() if disk.get('status') == 'failing')
+    })
+
+    session_monitor = SessionMonitor(
+        SessionFixtureSource(app.config['SESSIONS_FIXTURE_DIR']) if app.config['SESSIONS_FIXTURE_DIR'] else CommandSource(),
+        enabled=protocol_enabled,
+        share_paths=share_paths
+    )
+    # Sessions are collected on the metrics tick, so their gauges get history and alerts too
+    metrics_sampler.add_source(session_monitor.collect)
+
+    alert_notifiers = {'log': LogNotifier(log_activity)}
+    if app.config['ALERT_WEBHOOK_URL']:
+        alert_notifiers['webhook'] = WebhookNotifier(app.config['ALERT_WEBHOOK_URL'])
+    alert_engine = AlertEngine(get_db, alert_notifiers)
+    metrics_sampler.subscribe(alert_engine.on_sample)
+
+    metrics_history = RoundRobinStore(app.config['METRICS_HISTORY_DIR'])
+    metrics_sampler.subscribe(metrics_history.record)
+
+    password_hasher = user_directory.PasswordHasher(app.config['PASSWORD_HASH_WORKERS'])
+    token_revocations = RevocationList(get_db, interval=app.config['TOKEN_REVOCATION_SYNC'])
+    recycle_bin = RecycleBin(
+        get_db,
+        io_throttle,
+        max_age_days=app.config['RECYCLE_MAX_AGE_DAYS'],
+        max_bytes=app.config['RECYCLE_MAX_BYTES'],
+        interval=app.config['RECYCLE_PURGE_INTERVAL']
+    )
+    commands = CommandExecutor(
+        get_db,
+        runner=StubRunner() if app.config['COMMAND_RUNNER'] == 'stub' else SubprocessRunner(),
+        timeout=app.config['COMMAND_TIMEOUT']
+    )
+    protocol_configs = ConfigApplier(
+        get_db,
+        commands,
+        root=app.config['PROTOCOL_CONFIG_ROOT'],
+        delay=app.config['PROTOCOL_APPLY_DELAY'],
+        on_apply=log_protocol_apply
+    )
+    federation = Federation(get_db, timeout=app.config['FEDERATION_TIMEOUT'],
+                            node_timeout=app.config['FEDERATION_NODE_TIMEOUT'],
+                            cache_ttl=app.config['FEDERATION_CACHE_TTL'])
+
+def create_app(config=None):
+    # Entry point for servers and tests: apply config overrides before any
+    # subsystem reads them. Nothing here touches the database; the schema,
+    # settings and pollers come up with the first request.
+    if config:
+        app.config.update(config)
+    if commands is None:
+        init_subsystems()
+    if app.config['PROFILING'] and start_request_profile not in app.before_request_funcs.get(None, []):
+        app.before_request(start_request_profile)
+        app.after_request(finish_request_profile)
+    return app
+
+def start_request_profile():
+    # ?__profile=1 (or =tottime / =calls to change the sort) swaps the
+    # response for a cProfile report of the request
+    mode = request.args.get('__profile')
+    if not mode:
+        return None
+    verify_jwt_in_request(optional=True)
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (get_jwt_identity(),)).fetchone()
+    if user is None or not can_manage_system(user):
+        return jsonify({'error': 'Unauthorized'}), 403
+    g.request_profile = profiling.RequestProfile(mode)
+    g.request_profile.start()
+    return None
+
+def finish_request_profile(response):
+    profile = g.pop('request_profile', None)
+    if profile is None:
+        return response
+    # Streamed bodies are only produced after the view returns, so they
+    # are drained here while the profiler is still running
+    response.direct_passthrough = False
+    body = response.get_data()
+    elapsed = profile.stop()
+    header = f"{request.method} {request.path} -> {response.status}, {len(body)} bytes in {elapsed * 1000:.1f} ms\n\n"
+    return app.response_class(header + profile.report(), mimetype='text/plain')
+
+@jwt.token_in_blocklist_loader
+def token_revoked(jwt_header, jwt_payload):
+    # An in-memory set lookup; see RevocationList
+    return token_revocations.is_revoked(jwt_payload['jti'])
+
+_initialized = False
+_init_lock = threading.Lock()
+
+@app.before_request
+def initialize():
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        if commands is None:
+            init_subsystems()
+        init_schema()
+        load_settings()
+        token_revocations.start()
+        disk_health.start()
+        raid_arrays.start()
+        alert_engine.load()
+        metrics_sampler.start()
+        recycle_bin.start()
+        federation.load()
+        _initialized = True
+
+@app.route('/api/disks/health', methods=['GET'])
+@jwt_required()
+def get_disk_health():
+    # Served from the poller's cache; never runs smartctl on the request path
+    results = sorted(disk_health.results.values(), key=lambda r: r['disk'])
+    return jsonify({
+        'enabled': smart_monitoring_enabled(),
+        'pollInterval': disk_health.interval,
+        'disks': results
+    })
+
+@app.route('/api/disks/health/history', methods=['GET'])
+@jwt_required()
+def get_disk_health_history():
+    disk = request.args.get('disk')
+    if not disk:
+        return jsonify({'error': 'disk is required'}), 400
+    return jsonify(disk_health.history(
+        disk,
+        request.args.get('metric'),
+        request.args.get('since', 0, type=int)
+    ))
+
+@app.route('/api/storage/arrays', methods=['GET'])
+@jwt_required()
+def get_storage_arrays():
+    with get_db() as db:
+        settings = db.execute('SELECT raid_level, auto_repair FROM storage_settings ORDER BY id DESC LIMIT 1').fetchone()
+    return jsonify({
+        'available': raid_arrays.available,
+        'updatedAt': raid_arrays.updated_at,
+        'configuredRaidLevel': settings['raid_level'] if settings else 'RAID 1',
+        'autoRepair': bool(settings['auto_repair']) if settings else True,
+        'arrays': raid_arrays.arrays
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+@jwt_required()
+def get_metrics():
+    return jsonify({
+        'interval': metrics_sampler.interval,
+        'sampledAt': metrics_sampler.latest_at,
+        'latest': metrics_sampler.latest,
+        'history': metrics_history.metrics()
+    })
+
+@app.route('/api/metrics/history', methods=['GET'])
+@jwt_required()
+def get_metrics_history():
+    metric = request.args.get('metric', 'cpu')
+    cf = request.args.get('cf', 'avg')
+    if cf not in RRD_FIELDS:
+        return jsonify({'error': f"cf must be one of {list(RRD_FIELDS)}"}), 400
+    end = request.args.get('end', time.time(), type=float)
+    start = request.args.get('start', end - 3600, type=float)
+    points = request.args.get('points', type=int)
+    
+    history = metrics_history.query(metric, start, end, cf=cf, max_points=points)
+    if history is None:
+        return jsonify({'error': 'Unknown metric'}), 404
+    return jsonify(history)
+
+@app.route('/api/alerts', methods=['GET'])
+@jwt_required()
+def get_alerts():
+    status = request.args.get('status', 'all')
+    with get_db() as db:
+        if status == 'all':
+            alerts = db.execute('''
+                SELECT a.*, r.name AS rule_name, r.metric FROM alerts a
+                LEFT JOIN alert_rules r ON a.rule_id = r.id
+                ORDER BY a.id DESC LIMIT 100
+            ''').fetchall()
+        else:
+            alerts = db.execute('''
+                SELECT a.*, r.name AS rule_name, r.metric FROM alerts a
+                LEFT JOIN alert_rules r ON a.rule_id = r.id
+                WHERE a.status = ?
+                ORDER BY a.id DESC LIMIT 100
+            ''', (status,)).fetchall()
+        return jsonify([{
+            'id': alert['id'],
+            'ruleId': alert['rule_id'],
+            'rule': alert['rule_name'],
+            'metric': alert['metric'],
+            'status': alert['status'],
+            'severity': alert['severity'],
+            'value': alert['value'],
+            'resolvedValue': alert['resolved_value'],
+            'message': alert['message'],
+            'startedAt': alert['started_at'],
+            'resolvedAt': alert['resolved_at']
+        } for alert in alerts])
+
+def alert_rule_to_dict(rule):
+    return {
+        'id': rule['id'],
+        'name': rule['name'],
+        'metric': rule['metric'],
+        'operator': rule['operator'],
+        'threshold': rule['threshold'],
+        'duration': rule['duration'],
+        'clearThreshold': rule['clear_threshold'],
+        'aggregate': rule['aggregate'],
+        'window': rule['window'],
+        'severity': rule['severity'],
+        'notifiers': json.loads(rule['notifiers']) if rule['notifiers'] else ['log'],
+        'enabled': bool(rule['enabled'])
+    }
+
+def alert_rule_params(data):
+    if data.get('operator', '>') not in OPERATORS:
+        raise ValueError(f"operator must be one of {list(OPERATORS)}")
+    if data.get('severity', 'warning') not in SEVERITIES:
+        raise ValueError(f"severity must be one of {list(SEVERITIES)}")
+    if data.get('aggregate', 'last') not in ('last', 'avg'):
+        raise ValueError('aggregate must be last or avg')
+    if int(data.get('duration', 0)) < 0 or int(data.get('window', 0)) < 0:
+        raise ValueError('duration and window must not be negative')
+    return (
+        data['name'],
+        data['metric'],
+        data.get('operator', '>'),
+        float(data['threshold']),
+        int(data.get('duration', 0)),
+        float(data['clearThreshold']) if data.get('clearThreshold') is not None else None,
+        data.get('aggregate', 'last'),
+        int(data.get('window', 0)),
+        data.get('severity', 'warning'),
+        json.dumps(data.get('notifiers', ['log'])),
+        int(data.get('enabled', True))
+    )
+
+@app.route('/api/alert-rules', methods=['GET'])
+@jwt_required()
+def get_alert_rules():
+    with get_db() as db:
+        rules = db.execute('SELECT * FROM alert_rules ORDER BY id').fetchall()
+        return jsonify([alert_rule_to_dict(rule) for rule in rules])
+
+@app.route('/api/alert-rules', methods=['POST'])
+@jwt_required()
+def create_alert_rule():
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if not can_manage_system(user):
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        try:
+            params = alert_rule_params(request.get_json())
+        except (KeyError, ValueError, TypeError) as e:
+            return jsonify({'error': f'Invalid rule: {e}'}), 400
+        
+        cursor = db.cursor()
+        cursor.execute('''
+            INSERT INTO alert_rules (
+                name, metric, operator, threshold, duration, clear_threshold,
+                aggregate, window, severity, notifiers, enabled
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', params)
+        db.commit()
+        rule = db.execute('SELECT * FROM alert_rules WHERE id = ?', (cursor.lastrowid,)).fetchone()
+    alert_engine.load()
+    log_activity(user['id'], 'create_alert_rule', f"Created alert rule {params[0]}")
+    return jsonify(alert_rule_to_dict(rule)), 201
+
+@app.route('/api/alert-rules/<int:rule_id>', methods=['PUT'])
+@jwt_required()
+def update_alert_rule(rule_id):
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if not can_manage_system(user):
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        try:
+            params = alert_rule_params(request.get_json())
+        except (KeyError, ValueError, TypeError) as e:
+            return jsonify({'error': f'Invalid rule: {e}'}), 400
+        
+        cursor = db.cursor()
+        cursor.execute('''
+            UPDATE alert_rules
+            SET name = ?, metric = ?, operator = ?, threshold = ?, duration = ?, clear_threshold = ?,
+                aggregate = ?, window = ?, severity = ?, notifiers = ?, enabled = ?
+            WHERE id = ?
+        ''', params + (rule_id,))
+        if cursor.rowcount == 0:
+            return jsonify({'error': 'Alert rule not found'}), 404
+        db.commit()
+        rule = db.execute('SELECT * FROM alert_rules WHERE id = ?', (rule_id,)).fetchone()
+    alert_engine.load()
+    log_activity(user['id'], 'update_alert_rule', f"Updated alert rule {rule_id}")
+    return jsonify(alert_rule_to_dict(rule))
+
+@app.route('/api/alert-rules/<int:rule_id>', methods=['DELETE'])
+@jwt_required()
+def delete_alert_rule(rule_id):
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if not can_manage_system(user):
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        cursor = db.cursor()
+        cursor.execute('DELETE FROM alert_rules WHERE id = ?', (rule_id,))
+        if cursor.rowcount == 0:
+            return jsonify({'error': 'Alert rule not found'}), 404
+        db.execute('''
+            UPDATE alerts SET status = 'resolved', resolved_at = CURRENT_TIMESTAMP
+            WHERE rule_id = ? AND status = 'firing'
+        ''', (rule_id,))
         db.commit()
+    alert_engine.load()
+    log_activity(user['id'], 'delete_alert_rule', f"Deleted alert rule {rule_id}")
+    return jsonify({'message': 'Alert rule deleted successfully'})
+
+@app.route('/api/settings/io-throttle', methods=['GET'])
+@jwt_required()
+def get_io_throttle():
+    return jsonify(io_throttle.status())
 
-# Initialize settings tables
-init_settings_db()
+@app.route('/api/settings/io-throttle', methods=['PUT'])
+@jwt_required()
+def update_io_throttle():
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if not can_manage_system(user):
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        data = request.get_json()
+        try:
+            policy = validate_policy(dict(io_throttle.policy, **data))
+        except (ValueError, KeyError, TypeError) as e:
+            return jsonify({'error': f'Invalid throttle policy: {e}'}), 400
+        
+        db.execute('INSERT INTO io_throttle_settings (policy) VALUES (?)', (json.dumps(policy),))
+        db.execute('DELETE FROM io_throttle_settings WHERE id < (SELECT MAX(id) FROM io_throttle_settings)')
+        db.commit()
+        io_throttle.set_policy(policy)
+        log_activity(user['id'], 'update_io_throttle', 'Updated background I/O throttle policy')
+        return jsonify(io_throttle.status())
 
 @app.route('/api/protocols', methods=['GET'])
 def get_protocols():
@@ -1034,6 +2717,9 @@ def update_protocol_config(protocol_name):
             return jsonify({'error': 'Protocol not found'}), 404
         
         data = request.get_json()
+        errors = check_service_config(service['name'], data.get('config', {}))
+        if errors:
+            return jsonify({'error': 'Invalid protocol configuration', 'errors': errors}), 400
         
         try:
             db.execute('''
@@ -1049,6 +2735,7 @@ def update_protocol_config(protocol_name):
             db.commit()
             
             log_activity(user['id'], 'update_protocol', f"Updated {protocol_name} configuration")
+            protocol_configs.request_apply()
             return jsonify({'message': f'{protocol_name.upper()} configuration updated successfully'})
         except Exception as e:
             return jsonify({'error': str(e)}), 400
@@ -1094,11 +2781,43 @@ def control_protocol(protocol_name, action):
                 ''', (service['id'],))
             
             db.commit()
+            operation = submit_service_action(service['name'], action)
+            protocol_configs.request_apply()
             log_activity(user['id'], f'{action}_protocol', f"{action.capitalize()}ed {protocol_name} service")
-            return jsonify({'message': f'{protocol_name.upper()} service {action}ed successfully'})
+            return jsonify({
+                'message': f'{protocol_name.upper()} service {action} requested',
+                'operationId': operation['id']
+            }), 202
         except Exception as e:
             return jsonify({'error': str(e)}), 400
 
+@app.route('/api/protocols/<protocol_name>/sessions', methods=['GET'])
+@jwt_required()
+def get_protocol_sessions(protocol_name):
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if not can_manage_system(user):
+            return jsonify({'error': 'Unauthorized'}), 403
+    
+    protocol_name = protocol_name.lower()
+    if protocol_name not in SESSION_PORTS:
+        return jsonify({'error': 'Session statistics are only available for SMB and NFS'}), 404
+    
+    # Served from the sampler's last snapshot; never runs smbstatus per request
+    snapshot = session_monitor.sessions(protocol_name)
+    if snapshot is None:
+        return jsonify({
+            'protocol': protocol_name,
+            'available': False,
+            'updatedAt': None,
+            'sessions': [],
+            'clients': [],
+            'shares': [],
+            'totals': {}
+        })
+    return jsonify(snapshot)
+
 @app.route('/api/protocols/<protocol_name>/shares', methods=['GET'])
 @jwt_required()
 def get_protocol_shares(protocol_name):
@@ -1160,6 +2879,9 @@ def update_protocol_share(protocol_name, share_id):
             return jsonify({'error': 'Share not found'}), 404
         
         data = request.get_json()
+        errors = check_share_settings(service['name'], data.get('protocolConfig', {}))
+        if errors:
+            return jsonify({'error': 'Invalid share settings', 'errors': errors}), 400
         config = json.loads(service['config']) if service['config'] else {}
         
         if 'shares' not in config:
@@ -1176,9 +2898,446 @@ def update_protocol_share(protocol_name, share_id):
             
             db.commit()
             log_activity(user['id'], 'update_protocol_share', f"Updated {protocol_name} settings for share {share['name']}")
+            protocol_configs.request_apply()
             return jsonify({'message': f'Share {protocol_name.upper()} settings updated successfully'})
         except Exception as e:
             return jsonify({'error': str(e)}), 400
 
+@app.route('/api/operations', methods=['GET'])
+@jwt_required()
+def get_operations():
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if not can_manage_system(user):
+            return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify(commands.history(request.args.get('limit', 100, type=int)))
+
+@app.route('/api/operations/<operation_id>', methods=['GET'])
+@jwt_required()
+def get_operation(operation_id):
+    operation = commands.get(operation_id)
+    if operation is None:
+        return jsonify({'error': 'Operation not found'}), 404
+    return jsonify(operation)
+
+@app.route('/api/protocols/config-preview', methods=['GET'])
+@jwt_required()
+def preview_protocol_configs():
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if not can_manage_system(user):
+            return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify({
+        'dryRun': protocol_configs.dry_run,
+        'protocols': protocol_configs.preview(),
+        'lastApply': protocol_configs.last_result
+    })
+
+@app.route('/api/protocols/apply', methods=['POST'])
+@jwt_required()
+def apply_protocol_configs():
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if not can_manage_system(user):
+            return jsonify({'error': 'Unauthorized'}), 403
+    result = protocol_configs.apply()
+    return jsonify(result), 200 if not result['errors'] else 500
+
+def run_diagnostic(job, run_id, user_id, fn, *args):
+    status, result = 'failed', None
+    try:
+        result = fn(job, *args)
+        status = 'completed'
+        return result
+    except Exception as e:
+        result = {'error': str(e)}
+        raise
+    finally:
+        if job.cancelled:
+            status = 'cancelled'
+        net_benches.pop(job.id, None)
+        with get_db() as db:
+            db.execute('''
+                UPDATE diagnostics_runs SET status = ?, result = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?
+            ''', (status, json.dumps(result), run_id))
+            db.commit()
+        log_activity(user_id, 'diagnostics', f"{job.kind} {status}")
+
+def start_diagnostic(user, kind, target, params, fn, *args):
+    with get_db() as db:
+        run_id = db.execute('''
+            INSERT INTO diagnostics_runs (kind, target, params, created_by) VALUES (?, ?, ?, ?)
+        ''', (kind, target, json.dumps(params), user['id'])).lastrowid
+        db.commit()
+    job = jobs.submit(kind, run_diagnostic, run_id, user['id'], fn, *args,
+                      params=dict(params, runId=run_id), user_id=user['id'], executor=diagnostics_pool)
+    with get_db() as db:
+        db.execute('UPDATE diagnostics_runs SET job_id = ? WHERE id = ?', (job.id, run_id))
+        db.commit()
+    return job
+
+def diagnostics_run_to_dict(run):
+    return {
+        'id': run['id'],
+        'kind': run['kind'],
+        'target': run['target'],
+        'jobId': run['job_id'],
+        'status': run['status'],
+        'params': json.loads(run['params']) if run['params'] else {},
+        'result': json.loads(run['result']) if run['result'] else None,
+        'startedAt': run['started_at'],
+        'finishedAt': run['finished_at']
+    }
+
+def diagnostics_user():
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (get_jwt_identity(),)).fetchone()
+    return user if user and can_manage_system(user) else None
+
+@app.route('/api/diagnostics/disk-bench', methods=['POST'])
+@jwt_required()
+def start_disk_bench():
+    user = diagnostics_user()
+    if user is None:
+        return jsonify({'error': 'Unauthorized'}), 403
+    data = request.get_json(silent=True) or {}
+    mountpoint = data.get('mountpoint')
+    if mountpoint not in {volume['mountpoint'] for volume in volumes_data()}:
+        return jsonify({'error': 'mountpoint must be one of the volumes from /api/volumes'}), 400
+    size_mb = data.get('sizeMB', 256)
+    random_seconds = data.get('randomSeconds', 5)
+    if not isinstance(size_mb, int) or not 1 <= size_mb <= MAX_DISK_BENCH_MB:
+        return jsonify({'error': f"sizeMB must be between 1 and {MAX_DISK_BENCH_MB}"}), 400
+    if not isinstance(random_seconds, (int, float)) or not 0 < random_seconds <= 60:
+        return jsonify({'error': 'randomSeconds must be between 0 and 60'}), 400
+    # The temp file goes in the share or the volume root, whichever is writable
+    directory = data.get('directory') or mountpoint
+    if os.path.realpath(directory) != mountpoint and not os.path.realpath(directory).startswith(mountpoint.rstrip('/') + '/'):
+        return jsonify({'error': 'directory must be on the chosen volume'}), 400
+    if not os.access(directory, os.W_OK):
+        return jsonify({'error': f"{directory} is not writable"}), 400
+    if size_mb * 1024**2 > shutil.disk_usage(directory).free // 2:
+        return jsonify({'error': 'Not enough free space for the test file'}), 400
+
+    params = {'mountpoint': mountpoint, 'directory': directory, 'sizeMB': size_mb, 'randomSeconds': random_seconds}
+    job = start_diagnostic(user, 'disk_bench', mountpoint, params, diagnostics.disk_bench,
+                           directory, size_mb * 1024**2, random_seconds)
+    return jsonify(job.to_dict()), 202
+
+@app.route('/api/diagnostics/net-bench', methods=['POST'])
+@jwt_required()
+def start_net_bench():
+    # Returns the job plus the URLs the browser downloads from and uploads
+    # to; the job finishes once both transfers are done
+    user = diagnostics_user()
+    if user is None:
+        return jsonify({'error': 'Unauthorized'}), 403
+    data = request.get_json(silent=True) or {}
+    size_mb = data.get('sizeMB', 100)
+    if not isinstance(size_mb, int) or not 1 <= size_mb <= MAX_NET_BENCH_MB:
+        return jsonify({'error': f"sizeMB must be between 1 and {MAX_NET_BENCH_MB}"}), 400
+    bench = diagnostics.NetBench(size_mb * 1024**2)
+    params = {'sizeMB': size_mb, 'client': request.remote_addr}
+    job = start_diagnostic(user, 'net_bench', request.remote_addr, params, bench.wait)
+    job.update(done=0, total=2 * bench.size, message='Waiting for the client')
+    net_benches[job.id] = bench
+    return jsonify({
+        'job': job.to_dict(),
+        'downloadUrl': f"/api/diagnostics/net-bench/{job.id}/download",
+        'uploadUrl': f"/api/diagnostics/net-bench/{job.id}/upload",
+        'resultUrl': f"/api/diagnostics/net-bench/{job.id}/result"
+    }), 202
+
+def net_bench_session(job_id):
+    bench = net_benches.get(job_id)
+    job = jobs.get(job_id)
+    if bench is None or job is None or job.status not in ('queued', 'running'):
+        return None, None
+    return bench, job
+
+@app.route('/api/diagnostics/net-bench/<job_id>/download', methods=['GET'])
+@jwt_required()
+def net_bench_download(job_id):
+    bench, job = net_bench_session(job_id)
+    if bench is None:
+        return jsonify({'error': 'No such network benchmark'}), 404
+    job.update(message='Download')
+    response = app.response_class(bench.download(job), mimetype='application/octet-stream')
+    response.headers['Content-Length'] = str(bench.size)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/diagnostics/net-bench/<job_id>/upload', methods=['POST'])
+@jwt_required()
+def net_bench_upload(job_id):
+    bench, job = net_bench_session(job_id)
+    if bench is None:
+        return jsonify({'error': 'No such network benchmark'}), 404
+    job.update(message='Upload')
+    received = bench.upload(job, request.stream)
+    return jsonify({'receivedBytes': received, 'uploadMBps': bench.result['uploadMBps']})
+
+@app.route('/api/diagnostics/net-bench/<job_id>/result', methods=['POST'])
+@jwt_required()
+def net_bench_result(job_id):
+    bench, job = net_bench_session(job_id)
+    if bench is None:
+        return jsonify({'error': 'No such network benchmark'}), 404
+    data = request.get_json(silent=True) or {}
+    bench.report({key: data[key] for key in ('downloadMBps', 'uploadMBps', 'latencyMs', 'userAgent')
+                  if isinstance(data.get(key), (int, float, str))})
+    return jsonify({'message': 'Recorded'})
+
+@app.route('/api/diagnostics/runs', methods=['GET'])
+@jwt_required()
+def get_diagnostics_runs():
+    if diagnostics_user() is None:
+        return jsonify({'error': 'Unauthorized'}), 403
+    kind = request.args.get('kind')
+    with get_db() as db:
+        if kind:
+            runs = db.execute('SELECT * FROM diagnostics_runs WHERE kind = ? ORDER BY id DESC LIMIT 100', (kind,)).fetchall()
+        else:
+            runs = db.execute('SELECT * FROM diagnostics_runs ORDER BY id DESC LIMIT 100').fetchall()
+    return jsonify([diagnostics_run_to_dict(run) for run in runs])
+
+def federation_user():
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (get_jwt_identity(),)).fetchone()
+    return user if user and can_manage_system(user) else None
+
+@app.route('/api/federation/nodes', methods=['GET'])
+@jwt_required()
+def get_federation_nodes():
+    if federation_user() is None:
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify([node.to_dict() for node in federation.nodes.values()])
+
+@app.route('/api/federation/nodes', methods=['POST'])
+@jwt_required()
+def register_federation_node():
+    # The peer's credentials are used once to log in and are not stored
+    user = federation_user()
+    if user is None:
+        return jsonify({'error': 'Unauthorized'}), 403
+    data = request.get_json(silent=True) or {}
+    missing = [key for key in ('name', 'url', 'username', 'password') if not data.get(key)]
+    if missing:
+        return jsonify({'error': f"Missing {', '.join(missing)}"}), 400
+    try:
+        node = federation.register(data['name'], data['url'], data['username'], data['password'], user['id'])
+    except sqlite3.IntegrityError:
+        return jsonify({'error': 'A node with that name or URL is already registered'}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except (NodeError, OSError) as e:
+        return jsonify({'error': f"Could not reach the node: {e}"}), 502
+    log_activity(user['id'], 'register_node', f"Registered node {node.name} at {node.url}")
+    return jsonify(node.to_dict()), 201
+
+@app.route('/api/federation/nodes/<int:node_id>/login', methods=['POST'])
+@jwt_required()
+def relogin_federation_node(node_id):
+    # For a node whose refresh token was rejected; as with registering, the
+    # credentials are used once and not stored
+    user = federation_user()
+    if user is None:
+        return jsonify({'error': 'Unauthorized'}), 403
+    if node_id not in federation.nodes:
+        return jsonify({'error': 'Node not found'}), 404
+    data = request.get_json(silent=True) or {}
+    missing = [key for key in ('username', 'password') if not data.get(key)]
+    if missing:
+        return jsonify({'error': f"Missing {', '.join(missing)}"}), 400
+    try:
+        node = federation.relogin(node_id, data['username'], data['password'])
+    except (NodeError, OSError) as e:
+        return jsonify({'error': f"Could not log in to the node: {e}"}), 502
+    log_activity(user['id'], 'relogin_node', f"Logged in to node {node.name} again")
+    return jsonify(node.to_dict())
+
+@app.route('/api/federation/nodes/<int:node_id>', methods=['DELETE'])
+@jwt_required()
+def remove_federation_node(node_id):
+    user = federation_user()
+    if user is None:
+        return jsonify({'error': 'Unauthorized'}), 403
+    node = federation.nodes.get(node_id)
+    if node is None:
+        return jsonify({'error': 'Node not found'}), 404
+    federation.remove(node_id)
+    log_activity(user['id'], 'remove_node', f"Removed node {node.name}")
+    return jsonify({'message': 'Node removed'})
+
+@app.route('/api/federation/<view>', methods=['GET'])
+@jwt_required()
+def get_federated_view(view):
+    # This node's answer comes from the same route, dispatched in-process
+    # with the caller's token, next to the peers' answers
+    if view not in FEDERATION_VIEWS:
+        return jsonify({'error': f"view must be one of {', '.join(FEDERATION_VIEWS)}"}), 404
+    if federation_user() is None:
+        return jsonify({'error': 'Unauthorized'}), 403
+    local = sub_requests.submit(run_sub_request, FEDERATION_VIEWS[view],
+                                 {'Authorization': request.headers.get('Authorization', '')})
+    peers = federation.query(view)
+    status, body = local.result()
+    return jsonify({
+        'view': view,
+        'local': {'status': 'ok' if status == 200 else 'error', 'error': None if status == 200 else body,
+                  'data': body if status == 200 else None},
+        'nodes': peers
+    })
+
+@app.route('/api/config/export', methods=['GET'])
+@jwt_required()
+def export_config():
+    current_user = get_jwt_identity()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if not can_manage_system(user):
+            return jsonify({'error': 'Unauthorized'}), 403
+    now = datetime.now()
+
+    def generate():
+        with get_db() as db:
+            # One read transaction, so every section comes from the same state
+            db.execute('BEGIN')
+            yield from config_snapshot.iter_export(db, now.isoformat(timespec='seconds'), SCHEMA_VERSION)
+            db.rollback()
+
+    log_activity(user['id'], 'export_config', 'Exported the configuration')
+    response = app.response_class(generate(), mimetype='application/json')
+    response.headers['Content-Disposition'] = f'attachment; filename="flexnas-config-{now:%Y%m%d-%H%M%S}.json"'
+    return response
+
+@app.route('/api/config/import', methods=['POST'])
+@jwt_required()
+def import_config():
+    # Validates the snapshot, diffs it against the current rows and applies
+    # only the differences, all in one transaction. ?dryRun=1 returns the
+    # diff without changing anything; ?prune=1 also deletes rows the
+    # snapshot doesn't have.
+    current_user = get_jwt_identity()
+    snapshot = request.get_json(silent=True)
+    if snapshot is None:
+        return jsonify({'error': 'Body must be a JSON config snapshot'}), 400
+    dry_run = request.args.get('dryRun') in ('1', 'true')
+    prune = request.args.get('prune') in ('1', 'true')
+    started = time.perf_counter()
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (current_user,)).fetchone()
+        if not can_manage_system(user):
+            return jsonify({'error': 'Unauthorized'}), 403
+        # Taken before the diff, so nothing can change between diff and apply
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            sections = config_snapshot.validate(db, snapshot, share_path_error)
+            plan = config_snapshot.diff(db, sections, prune)
+            if not dry_run:
+                config_snapshot.apply(db, plan, user['id'])
+        except config_snapshot.InvalidSnapshot as e:
+            db.rollback()
+            return jsonify({'error': 'Invalid config snapshot', 'errors': e.errors[:100]}), 400
+        except sqlite3.Error as e:
+            db.rollback()
+            return jsonify({'error': f"Import failed and nothing was changed: {e}"}), 409
+        if dry_run:
+            db.rollback()
+        else:
+            db.commit()
+
+    changes = config_snapshot.summary(plan)
+    total = sum(c['create'] + c['update'] + c['delete'] for c in changes.values())
+    if not dry_run and total:
+        if any(changes.get(table, {}).get(kind) for table in ('shares', 'services') for kind in ('create', 'update', 'delete')):
+            protocol_configs.request_apply()
+        log_activity(user['id'], 'import_config', ', '.join(
+            f"{table}: {c['create']} created, {c['update']} updated, {c['delete']} deleted"
+            for table, c in changes.items() if c['create'] or c['update'] or c['delete']))
+    return jsonify({
+        'dryRun': dry_run,
+        'prune': prune,
+        'changed': total,
+        'changes': changes,
+        'elapsedMs': round((time.perf_counter() - started) * 1000, 1)
+    })
+
+def profiling_user():
+    # (user, None) or (None, error response)
+    if not app.config['PROFILING']:
+        return None, (jsonify({'error': 'Profiling is disabled'}), 404)
+    with get_db() as db:
+        user = db.execute('SELECT * FROM users WHERE username = ?', (get_jwt_identity(),)).fetchone()
+    if not can_manage_system(user):
+        return None, (jsonify({'error': 'Unauthorized'}), 403)
+    return user, None
+
+def run_process_profile(job, seconds, interval, path):
+    counts = profiling.sample(job, seconds, interval)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(profiling.collapsed(counts))
+    return {
+        'file': os.path.basename(path),
+        'samples': sum(counts.values()),
+        'stacks': len(counts),
+        'top': profiling.top_frames(counts)
+    }
+
+@app.route('/api/profiling/sample', methods=['POST'])
+@jwt_required()
+def start_process_profile():
+    user, error = profiling_user()
+    if user is None:
+        return error
+    data = request.get_json(silent=True) or {}
+    seconds = data.get('seconds', 30)
+    interval_ms = data.get('intervalMs', 5)
+    if not isinstance(seconds, (int, float)) or not 0 < seconds <= MAX_PROFILE_SECONDS:
+        return jsonify({'error': f"seconds must be between 0 and {MAX_PROFILE_SECONDS}"}), 400
+    if not isinstance(interval_ms, (int, float)) or not 1 <= interval_ms <= 1000:
+        return jsonify({'error': 'intervalMs must be between 1 and 1000'}), 400
+    running = jobs.running('process_profile')
+    if running:
+        return jsonify({'error': 'A profile is already being captured', 'job': running[0].to_dict()}), 409
+    name = datetime.now().strftime('profile-%Y%m%d-%H%M%S.folded')
+    path = os.path.join(os.path.abspath(app.config['PROFILE_DIR']), name)
+    job = jobs.submit('process_profile', run_process_profile, seconds, interval_ms / 1000, path,
+                      params={'seconds': seconds, 'intervalMs': interval_ms, 'file': name},
+                      user_id=user['id'], executor=profiling_pool)
+    job.update(total=seconds, message='Sampling')
+    log_activity(user['id'], 'process_profile', f"Sampling the process for {seconds} s into {name}")
+    return jsonify(job.to_dict()), 202
+
+@app.route('/api/profiling/samples', methods=['GET'])
+@jwt_required()
+def list_process_profiles():
+    user, error = profiling_user()
+    if user is None:
+        return error
+    directory = app.config['PROFILE_DIR']
+    names = sorted((name for name in os.listdir(directory) if name.endswith('.folded')), reverse=True) \
+        if os.path.isdir(directory) else []
+    return jsonify([{
+        'file': name,
+        'size': os.path.getsize(os.path.join(directory, name)),
+        'createdAt': datetime.fromtimestamp(os.path.getmtime(os.path.join(directory, name))).isoformat()
+    } for name in names])
+
+@app.route('/api/profiling/samples/<name>', methods=['GET'])
+@jwt_required()
+def download_process_profile(name):
+    user, error = profiling_user()
+    if user is None:
+        return error
+    path = os.path.join(os.path.abspath(app.config['PROFILE_DIR']), name)
+    if os.path.basename(name) != name or not name.endswith('.folded') or not os.path.isfile(path):
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=name)
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000) 
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=5000) 
\ No newline at end of file
@@ -0,0 +1,392 @@
+import os
+import shutil
+import stat as stat_module
+import struct
+import tarfile
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK = 1024 * 1024
+GZIP_BLOCK = 1024 * 1024
+GZIP_LEVEL = 6
+FORMATS = ('tar.gz', 'tar', 'tar.xz', 'zip')
+TAR_MODES = {'tar': 'w|', 'tar.xz': 'w|xz'}
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def archive_format(path):
+    name = path.lower()
+    if name.endswith('.zip'):
+        return 'zip'
+    if name.endswith(('.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz', '.tar')):
+        return 'tar'
+    return None
+
+
+def declared_size(path):
+    # Uncompressed size from the archive's own metadata where that's cheap;
+    # None when finding out would mean decompressing everything
+    if archive_format(path) == 'zip':
+        try:
+            with zipfile.ZipFile(path) as zf:
+                return sum(info.file_size for info in zf.infolist())
+        except zipfile.BadZipFile as e:
+            raise ValueError(str(e))
+    if path.lower().endswith('.tar'):
+        return os.path.getsize(path)
+    return None
+
+
+def _check_quota(size, limit):
+    # Up-front check against what the archive claims; _Output enforces the
+    # limit again while writing, since headers can lie
+    if limit is not None and size is not None and size > limit:
+        raise QuotaExceeded(f"Needs {size} bytes but only {max(limit, 0)} are left under the quota")
+
+
+def _safe_path(destination, name):
+    # Rejects absolute names and anything that climbs out of destination,
+    # including through symlinks already under it: the parent is resolved
+    # and must stay inside the resolved destination
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or '..' in parts or os.path.isabs(name):
+        return None
+    root = os.path.realpath(destination)
+    parent = os.path.realpath(os.path.join(root, *parts[:-1]))
+    if os.path.commonpath([root, parent]) != root:
+        return None
+    return os.path.join(parent, parts[-1])
+
+
+class _Output:
+    # Tracks what an extract or compress wrote, so a failed or cancelled run
+    # can be undone and the quota charged only for what stays on disk
+
+    def __init__(self, job, limit):
+        self.job = job
+        self.limit = limit
+        self.written = 0
+        self.created = []
+
+    def count(self, nbytes):
+        self.written += nbytes
+        if self.limit is not None and self.written > self.limit:
+            raise QuotaExceeded(f"Quota exceeded after writing {self.written} bytes")
+        if self.job is not None:
+            self.job.io(nbytes)
+
+    def undo(self):
+        for path in reversed(self.created):
+            try:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    os.rmdir(path)
+                else:
+                    os.unlink(path)
+            except OSError:
+                continue
+
+
+def _copy_member(source, target, output, overwrite):
+    if os.path.lexists(target):
+        if not overwrite:
+            return False
+        if os.path.isdir(target) and not os.path.islink(target):
+            raise IsADirectoryError(target)
+        os.unlink(target)
+    # O_NOFOLLOW: a symlink swapped in for the target is never written through
+    fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o644)
+    with os.fdopen(fd, 'wb') as f:
+        output.created.append(target)
+        while True:
+            if output.job is not None:
+                output.job.check_cancelled()
+            chunk = source.read(CHUNK)
+            if not chunk:
+                break
+            output.count(len(chunk))
+            f.write(chunk)
+    return True
+
+
+def _make_dirs(path, output):
+    missing = []
+    while not os.path.isdir(path) or os.path.islink(path):
+        if os.path.islink(path):
+            raise NotADirectoryError(f"{path} is a symlink")
+        missing.append(path)
+        path = os.path.dirname(path)
+    for directory in reversed(missing):
+        os.mkdir(directory)
+        output.created.append(directory)
+
+
+def extract(archive, destination, job=None, limit=None, overwrite=False):
+    # Streams members to disk a chunk at a time; memory use doesn't depend
+    # on member or archive size. limit is the quota headroom in bytes.
+    _check_quota(declared_size(archive), limit)
+    output = _Output(job, limit)
+    stats = {'files': 0, 'directories': 0, 'skipped': 0, 'unsafe': []}
+    archive_size = os.path.getsize(archive)
+    destination = os.path.realpath(destination)
+    _make_dirs(destination, output)
+    try:
+        if archive_format(archive) == 'zip':
+            with zipfile.ZipFile(archive) as zf:
+                members = zf.infolist()
+                if job is not None:
+                    job.update(done=0, total=sum(info.file_size for info in members) or None)
+                for info in members:
+                    if job is not None:
+                        job.check_cancelled()
+                        job.update(message=info.filename)
+                    target = _safe_path(destination, info.filename)
+                    mode = info.external_attr >> 16
+                    if target is None or stat_module.S_ISLNK(mode):
+                        stats['unsafe'].append(info.filename)
+                        continue
+                    if info.is_dir():
+                        _make_dirs(target, output)
+                        stats['directories'] += 1
+                        continue
+                    _make_dirs(os.path.dirname(target), output)
+                    with zf.open(info) as source:
+                        copied = _copy_member(source, target, output, overwrite)
+                    stats['files' if copied else 'skipped'] += 1
+                    if copied and mode & 0o777:
+                        os.chmod(target, mode & 0o755)
+                    if job is not None:
+                        job.advance(info.file_size)
+        else:
+            with open(archive, 'rb') as raw:
+                if job is not None:
+                    job.update(done=0, total=archive_size)
+                # Stream mode: members are read in order and never seeked back to
+                with tarfile.open(fileobj=raw, mode='r|*') as tf:
+                    for member in tf:
+                        if job is not None:
+                            job.check_cancelled()
+                            job.update(done=raw.tell(), message=member.name)
+                        target = _safe_path(destination, member.name)
+                        # Links and device nodes are never recreated from uploads
+                        if target is None or not (member.isfile() or member.isdir()):
+                            stats['unsafe'].append(member.name)
+                            continue
+                        if member.isdir():
+                            _make_dirs(target, output)
+                            stats['directories'] += 1
+                            continue
+                        _make_dirs(os.path.dirname(target), output)
+                        copied = _copy_member(tf.extractfile(member), target, output, overwrite)
+                        stats['files' if copied else 'skipped'] += 1
+                        if copied:
+                            os.chmod(target, member.mode & 0o755)
+                            os.utime(target, (member.mtime, member.mtime))
+    except BaseException:
+        output.undo()
+        raise
+    stats['bytes'] = output.written
+    stats['unsafe'] = stats['unsafe'][:100]
+    return stats
+
+
+class ParallelGzipWriter:
+    # pigz-style gzip: the input is cut into blocks that worker threads
+    # deflate independently (zlib releases the GIL), each primed with the
+    # previous block's last 32 KiB so the ratio stays close to plain gzip.
+    # The blocks join into one ordinary gzip member.
+
+    def __init__(self, fileobj, workers=None, level=GZIP_LEVEL, block_size=GZIP_BLOCK, initializer=None):
+        self.fileobj = fileobj
+        self.level = level
+        self.block_size = block_size
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='gzip',
+                                        initializer=initializer)
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._dictionary = b''
+        self._crc = 0
+        self._size = 0
+        # Magic, deflate, no flags, no mtime, no extra flags, OS unknown
+        self.fileobj.write(struct.pack('<BBBBIBB', 0x1f, 0x8b, 8, 0, 0, 0, 255))
+
+    def _deflate(self, data, dictionary, last):
+        if dictionary:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    def _submit(self, data, last=False):
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        self._pending.append(self._pool.submit(self._deflate, data, self._dictionary, last))
+        self._dictionary = bytes(data[-32768:])
+        # Bounded memory: at most two blocks per worker in flight
+        while len(self._pending) > self.workers * 2:
+            self.fileobj.write(self._pending.popleft().result())
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[:self.block_size])
+            del self._buffer[:self.block_size]
+            self._submit(block)
+        return len(data)
+
+    def close(self):
+        self._submit(bytes(self._buffer), last=True)
+        self._buffer = bytearray()
+        while self._pending:
+            self.fileobj.write(self._pending.popleft().result())
+        self.fileobj.write(struct.pack('<II', self._crc, self._size & 0xffffffff))
+        self._pool.shutdown()
+
+    def abort(self):
+        self._pending.clear()
+        self._pool.shutdown(cancel_futures=True)
+
+
+class _CountingFile:
+    def __init__(self, fileobj, output):
+        self.fileobj = fileobj
+        self.output = output
+
+    def write(self, data):
+        self.output.count(len(data))
+        return self.fileobj.write(data)
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def flush(self):
+        self.fileobj.flush()
+
+
+def _walk(paths, skip=()):
+    # (path, archive name) pairs; archive names are relative to each
+    # source's parent so a folder keeps its own name inside the archive
+    for source in paths:
+        base = os.path.dirname(source.rstrip(os.sep))
+        yield source, os.path.relpath(source, base)
+        if os.path.isdir(source) and not os.path.islink(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(dirs) + sorted(files):
+                    path = os.path.join(root, name)
+                    if path not in skip:
+                        yield path, os.path.relpath(path, base)
+
+
+def source_size(paths):
+    total = 0
+    for path, _ in _walk(paths):
+        try:
+            st = os.lstat(path)
+        except OSError:
+            continue
+        if stat_module.S_ISREG(st.st_mode):
+            total += st.st_size
+    return total
+
+
+def compress(paths, archive, fmt='tar.gz', job=None, limit=None, workers=None):
+    # Writes to a hidden partial file and renames it into place at the end
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    partial = os.path.join(os.path.dirname(archive), f".{os.path.basename(archive)}.partial")
+    total = source_size(paths)
+    # Only a plain tar has a size known in advance; compressed output is
+    # held to the limit as it is written
+    if fmt == 'tar':
+        _check_quota(total, limit)
+    output = _Output(job, limit)
+    # The archive may be written into one of the folders being packed
+    skip = {partial, archive}
+    if job is not None:
+        job.update(done=0, total=total or None)
+    stats = {'files': 0, 'directories': 0, 'inputBytes': 0}
+    started = time.perf_counter()
+    try:
+        with open(partial, 'xb') as raw:
+            output.created.append(partial)
+            counted = _CountingFile(raw, output)
+            if fmt == 'zip':
+                with zipfile.ZipFile(counted, 'w', zipfile.ZIP_DEFLATED, compresslevel=GZIP_LEVEL) as zf:
+                    for path, name in _walk(paths, skip):
+                        _add_zip(zf, path, name, job, stats)
+            elif fmt == 'tar.gz':
+                sink = ParallelGzipWriter(counted, workers,
+                                          initializer=job.worker_init if job is not None else None)
+                try:
+                    with tarfile.open(fileobj=sink, mode='w|') as tf:
+                        for path, name in _walk(paths, skip):
+                            _add_tar(tf, path, name, job, stats)
+                except BaseException:
+                    sink.abort()
+                    raise
+                sink.close()
+            else:
+                with tarfile.open(fileobj=counted, mode=TAR_MODES[fmt]) as tf:
+                    for path, name in _walk(paths, skip):
+                        _add_tar(tf, path, name, job, stats)
+        os.replace(partial, archive)
+    except BaseException:
+        output.undo()
+        raise
+    stats['bytes'] = output.written
+    stats['seconds'] = round(time.perf_counter() - started, 2)
+    return stats
+
+
+class _Progress:
+    # Reads a source file while advancing the job and honouring cancel
+    def __init__(self, fileobj, job):
+        self.fileobj = fileobj
+        self.job = job
+
+    def read(self, size=-1):
+        if self.job is not None:
+            self.job.check_cancelled()
+        data = self.fileobj.read(size if size and size > 0 else CHUNK)
+        if self.job is not None:
+            self.job.advance(len(data))
+        return data
+
+
+def _add_tar(tf, path, name, job, stats):
+    try:
+        info = tf.gettarinfo(path, name)
+    except OSError:
+        return
+    if info.isreg():
+        with open(path, 'rb') as f:
+            tf.addfile(info, _Progress(f, job))
+        stats['files'] += 1
+        stats['inputBytes'] += info.size
+    elif info.isdir() or info.issym():
+        tf.addfile(info)
+        stats['directories' if info.isdir() else 'files'] += 1
+
+
+def _add_zip(zf, path, name, job, stats):
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return
+    if stat_module.S_ISDIR(st.st_mode):
+        zf.writestr(name.rstrip('/') + '/', b'')
+        stats['directories'] += 1
+    elif stat_module.S_ISREG(st.st_mode):
+        info = zipfile.ZipInfo.from_file(path, name)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with open(path, 'rb') as source, zf.open(info, 'w', force_zip64=st.st_size > 2**31) as target:
+            shutil.copyfileobj(_Progress(source, job), target, CHUNK)
+        stats['files'] += 1
+        stats['inputBytes'] += st.st_size
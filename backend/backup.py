@@ -0,0 +1,235 @@
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dedupe import walk_files
+from hashing import ALGORITHM, CHUNK_SIZE, HashCache, file_digest, new_hash
+
+MANIFEST_NAME = '.flexnas-manifest.json'
+MAX_LISTED = 1000
+# A run that would remove more than this share of the files an earlier run
+# copied (of a backup holding at least MIN_GUARDED files) leaves them alone
+# and reports it instead; an unmounted volume looks like an empty source
+MAX_REMOVED_FRACTION = 0.5
+MIN_GUARDED = 20
+
+
+def load_manifest(destination):
+    try:
+        with open(os.path.join(destination, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('algorithm') != ALGORITHM:
+        return None
+    return manifest
+
+
+def write_manifest(destination, manifest):
+    path = os.path.join(destination, MANIFEST_NAME)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def copy_and_hash(src, dst, io=None):
+    # Single pass: every block read is hashed and written, so the manifest
+    # hash describes exactly the bytes that landed in the destination
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = f"{dst}.flexnas-tmp"
+    h = new_hash()
+    with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+        while True:
+            block = fin.read(CHUNK_SIZE)
+            if not block:
+                break
+            if io is not None:
+                # Read and write both hit disks
+                io(2 * len(block), 2)
+            h.update(block)
+            fout.write(block)
+    shutil.copystat(src, tmp)
+    os.replace(tmp, dst)
+    return h.hexdigest()
+
+
+def run(db, backup, job=None, workers=None, confirm_removals=False):
+    # confirm_removals lets a run mirror deletions past the guard below
+    source = backup['source_path']
+    destination = backup['destination_path']
+    if not os.path.isdir(source):
+        raise FileNotFoundError(f"Source path {source} does not exist")
+    os.makedirs(destination, exist_ok=True)
+
+    previous = load_manifest(destination) or {'files': {}}
+    incremental = backup['type'] != 'full'
+    cache = HashCache(db)
+    files = {}
+    to_copy = []
+    total_bytes = 0
+
+    unreadable = []
+    for path, st in walk_files(source, min_size=0, errors=unreadable):
+        rel = os.path.relpath(path, source)
+        total_bytes += st.st_size
+        old = previous['files'].get(rel)
+        if incremental and old and old[0] == st.st_size and old[1] == st.st_mtime_ns:
+            try:
+                if os.stat(os.path.join(destination, rel)).st_size == st.st_size:
+                    files[rel] = old
+                    continue
+            except OSError:
+                pass
+        to_copy.append((rel, path, st))
+
+    seen = len(files) + len(to_copy)
+    if job is not None:
+        job.update(done=0, total=sum(st.st_size for _, _, st in to_copy),
+                   message=f"Copying {len(to_copy)} of {len(to_copy) + len(files)} files")
+
+    errors = [{'path': os.path.relpath(path, source), 'error': message} for path, message in unreadable]
+    workers = workers or min(8, (os.cpu_count() or 2) * 2)
+    io = job.io if job is not None else None
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='backup',
+                            initializer=job.worker_init if job is not None else None) as pool:
+        futures = [(rel, path, st, pool.submit(copy_and_hash, path, os.path.join(destination, rel), io))
+                   for rel, path, st in to_copy]
+        for rel, path, st, future in futures:
+            if job is not None:
+                job.check_cancelled(pool)
+            try:
+                digest = future.result()
+            except OSError as e:
+                errors.append({'path': rel, 'error': str(e)})
+                continue
+            files[rel] = [st.st_size, st.st_mtime_ns, digest]
+            cache.put(os.stat(os.path.join(destination, rel)), 'full', digest)
+            if job is not None:
+                job.advance(st.st_size)
+    cache.flush()
+
+    # Mirror deletions, but only for files an earlier run put there. A path
+    # the walk could not read may still exist in the source, so its earlier
+    # copies (everything under it, for a directory) are kept and stay in
+    # the manifest.
+    removed = 0
+    skipped = {os.path.relpath(path, source) for path, _ in unreadable}
+    failed = {e['path'] for e in errors} - skipped
+    prefixes = tuple(os.path.join(rel, '') for rel in skipped)
+    gone = []
+    for rel in previous['files'].keys() - files.keys() - failed:
+        if rel in skipped or rel.startswith(prefixes):
+            files[rel] = previous['files'][rel]
+        else:
+            gone.append(rel)
+    total = len(previous['files'])
+    if gone and not confirm_removals and (not seen or (total >= MIN_GUARDED and len(gone) > total * MAX_REMOVED_FRACTION)):
+        reason = 'the source is empty' if not seen else f"that is {len(gone)} of {total} files"
+        errors.append({'path': '.', 'error': f"Not removing {len(gone)} backed-up files because {reason}; "
+                                             f"check that the source volume is mounted, or run it "
+                                             f"again with confirmRemovals"})
+        for rel in gone:
+            files[rel] = previous['files'][rel]
+        gone = []
+    for rel in gone:
+        try:
+            os.remove(os.path.join(destination, rel))
+            removed += 1
+        except OSError:
+            pass
+
+    write_manifest(destination, {
+        'version': 1,
+        'algorithm': ALGORITHM,
+        'backupId': backup['id'],
+        'createdAt': time.time(),
+        'source': source,
+        'files': files
+    })
+    return {
+        'files': len(files),
+        'bytes': total_bytes,
+        'copiedFiles': len(to_copy) - len(failed),
+        'copiedBytes': sum(st.st_size for _, _, st in to_copy),
+        'removedFiles': removed,
+        'errors': errors[:MAX_LISTED]
+    }
+
+
+def verify(db, backup, job=None, deep=False, workers=None):
+    destination = backup['destination_path']
+    manifest = load_manifest(destination)
+    if manifest is None:
+        raise FileNotFoundError(f"No manifest found in {destination}")
+
+    cache = HashCache(db)
+    missing, changed, to_hash = [], [], []
+    verified = reused = 0
+    for rel, (size, _, digest) in manifest['files'].items():
+        try:
+            st = os.stat(os.path.join(destination, rel))
+        except OSError:
+            missing.append(rel)
+            continue
+        if st.st_size != size:
+            changed.append(rel)
+            continue
+        cached = None if deep else cache.get(st, 'full')
+        if cached is not None:
+            reused += 1
+            verified += 1
+            if cached != digest:
+                changed.append(rel)
+        else:
+            to_hash.append((rel, st, digest))
+
+    if job is not None:
+        job.update(done=0, total=sum(st.st_size for _, st, _ in to_hash),
+                   message=f"Hashing {len(to_hash)} files ({reused} unchanged since last hash)")
+
+    workers = workers or min(8, (os.cpu_count() or 2) * 2)
+    io = job.io if job is not None else None
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='verify',
+                            initializer=job.worker_init if job is not None else None) as pool:
+        futures = [(rel, st, digest, pool.submit(file_digest, os.path.join(destination, rel), io))
+                   for rel, st, digest in to_hash]
+        for rel, st, digest, future in futures:
+            if job is not None:
+                job.check_cancelled(pool)
+            try:
+                actual = future.result()
+            except OSError:
+                missing.append(rel)
+                continue
+            cache.put(st, 'full', actual)
+            verified += 1
+            if actual != digest:
+                changed.append(rel)
+            if job is not None:
+                job.advance(st.st_size)
+    cache.flush()
+
+    extra = []
+    for path, _ in walk_files(destination, min_size=0):
+        rel = os.path.relpath(path, destination)
+        if rel != MANIFEST_NAME and rel not in manifest['files']:
+            extra.append(rel)
+
+    return {
+        'ok': not (missing or changed),
+        'files': len(manifest['files']),
+        'verifiedFiles': verified,
+        'hashedFiles': len(to_hash),
+        'reusedHashes': reused,
+        'missingCount': len(missing),
+        'changedCount': len(changed),
+        'extraCount': len(extra),
+        'missing': sorted(missing)[:MAX_LISTED],
+        'changed': sorted(changed)[:MAX_LISTED],
+        'extra': sorted(extra)[:MAX_LISTED]
+    }
@@ -0,0 +1,84 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def add_rule(db, name, window, threshold=50, notifiers='["stub"]'):
+    db.execute('''
+        INSERT INTO alert_rules (name, metric, operator, threshold, duration, clear_threshold,
+                                 aggregate, window, severity, notifiers)
+        VALUES (?, 'cpu', '>', ?, 0, ?, 'avg', ?, 'warning', ?)
+    ''', (name, threshold, threshold - 10, window, notifiers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Alert rule evaluation cost and notifier delivery')
+    parser.add_argument('--rules', type=int, default=500, help='rules evaluated per tick in the timing run')
+    parser.add_argument('--ticks', type=int, default=2000)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix='alerts-bench-')
+    os.environ['DATABASE'] = os.path.join(work, 'nas.db')
+    import app
+    from alerts import AlertEngine, StubNotifier
+
+    failures = []
+    try:
+        app.create_app()
+        app.init_schema()
+        with app.get_db() as db:
+            db.execute('DELETE FROM alert_rules')
+            add_rule(db, 'cpu 1m', 60)
+            add_rule(db, 'cpu 15m', 900)
+            db.commit()
+
+        # Delivery: a minute-long spike after a quiet quarter hour trips the
+        # 60 s average but not the 900 s one, and clears once it is over
+        stub = StubNotifier()
+        engine = AlertEngine(app.get_db, {'stub': stub})
+        engine.load()
+        ts = 0
+        for value in [10] * 90 + [100] * 7:
+            ts += 10
+            engine.on_sample(ts, {'cpu': value})
+        if not stub.wait(1):
+            failures.append('no firing notification was delivered')
+        for _ in range(7):
+            ts += 10
+            engine.on_sample(ts, {'cpu': 10})
+        if not stub.wait(2):
+            failures.append('no resolved notification was delivered')
+        sent = [(event, alert['rule']) for event, alert in stub.sent]
+        print(f"delivered: {sent}")
+        if sent != [('firing', 'cpu 1m'), ('resolved', 'cpu 1m')]:
+            failures.append(f"expected the 1m rule to fire and resolve once, got {sent}")
+
+        # Cost per tick: one check per rule, whatever the window lengths
+        with app.get_db() as db:
+            db.execute('DELETE FROM alert_rules')
+            for i in range(args.rules):
+                add_rule(db, f'rule {i}', 60 * (i % 30), threshold=1000, notifiers='[]')
+            db.commit()
+        engine = AlertEngine(app.get_db, {})
+        engine.load()
+        t0 = time.perf_counter()
+        for i in range(args.ticks):
+            engine.on_sample(ts + i * 10, {'cpu': 50.0})
+        per_tick = (time.perf_counter() - t0) / args.ticks
+        print(f"evaluate: {per_tick * 1e6:.0f} us per tick for {args.rules} rules "
+              f"({per_tick / args.rules * 1e6:.2f} us per rule), {len(engine.windows)} windows")
+    finally:
+        shutil.rmtree(work)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import argparse
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench_load import PASSWORD, percentile, request, start_server
+
+
+class SlowPeer(BaseHTTPRequestHandler):
+    # Logs in instantly but takes delay seconds over every view
+    protocol_version = 'HTTP/1.1'
+    delay = 10.0
+
+    def _reply(self, body):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self._reply({'access_token': 'slow', 'refresh_token': 'slow'})
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        self._reply({'slow': True})
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Federated view fan-out against several local backends and one slow peer')
+    parser.add_argument('--peers', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=1.0, help='FEDERATION_TIMEOUT for the front node')
+    parser.add_argument('--slow-seconds', type=float, default=3.0, help='must stay under the 10 s node timeout')
+    parser.add_argument('--count', type=int, default=20)
+    parser.add_argument('--view', default='system-status')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='flexnas-federation-')
+    servers = []
+    SlowPeer.delay = args.slow_seconds
+    slow = ThreadingHTTPServer(('127.0.0.1', 0), SlowPeer)
+    threading.Thread(target=slow.serve_forever, daemon=True).start()
+    try:
+        # Peers answer at once; the front node only gets the short timeout
+        os.environ['FEDERATION_TIMEOUT'] = str(args.timeout)
+        os.environ['FEDERATION_CACHE_TTL'] = '0'
+        ports = []
+        for i in range(args.peers + 1):
+            directory = os.path.join(workdir, f'node{i}')
+            os.makedirs(directory)
+            server, port = start_server(directory)
+            servers.append(server)
+            ports.append(port)
+
+        front = http.client.HTTPConnection('127.0.0.1', ports[0], timeout=60)
+        status, body = request(front, 'POST', '/api/login', {'username': 'admin', 'password': PASSWORD})
+        if status != 200:
+            sys.exit(f"login to the front node failed with HTTP {status}")
+        auth = {'Authorization': f"Bearer {json.loads(body)['access_token']}"}
+        peers = [(f'peer{i}', f'http://127.0.0.1:{port}') for i, port in enumerate(ports[1:], 1)]
+        peers.append(('slow', f'http://127.0.0.1:{slow.server_address[1]}'))
+        for name, url in peers:
+            status, body = request(front, 'POST', '/api/federation/nodes',
+                                   {'name': name, 'url': url, 'username': 'admin', 'password': PASSWORD}, auth)
+            if status != 201:
+                sys.exit(f"registering {name} failed with HTTP {status}: {body[:200]}")
+
+        latencies, statuses = [], {}
+        for _ in range(args.count):
+            t0 = time.perf_counter()
+            status, body = request(front, 'GET', f'/api/federation/{args.view}', None, auth)
+            latencies.append(time.perf_counter() - t0)
+            if status != 200:
+                sys.exit(f"federated view failed with HTTP {status}")
+            for node in json.loads(body)['nodes']:
+                statuses.setdefault(node['node']['name'], {}).setdefault(node['status'], 0)
+                statuses[node['node']['name']][node['status']] += 1
+        front.close()
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait(10)
+        slow.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies.sort()
+    print(f"{args.count} federated {args.view} calls over {len(peers)} peers, timeout {args.timeout:g} s")
+    print(f"  p50 {percentile(latencies, 50) * 1000:.1f} ms  p90 {percentile(latencies, 90) * 1000:.1f} ms  "
+          f"max {latencies[-1] * 1000:.1f} ms")
+    for name, counts in statuses.items():
+        print(f"  {name:8s} {counts}")
+
+    failures = []
+    if latencies[-1] > args.timeout + 1.0:
+        failures.append(f"a call took {latencies[-1]:.2f} s; the slow peer held up the view")
+    for name, counts in statuses.items():
+        if name != 'slow' and set(counts) != {'ok'}:
+            failures.append(f"{name} was not always ok: {counts}")
+    if args.count * args.timeout > args.slow_seconds * 2 and not statuses.get('slow', {}).get('stale'):
+        failures.append("the slow peer's late replies never reached the cache")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
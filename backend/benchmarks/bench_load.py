@@ -0,0 +1,304 @@
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'load-baseline.json')
+PASSWORD = 'admin12345'
+ACTIONS = ('login', 'logout', 'create_share', 'update_share', 'delete_file', 'create_user', 'backup', 'update_quota')
+
+# Both run in a fresh interpreter; the schema step also creates the admin user
+SCHEMA = '''
+import sys
+sys.path.insert(0, sys.argv[1])
+import app
+app.create_app()
+app.init_schema()
+'''
+
+SERVER = '''
+import sys
+sys.path.insert(0, sys.argv[1])
+import app
+app.create_app().run(host='127.0.0.1', port=int(sys.argv[2]), threaded=True, use_reloader=False)
+'''
+
+
+def environment(workdir):
+    return dict(os.environ, DATABASE=os.path.join(workdir, 'nas.db'),
+                METRICS_HISTORY_DIR=os.path.join(workdir, 'metrics-history'),
+                SMART_FIXTURE_DIR=os.path.join(workdir, 'smart'), MDSTAT_PATH=os.path.join(workdir, 'mdstat'),
+                PROTOCOL_CONFIG_ROOT=os.path.join(workdir, 'etc'), COMMAND_RUNNER='stub',
+                JWT_SECRET_KEY='load-benchmark-secret-key-long-enough-for-hs256')
+
+
+def build_tree(root, dirs, files_per_dir, wide):
+    # dirs folders of files_per_dir empty files each, plus one wide folder
+    # that /api/files lists
+    for d in range(dirs):
+        path = os.path.join(root, f'dir{d:05d}')
+        os.makedirs(path, exist_ok=True)
+        for f in range(files_per_dir):
+            open(os.path.join(path, f'file{f:05d}.dat'), 'wb').close()
+    wide_path = os.path.join(root, 'wide')
+    os.makedirs(wide_path, exist_ok=True)
+    for f in range(wide):
+        open(os.path.join(wide_path, f'photo{f:06d}.bin'), 'wb').close()
+    return wide_path
+
+
+def seed(workdir, users, shares, activity, dirs, files_per_dir, wide):
+    subprocess.run([sys.executable, '-c', SCHEMA, BACKEND], cwd=workdir, env=environment(workdir),
+                   capture_output=True, check=True)
+    tree = os.path.join(workdir, 'tree')
+    wide_path = build_tree(tree, dirs, files_per_dir, wide)
+    rng = random.Random(1)
+    db = sqlite3.connect(os.path.join(workdir, 'nas.db'))
+    # Every seeded user shares the admin's password hash, so logins cost one
+    # real bcrypt check without hashing thousands of passwords up front
+    password_hash = db.execute("SELECT password_hash FROM users WHERE username = 'admin'").fetchone()[0]
+    db.executemany('''
+        INSERT INTO users (username, email, password_hash, role, status, permissions) VALUES (?, ?, ?, ?, ?, ?)
+    ''', ((f'user{i:06d}', f'user{i}@example.com', password_hash, 'user', 'active', 'read_files')
+          for i in range(users)))
+    db.executemany('''
+        INSERT INTO shares (name, path, description, created_by, is_public, allowed_users, read_only)
+        VALUES (?, ?, ?, 1, ?, ?, ?)
+    ''', ((f'share{i:05d}', os.path.join(tree, f'dir{i % max(dirs, 1):05d}'), f'Seeded share {i}', int(i % 3 == 0),
+           ','.join(f'user{rng.randrange(users):06d}' for _ in range(3)) if users else '', int(i % 5 == 0))
+          for i in range(shares)))
+    start = datetime(2024, 1, 1)
+    db.executemany('INSERT INTO activity_log (timestamp, user_id, action, details) VALUES (?, ?, ?, ?)', (
+        ((start + timedelta(seconds=i * 30)).strftime('%Y-%m-%d %H:%M:%S'), rng.randrange(1, users + 2),
+         ACTIONS[i % len(ACTIONS)], f'Seeded event {i}')
+        for i in range(activity)))
+    db.commit()
+    db.close()
+    return wide_path
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(workdir):
+    port = free_port()
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    server = subprocess.Popen([sys.executable, '-c', SERVER, BACKEND, str(port)], cwd=workdir,
+                              env=environment(workdir), stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return server, port
+        except OSError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"Server did not start, see {log.name}")
+
+
+def request(conn, method, path, body=None, headers=None):
+    headers = dict(headers or {})
+    if body is not None:
+        body = json.dumps(body)
+        headers['Content-Type'] = 'application/json'
+    conn.request(method, path, body=body, headers=headers)
+    response = conn.getresponse()
+    data = response.read()
+    return response.status, data
+
+
+def percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else None
+
+
+def drive(port, scenario, concurrency, duration, warmup=2):
+    # concurrency clients, each on its own keep-alive connection, sending
+    # back to back for duration seconds once every client has warmed up
+    latencies, errors = [], []
+    lock = threading.Lock()
+    ready = threading.Barrier(concurrency + 1)
+
+    def client(seed):
+        rng = random.Random(seed)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        mine, failed = [], []
+        try:
+            try:
+                for _ in range(warmup):
+                    request(conn, *scenario(rng))
+            finally:
+                ready.wait()
+            stop = time.monotonic() + duration
+            while time.monotonic() < stop:
+                args = scenario(rng)
+                t0 = time.perf_counter()
+                try:
+                    status, _ = request(conn, *args)
+                except (OSError, http.client.HTTPException) as e:
+                    failed.append(str(e))
+                    conn.close()
+                    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                    continue
+                elapsed = time.perf_counter() - t0
+                if status >= 400:
+                    failed.append(f'HTTP {status}')
+                mine.append(elapsed)
+        finally:
+            conn.close()
+            with lock:
+                latencies.extend(mine)
+                errors.extend(failed)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'firstError': errors[0] if errors else None,
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50Ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p90Ms': round(percentile(latencies, 90) * 1000, 2) if latencies else None,
+        'p99Ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        'maxMs': round(latencies[-1] * 1000, 2) if latencies else None
+    }
+
+
+def scenarios(token, users, wide_path):
+    auth = {'Authorization': f'Bearer {token}'}
+    return {
+        'login': lambda rng: ('POST', '/api/login', {
+            'username': f'user{rng.randrange(users):06d}' if users else 'admin', 'password': PASSWORD}),
+        'shares': lambda rng: ('GET', '/api/shares', None, auth),
+        'files': lambda rng: ('GET', f'/api/files?path={wide_path}', None, auth),
+        'activityLog': lambda rng: ('GET', '/api/activity-log', None, auth),
+        'systemStatus': lambda rng: ('GET', '/api/system-status', None, auth)
+    }
+
+
+def compare(results, baseline, tolerance):
+    # A scenario regresses when throughput drops or median/p90 latency grows
+    # by more than tolerance against the baseline
+    failures = []
+    for name, result in results['endpoints'].items():
+        if result['errors']:
+            failures.append(f"{name}: {result['errors']} errors, first: {result['firstError']}")
+        base = baseline.get('endpoints', {}).get(name)
+        if not base:
+            continue
+        if result['rps'] < base['rps'] * (1 - tolerance):
+            failures.append(f"{name}: {result['rps']} req/s, baseline {base['rps']}")
+        for key in ('p50Ms', 'p90Ms'):
+            if result[key] is not None and base.get(key) and result[key] > base[key] * (1 + tolerance):
+                failures.append(f"{name}: {key} {result[key]}, baseline {base[key]}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent load test of the main API endpoints against a seeded database')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--shares', type=int, default=5000)
+    parser.add_argument('--activity', type=int, default=1000000)
+    parser.add_argument('--dirs', type=int, default=200)
+    parser.add_argument('--files-per-dir', type=int, default=100)
+    parser.add_argument('--wide', type=int, default=20000, help='entries in the directory /api/files lists')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per endpoint')
+    parser.add_argument('--only', action='append', help='run just these scenarios')
+    parser.add_argument('--workdir', help='keep the seeded database and tree here and reuse them on later runs')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='flexnas-load-')
+    os.makedirs(workdir, exist_ok=True)
+    marker = os.path.join(workdir, 'seeded.json')
+    shape = {key: getattr(args, key) for key in ('users', 'shares', 'activity', 'dirs', 'files_per_dir', 'wide')}
+    if os.path.exists(marker) and json.load(open(marker))['shape'] == shape:
+        wide_path = json.load(open(marker))['widePath']
+    else:
+        if os.path.exists(marker):
+            sys.exit(f"{workdir} was seeded with different sizes; pick another --workdir")
+        t0 = time.perf_counter()
+        wide_path = seed(workdir, **shape)
+        json.dump({'shape': shape, 'widePath': wide_path}, open(marker, 'w'))
+        print(f"seeded in {time.perf_counter() - t0:.1f} s")
+
+    server, port = start_server(workdir)
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        status, body = request(conn, 'POST', '/api/login', {'username': 'admin', 'password': PASSWORD})
+        conn.close()
+        if status != 200:
+            sys.exit(f"admin login failed with HTTP {status}")
+        token = json.loads(body)['access_token']
+
+        results = {
+            'meta': {'shape': shape, 'concurrency': args.concurrency, 'duration': args.duration,
+                     'python': platform.python_version(), 'cpus': os.cpu_count(),
+                     'timestamp': datetime.now().isoformat(timespec='seconds')},
+            'endpoints': {}
+        }
+        for name, scenario in scenarios(token, args.users, wide_path).items():
+            if args.only and name not in args.only:
+                continue
+            result = drive(port, scenario, args.concurrency, args.duration)
+            results['endpoints'][name] = result
+            print(f"{name:13s} {result['rps']:8.1f} req/s  p50 {result['p50Ms']} ms  p90 {result['p90Ms']} ms  "
+                  f"p99 {result['p99Ms']} ms  errors {result['errors']}")
+    finally:
+        server.terminate()
+        server.wait(10)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        baseline = json.load(open(args.baseline))
+        if baseline['meta']['shape'] != shape or baseline['meta']['concurrency'] != args.concurrency:
+            print('baseline was recorded with different sizes or concurrency; not comparing')
+            baseline = None
+    else:
+        print(f"no baseline at {args.baseline}; run with --save-baseline to record one")
+    failures = compare(results, baseline or {}, args.tolerance)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
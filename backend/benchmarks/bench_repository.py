@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import repository  # noqa: E402
+
+WORDS = [b'share', b'backup', b'volume', b'quota', b'snapshot', b'nas', b'disk', b'user',
+         b'photo', b'report', b'invoice', b'2024', b'export', b'raid', b'array', b'\n']
+
+
+def text_blob(rng, size):
+    out = bytearray()
+    while len(out) < size:
+        out += rng.choice(WORDS) + b' '
+    return bytes(out[:size])
+
+
+def make_dataset(root, rng, total_mb):
+    # Half incompressible media, half compressible documents, plus duplicate copies
+    os.makedirs(os.path.join(root, 'media'))
+    os.makedirs(os.path.join(root, 'docs'))
+    os.makedirs(os.path.join(root, 'copies'))
+    target = total_mb * 1024 * 1024
+    written = 0
+    i = 0
+    while written < target:
+        size = rng.randint(1, 16) * 1024 * 1024
+        if i % 2:
+            path = os.path.join(root, 'media', f'clip{i}.bin')
+            data = rng.randbytes(size)
+        else:
+            path = os.path.join(root, 'docs', f'doc{i}.txt')
+            data = text_blob(rng, size)
+        with open(path, 'wb') as f:
+            f.write(data)
+        if i % 5 == 0:
+            shutil.copy(path, os.path.join(root, 'copies', os.path.basename(path)))
+            written += size
+        written += size
+        i += 1
+
+
+def mutate_dataset(root, rng, fraction=0.2):
+    # Insert a few bytes near the start of some files: fixed-size chunking
+    # would re-store everything after the insertion point
+    names = sorted(os.path.join(d, n) for d, _, files in os.walk(root) for n in files)
+    for path in rng.sample(names, max(1, int(len(names) * fraction))):
+        with open(path, 'rb') as f:
+            data = f.read()
+        at = rng.randrange(len(data) // 4 + 1)
+        with open(path, 'wb') as f:
+            f.write(data[:at] + rng.randbytes(rng.randint(1, 4096)) + data[at:])
+
+
+def ingest(repo_root, source, backup_id, workers):
+    backup = {'id': backup_id, 'source_path': source, 'destination_path': f'repo:{repo_root}',
+              'type': 'full', 'retention_days': 30}
+    return repository.run(None, backup, workers=workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark backup repository ingest and dedup')
+    parser.add_argument('--size-mb', type=int, default=256, help='synthetic dataset size')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--compression', choices=sorted(repository.CODEC_TAGS), default=None)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    work = tempfile.mkdtemp(prefix='flexnas-bench-')
+    try:
+        source = os.path.join(work, 'source')
+        repo_root = os.path.join(work, 'repo')
+        make_dataset(source, rng, args.size_mb)
+        repository.Repository.open(repo_root, create=True, compression=args.compression).close()
+
+        first = ingest(repo_root, source, 1, args.workers)
+        mutate_dataset(source, rng)
+        second = ingest(repo_root, source, 1, args.workers)
+
+        restored = os.path.join(work, 'restored')
+        with repository.Repository.open(repo_root) as repo:
+            snapshot = repo.snapshots(1)[-1]
+            started = time.time()
+            repository.restore(repo, snapshot, restored)
+            restore_seconds = time.time() - started
+            stats = repo.stats()
+            compression = repo.config['compression']
+        for rel in snapshot['files']:
+            with open(os.path.join(source, rel), 'rb') as a, open(os.path.join(restored, rel), 'rb') as b:
+                if a.read() != b.read():
+                    raise SystemExit(f'Restore mismatch for {rel}')
+
+        repo_bytes = sum(os.path.getsize(os.path.join(d, n))
+                         for d, _, files in os.walk(repo_root) for n in files)
+        logical = first['bytes'] + second['bytes']
+        results = {
+            'compression': compression,
+            'datasetMB': round(first['bytes'] / 1e6, 1),
+            'firstIngest': {'MBps': first['ingestMBps'], 'seconds': first['seconds'],
+                            'dedupRatio': first['dedupRatio']},
+            'secondIngest': {'MBps': second['ingestMBps'], 'seconds': second['seconds'],
+                             'newMB': round(second['newBytes'] / 1e6, 1),
+                             'dedupRatio': second['dedupRatio']},
+            'restoreMBps': round(second['bytes'] / max(restore_seconds, 1e-9) / 1e6, 1),
+            'chunks': stats['chunks'],
+            'averageChunkKB': round(stats['rawBytes'] / max(stats['chunks'], 1) / 1024, 1),
+            'repositoryMB': round(repo_bytes / 1e6, 1),
+            'overallRatio': round(logical / repo_bytes, 2)
+        }
+        print(json.dumps(results, indent=2))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import responses  # noqa: E402
+
+
+def listing(count):
+    # Shaped like /api/files entries
+    return [{
+        'name': f'IMG_{i:06d}.jpg',
+        'path': f'/srv/photos/2023/holiday/IMG_{i:06d}.jpg',
+        'type': 'file',
+        'size': 1500000 + i * 37,
+        'modified': f'2023-08-{1 + i % 28:02d}T10:{i % 60:02d}:{i * 7 % 60:02d}',
+        'thumbnail': f'/api/thumbnails?path=%2Fsrv%2Fphotos%2F2023%2Fholiday%2FIMG_{i:06d}.jpg&size=256&v={i:040x}'
+    } for i in range(count)]
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON serialization and compression benchmark')
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    items = listing(args.entries)
+    print(f"encoder: {'orjson' if responses.orjson else 'json'}, "
+          f"brotli: {'yes' if responses.brotli else 'not installed'}, {args.entries} entries")
+
+    # What jsonify() did before: stdlib, sorted keys, ASCII escaping
+    elapsed, baseline = timed(lambda: json.dumps(items, sort_keys=True, separators=(',', ':')).encode(), args.repeat)
+    print(f"stdlib jsonify:  {elapsed * 1000:7.1f} ms  {len(baseline) / 1024**2:6.2f} MB")
+
+    elapsed, body = timed(lambda: responses.dumps_bytes(items), args.repeat)
+    print(f"fast encoder:    {elapsed * 1000:7.1f} ms  {len(body) / 1024**2:6.2f} MB")
+
+    elapsed, chunks = timed(lambda: list(responses.iter_json_array(items)), args.repeat)
+    largest = max(len(chunk) for chunk in chunks)
+    print(f"streamed:        {elapsed * 1000:7.1f} ms  largest chunk {largest / 1024:.0f} KB")
+    assert json.loads(b''.join(chunks)) == items
+
+    elapsed, packed = timed(lambda: gzip.compress(body, compresslevel=responses.GZIP_LEVEL, mtime=0), args.repeat)
+    print(f"gzip level {responses.GZIP_LEVEL}:    {elapsed * 1000:7.1f} ms  {len(packed) / 1024**2:6.2f} MB on the wire "
+          f"({len(body) / len(packed):.1f}x)")
+
+    if responses.brotli is not None:
+        elapsed, packed = timed(lambda: responses.brotli.compress(body, quality=responses.BROTLI_QUALITY), args.repeat)
+        print(f"brotli q{responses.BROTLI_QUALITY}:       {elapsed * 1000:7.1f} ms  "
+              f"{len(packed) / 1024**2:6.2f} MB on the wire ({len(body) / len(packed):.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
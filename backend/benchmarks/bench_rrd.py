@@ -0,0 +1,71 @@
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rrd  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Round-robin metrics store benchmark')
+    parser.add_argument('--metrics', type=int, default=20, help='metrics per sample')
+    parser.add_argument('--samples', type=int, default=5000, help='samples for the write benchmark')
+    parser.add_argument('--fill-step', type=int, default=300,
+                        help='seconds between samples when filling a year of history')
+    parser.add_argument('--queries', type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    names = ['cpu', 'memory', 'disk', 'net:rx', 'net:tx'] + \
+        [f'io:sd{chr(97 + i)}:read' for i in range(args.metrics - 5)]
+    names = names[:args.metrics]
+    work = tempfile.mkdtemp(prefix='rrd-bench-')
+    try:
+        store = rrd.RoundRobinStore(work)
+        now = int(time.time())
+
+        # Write cost: one sampler tick updates every archive of every metric
+        start = now - args.samples * 10
+        store.record(start, {name: 0.0 for name in names})
+        t0 = time.perf_counter()
+        for i in range(1, args.samples):
+            store.record(start + i * 10, {name: rng.random() * 100 for name in names})
+        elapsed = time.perf_counter() - t0
+        per_sample = elapsed / (args.samples - 1)
+        print(f"write: {per_sample * 1e6:.0f} us per sample of {len(names)} metrics "
+              f"({per_sample / len(names) * 1e6:.1f} us per metric)")
+
+        # A year of history for one metric, then a full-range chart query
+        t0 = time.perf_counter()
+        year = 366 * 86400
+        for ts in range(now - year, now, args.fill_step):
+            store.record(ts, {'year': rng.random() * 100})
+        print(f"fill: {year // args.fill_step} samples in {time.perf_counter() - t0:.1f}s")
+
+        t0 = time.perf_counter()
+        for _ in range(args.queries):
+            result = store.query('year', now - 365 * 86400, now)
+        elapsed = (time.perf_counter() - t0) / args.queries
+        print(f"query 1y: {elapsed * 1000:.2f} ms, {len(result['points'])} points at {result['step']}s step")
+
+        t0 = time.perf_counter()
+        for _ in range(args.queries):
+            result = store.query('year', now - 86400, now, cf='max', max_points=300)
+        elapsed = (time.perf_counter() - t0) / args.queries
+        print(f"query 1d (<=300 points): {elapsed * 1000:.2f} ms, {len(result['points'])} points "
+              f"at {result['step']}s step")
+
+        size = sum(os.path.getsize(os.path.join(work, name)) for name in os.listdir(work))
+        print(f"disk: {size / len(os.listdir(work)) / 1024**2:.2f} MB per metric (fixed)")
+        store.close()
+    finally:
+        shutil.rmtree(work)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter so nothing is already imported
+PROBE = '''
+import json, os, sys, time
+sys.path.insert(0, sys.argv[1])
+t0 = time.perf_counter()
+import app
+imported = time.perf_counter()
+database_after_import = os.path.exists(app.app.config['DATABASE'])
+app.create_app({'COMMAND_RUNNER': 'stub', 'PROTOCOL_CONFIG_ROOT': os.path.join(os.getcwd(), 'etc')})
+created = time.perf_counter()
+database_after_create = os.path.exists(app.app.config['DATABASE'])
+response = app.app.test_client().post('/api/login', json={'username': 'admin', 'password': 'admin12345'})
+first_request = time.perf_counter()
+print(json.dumps({
+    'import': imported - t0,
+    'createApp': created - imported,
+    'firstRequest': first_request - created,
+    'databaseAfterImport': database_after_import,
+    'databaseAfterCreate': database_after_create,
+    'loginStatus': response.status_code
+}))
+'''
+
+
+def probe():
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, DATABASE=os.path.join(workdir, 'nas.db'),
+                   METRICS_HISTORY_DIR=os.path.join(workdir, 'metrics-history'),
+                   SMART_FIXTURE_DIR=os.path.join(workdir, 'smart'), MDSTAT_PATH=os.path.join(workdir, 'mdstat'))
+        out = subprocess.run([sys.executable, '-c', PROBE, BACKEND], cwd=workdir, env=env,
+                             capture_output=True, text=True, check=True)
+        return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='App import and startup time benchmark')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=500,
+                        help='fail when the best import time exceeds this')
+    args = parser.parse_args()
+
+    runs = [probe() for _ in range(args.repeat)]
+    for key in ('import', 'createApp', 'firstRequest'):
+        values = sorted(run[key] * 1000 for run in runs)
+        print(f"{key:13s} best {values[0]:7.1f} ms  median {values[len(values) // 2]:7.1f} ms")
+
+    failures = []
+    best_import = min(run['import'] for run in runs) * 1000
+    if best_import > args.budget_ms:
+        failures.append(f"import took {best_import:.1f} ms, budget is {args.budget_ms:.0f} ms")
+    if any(run['databaseAfterImport'] or run['databaseAfterCreate'] for run in runs):
+        failures.append('the database was created before the first request')
+    if any(run['loginStatus'] != 200 for run in runs):
+        failures.append('first request (admin login) did not succeed')
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
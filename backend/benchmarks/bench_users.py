@@ -0,0 +1,88 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import users  # noqa: E402
+
+
+def build(count):
+    db = sqlite3.connect(':memory:')
+    db.row_factory = sqlite3.Row
+    db.execute('''
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT NOT NULL DEFAULT 'user',
+            status TEXT NOT NULL DEFAULT 'active',
+            permissions TEXT NOT NULL DEFAULT 'read_files',
+            last_login DATETIME
+        )
+    ''')
+    db.execute('CREATE INDEX idx_users_username_nocase ON users (username COLLATE NOCASE)')
+    db.execute('CREATE INDEX idx_users_email_nocase ON users (email COLLATE NOCASE)')
+    db.execute("CREATE INDEX idx_users_last_login ON users (COALESCE(last_login, ''), id)")
+    db.executemany('INSERT INTO users (username, email, password_hash, last_login) VALUES (?, ?, ?, ?)', (
+        (f'user{i:07d}', f'user{i}@example.com', 'x', None if i % 4 else f'2024-01-01 {i % 24:02d}:00:00')
+        for i in range(count)))
+    db.commit()
+    return db
+
+
+def walk(db, sort, limit):
+    pages, cursor = 0, None
+    t0 = time.perf_counter()
+    while True:
+        rows, cursor = users.page(db, sort=sort, order='desc', limit=limit, cursor=cursor)
+        pages += 1
+        if cursor is None:
+            return pages, time.perf_counter() - t0
+
+
+def walk_offset(db, limit):
+    pages, offset = 0, 0
+    t0 = time.perf_counter()
+    while True:
+        rows = db.execute(f'SELECT {users.COLUMNS} FROM users ORDER BY username DESC LIMIT ? OFFSET ?',
+                          (limit, offset)).fetchall()
+        pages += 1
+        offset += limit
+        if len(rows) < limit:
+            return pages, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='User directory paging and bulk password hashing benchmark')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--hashes', type=int, default=32)
+    args = parser.parse_args()
+
+    db = build(args.users)
+    pages, elapsed = walk_offset(db, args.limit)
+    print(f"offset paging:   {pages} pages in {elapsed * 1000:8.1f} ms")
+    for sort in ('username', 'lastLogin'):
+        pages, elapsed = walk(db, sort, args.limit)
+        print(f"keyset {sort:9s} {pages} pages in {elapsed * 1000:8.1f} ms")
+    t0 = time.perf_counter()
+    rows, _ = users.page(db, search='user00042', limit=args.limit)
+    print(f"prefix search:   {len(rows)} rows in {(time.perf_counter() - t0) * 1000:.2f} ms")
+
+    passwords = [f'password-{i}' for i in range(args.hashes)]
+    t0 = time.perf_counter()
+    users.PasswordHasher(workers=1).hash_many(passwords)
+    serial = time.perf_counter() - t0
+    hasher = users.PasswordHasher()
+    t0 = time.perf_counter()
+    hasher.hash_many(passwords)
+    pooled = time.perf_counter() - t0
+    print(f"bcrypt x{args.hashes}: serial {serial:.2f} s, {hasher.workers} processes {pooled:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import json
+import subprocess
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+OUTPUT_LIMIT = 16 * 1024
+FINISHED = ('succeeded', 'failed', 'timeout')
+
+
+class CommandFailed(Exception):
+    def __init__(self, operation):
+        super().__init__(f"{' '.join(operation['argv'])}: {operation['error'] or operation['stderr'].strip()}")
+        self.operation = operation
+
+
+class SubprocessRunner:
+    def run(self, argv, timeout):
+        out = subprocess.run(argv, capture_output=True, text=True, timeout=timeout)
+        return out.returncode, out.stdout, out.stderr
+
+
+class StubRunner:
+    # Records commands instead of running them; for tests and development
+    # machines without systemd
+
+    def __init__(self, returncode=0):
+        self.returncode = returncode
+        self.calls = []
+
+    def run(self, argv, timeout):
+        self.calls.append(list(argv))
+        return self.returncode, '', ''
+
+
+def systemctl(action, unit):
+    return ['systemctl', action, unit]
+
+
+class CommandExecutor:
+    # Runs system commands on a worker pool so a slow D-Bus or daemon never
+    # holds up a request; every command lands in the command_audit table
+
+    def __init__(self, get_db, runner=None, max_workers=4, timeout=30, keep=500):
+        self.get_db = get_db
+        self.runner = runner or SubprocessRunner()
+        self.timeout = timeout
+        self.keep = keep
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='command')
+        self._operations = OrderedDict()
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def _new(self, name, argv, timeout, requested_by, idempotency_key):
+        return {
+            'id': uuid.uuid4().hex[:12],
+            'name': name,
+            'argv': list(argv),
+            'timeout': timeout or self.timeout,
+            'requestedBy': requested_by,
+            'idempotencyKey': idempotency_key,
+            'status': 'queued',
+            'returncode': None,
+            'stdout': '',
+            'stderr': '',
+            'error': None,
+            'createdAt': time.time(),
+            'startedAt': None,
+            'finishedAt': None
+        }
+
+    def submit(self, name, argv, timeout=None, requested_by=None, idempotency_key=None):
+        # A repeated idempotency key returns the original operation instead
+        # of running the command twice. Keys are scoped to the user and the
+        # operation name, so one caller's key never matches another's.
+        with self._lock:
+            if idempotency_key:
+                scope = (requested_by, name, idempotency_key)
+                existing = self._keys.get(scope) or self._find_key(*scope)
+                if existing is not None:
+                    return self.get(existing)
+            operation = self._new(name, argv, timeout, requested_by, idempotency_key)
+            self._remember(operation)
+        self._record(operation)
+        self._pool.submit(self._execute, operation)
+        return dict(operation)
+
+    def run(self, name, argv, timeout=None, requested_by=None):
+        # Synchronous variant for callers already off the request path
+        operation = self._new(name, argv, timeout, requested_by, None)
+        with self._lock:
+            self._remember(operation)
+        self._record(operation)
+        self._execute(operation)
+        if operation['status'] != 'succeeded':
+            raise CommandFailed(operation)
+        return dict(operation)
+
+    def _remember(self, operation):
+        self._operations[operation['id']] = operation
+        if operation['idempotencyKey']:
+            self._keys[self._scope(operation)] = operation['id']
+        finished = [op_id for op_id, op in self._operations.items() if op['status'] in FINISHED]
+        for op_id in finished[:max(0, len(finished) - self.keep)]:
+            self._keys.pop(self._scope(self._operations.pop(op_id)), None)
+
+    @staticmethod
+    def _scope(operation):
+        return operation['requestedBy'], operation['name'], operation['idempotencyKey']
+
+    def _execute(self, operation):
+        operation['status'] = 'running'
+        operation['startedAt'] = time.time()
+        try:
+            returncode, stdout, stderr = self.runner.run(operation['argv'], operation['timeout'])
+            operation['returncode'] = returncode
+            operation['stdout'] = (stdout or '')[-OUTPUT_LIMIT:]
+            operation['stderr'] = (stderr or '')[-OUTPUT_LIMIT:]
+            operation['status'] = 'succeeded' if returncode == 0 else 'failed'
+        except subprocess.TimeoutExpired:
+            operation['status'] = 'timeout'
+            operation['error'] = f"Timed out after {operation['timeout']}s"
+        except OSError as e:
+            operation['status'] = 'failed'
+            operation['error'] = str(e)
+        except Exception as e:
+            operation['status'] = 'failed'
+            operation['error'] = str(e)
+            traceback.print_exc()
+        finally:
+            operation['finishedAt'] = time.time()
+            self._record(operation)
+
+    def _record(self, operation):
+        try:
+            with self.get_db() as db:
+                db.execute('''
+                    INSERT OR REPLACE INTO command_audit (
+                        id, idempotency_key, name, argv, requested_by, status, returncode,
+                        stdout, stderr, error, created_at, started_at, finished_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    operation['id'], operation['idempotencyKey'], operation['name'],
+                    json.dumps(operation['argv']), operation['requestedBy'], operation['status'],
+                    operation['returncode'], operation['stdout'], operation['stderr'], operation['error'],
+                    operation['createdAt'], operation['startedAt'], operation['finishedAt']
+                ))
+                db.commit()
+        except Exception:
+            traceback.print_exc()
+
+    def _find_key(self, requested_by, name, idempotency_key):
+        with self.get_db() as db:
+            row = db.execute('''
+                SELECT id FROM command_audit WHERE requested_by IS ? AND name = ? AND idempotency_key = ?
+            ''', (requested_by, name, idempotency_key)).fetchone()
+        return row['id'] if row else None
+
+    def _from_row(self, row):
+        return {
+            'id': row['id'],
+            'name': row['name'],
+            'argv': json.loads(row['argv']),
+            'requestedBy': row['requested_by'],
+            'idempotencyKey': row['idempotency_key'],
+            'status': row['status'],
+            'returncode': row['returncode'],
+            'stdout': row['stdout'],
+            'stderr': row['stderr'],
+            'error': row['error'],
+            'createdAt': row['created_at'],
+            'startedAt': row['started_at'],
+            'finishedAt': row['finished_at']
+        }
+
+    def get(self, operation_id):
+        operation = self._operations.get(operation_id)
+        if operation is not None:
+            return dict(operation)
+        with self.get_db() as db:
+            row = db.execute('SELECT * FROM command_audit WHERE id = ?', (operation_id,)).fetchone()
+        return self._from_row(row) if row else None
+
+    def history(self, limit=100):
+        with self.get_db() as db:
+            rows = db.execute('SELECT * FROM command_audit ORDER BY created_at DESC LIMIT ?', (limit,)).fetchall()
+        return [self._from_row(row) for row in rows]
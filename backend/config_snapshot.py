@@ -0,0 +1,264 @@
+import json
+
+from responses import dumps_bytes, iter_json_array
+from sharing import check_service_config, check_share_name
+
+FORMAT = 'flexnas-config'
+VERSION = 1
+
+# Sections in export and apply order. Keyed sections are matched on their
+# natural key, since ids differ between boxes; settings tables hold a
+# single row, which is updated in place.
+SECTIONS = {
+    'system_settings': None,
+    'network_settings': None,
+    'storage_settings': None,
+    'services': ('name',),
+    'shares': ('name',),
+    'quotas': ('username', 'path'),
+    'backups': ('name',)
+}
+# Bookkeeping and runtime state, not configuration
+SKIP = {'id', 'created_at', 'updated_at', 'created_by', 'used_space', 'last_run', 'next_run'}
+
+
+class InvalidSnapshot(Exception):
+    def __init__(self, errors):
+        super().__init__('; '.join(errors[:5]))
+        self.errors = errors
+
+
+def _table_columns(db, table):
+    # {column: required on insert}
+    return {row['name']: bool(row['notnull']) and row['dflt_value'] is None and not row['pk']
+            for row in db.execute(f'PRAGMA table_info({table})').fetchall()}
+
+
+def columns(db, table):
+    cols = {name: required for name, required in _table_columns(db, table).items() if name not in SKIP}
+    if table == 'quotas':
+        # Users are matched by name on the importing box
+        del cols['user_id']
+        cols = {'username': True, **cols}
+    return cols
+
+
+def export_rows(db, table):
+    names = list(columns(db, table))
+    if table == 'quotas':
+        cursor = db.execute('SELECT u.username, q.* FROM quotas q JOIN users u ON q.user_id = u.id ORDER BY q.id')
+    elif SECTIONS[table] is None:
+        # The row the settings pages read
+        cursor = db.execute(f'SELECT * FROM {table} ORDER BY id LIMIT 1')
+    else:
+        cursor = db.execute(f'SELECT * FROM {table} ORDER BY id')
+    for row in cursor:
+        yield {name: row[name] for name in names}
+
+
+def iter_export(db, exported_at, schema_version):
+    # Streamed section by section, so thousands of shares and quotas are
+    # never held as one document
+    header = {'format': FORMAT, 'version': VERSION, 'schemaVersion': schema_version, 'exportedAt': exported_at}
+    yield dumps_bytes(header)[:-1] + b',"sections":{'
+    for i, table in enumerate(SECTIONS):
+        yield (b',' if i else b'') + dumps_bytes(table) + b':'
+        yield from iter_json_array(export_rows(db, table))
+    yield b'}}'
+
+
+def _key(table, row):
+    return tuple(row[name] for name in SECTIONS[table])
+
+
+def validate(db, snapshot, share_path_error=None):
+    # Returns {table: [rows]} for the sections present; raises
+    # InvalidSnapshot with every problem found. share_path_error(path)
+    # holds imported share paths to the same roots as the shares API.
+    errors = []
+    if not isinstance(snapshot, dict) or snapshot.get('format') != FORMAT:
+        raise InvalidSnapshot([f"Not a {FORMAT} snapshot"])
+    if snapshot.get('version') != VERSION:
+        raise InvalidSnapshot([f"Unsupported snapshot version {snapshot.get('version')}; expected {VERSION}"])
+    sections = snapshot.get('sections')
+    if not isinstance(sections, dict):
+        raise InvalidSnapshot(['sections must be an object'])
+    unknown = set(sections) - set(SECTIONS)
+    if unknown:
+        errors.append(f"Unknown sections: {', '.join(sorted(unknown))}")
+
+    usernames = {row['username'] for row in db.execute('SELECT username FROM users')}
+    result = {}
+    for table, key in SECTIONS.items():
+        if table not in sections:
+            continue
+        rows = sections[table]
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            errors.append(f"{table} must be a list of objects")
+            continue
+        if key is None and len(rows) > 1:
+            errors.append(f"{table} holds a single row")
+            continue
+        cols = columns(db, table)
+        seen = set()
+        clean = []
+        for i, row in enumerate(rows):
+            where = f"{table}[{i}]"
+            extra = set(row) - set(cols)
+            if extra:
+                errors.append(f"{where}: unknown fields {', '.join(sorted(extra))}")
+                continue
+            bad = [name for name, value in row.items() if not isinstance(value, (str, int, float, type(None)))]
+            if bad:
+                errors.append(f"{where}: {', '.join(bad)} must be a string, number, boolean or null")
+                continue
+            row = {name: int(value) if isinstance(value, bool) else value for name, value in row.items()}
+            if key is not None:
+                missing = [name for name in key if row.get(name) in (None, '')]
+                if missing:
+                    errors.append(f"{where}: missing {', '.join(missing)}")
+                    continue
+                if _key(table, row) in seen:
+                    errors.append(f"{where}: duplicate {'/'.join(map(str, _key(table, row)))}")
+                    continue
+                seen.add(_key(table, row))
+            if table == 'services' and row.get('config') is not None:
+                # Rendered into daemon configs, so held to the same checks as the API
+                try:
+                    config = json.loads(row['config'])
+                except (TypeError, ValueError):
+                    errors.append(f"{where}: config is not valid JSON")
+                    continue
+                errors.extend(f"{where}: {error}" for error in check_service_config(row['name'], config))
+            if table == 'shares':
+                # Exported and rendered into daemon configs like any other share
+                error = check_share_name(row['name'])
+                if error is None and 'path' in row and share_path_error is not None:
+                    error = share_path_error(row['path'])
+                if error:
+                    errors.append(f"{where}: {error}")
+                    continue
+            if table == 'quotas':
+                if row['username'] not in usernames:
+                    errors.append(f"{where}: no user named {row['username']}")
+                soft, hard = row.get('soft_limit'), row.get('hard_limit')
+                if isinstance(soft, (int, float)) and isinstance(hard, (int, float)) and soft > hard:
+                    errors.append(f"{where}: soft_limit is above hard_limit")
+            clean.append(row)
+        result[table] = clean
+    if errors:
+        raise InvalidSnapshot(errors)
+    return result
+
+
+def _check_required(table, row, cols, label):
+    required = [name for name, needed in cols.items() if needed and row.get(name) is None]
+    if required:
+        raise InvalidSnapshot([f"{table} {label}: new rows need {', '.join(required)}"])
+
+
+def diff(db, sections, prune=False):
+    # {table: {'create': [rows], 'update': [(key, changes)], 'delete': [keys]}}
+    # for the sections given. Fields a row leaves out are left alone;
+    # existing rows missing from the snapshot are deleted only with prune.
+    plan = {}
+    for table, rows in sections.items():
+        key = SECTIONS[table]
+        cols = columns(db, table)
+        current = list(export_rows(db, table))
+        changes = {'create': [], 'update': [], 'delete': []}
+        if key is None:
+            if rows and not current:
+                _check_required(table, rows[0], cols, 'row')
+                changes['create'].append(rows[0])
+            elif rows:
+                delta = {name: value for name, value in rows[0].items() if current[0][name] != value}
+                if delta:
+                    changes['update'].append((None, delta))
+        else:
+            existing = {_key(table, row): row for row in current}
+            for row in rows:
+                old = existing.pop(_key(table, row), None)
+                if old is None:
+                    _check_required(table, row, cols, _label(table, _key(table, row)))
+                    changes['create'].append(row)
+                    continue
+                delta = {name: value for name, value in row.items() if name not in key and old[name] != value}
+                if delta:
+                    changes['update'].append((_key(table, row), delta))
+            if prune:
+                changes['delete'] = list(existing)
+        plan[table] = changes
+    return plan
+
+
+def _where(table):
+    if table == 'quotas':
+        return 'user_id = (SELECT id FROM users WHERE username = ?) AND path = ?'
+    return ' AND '.join(f'{name} = ?' for name in SECTIONS[table])
+
+
+def apply(db, plan, user_id=None):
+    # Runs inside the caller's transaction; nothing is committed here. Rows
+    # with the same set of fields go through one executemany.
+    for table, changes in plan.items():
+        if SECTIONS[table] is None:
+            for row in changes['create']:
+                names = list(row)
+                db.execute(f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+                           [row[name] for name in names])
+            for _, delta in changes['update']:
+                db.execute(f"UPDATE {table} SET {', '.join(f'{name} = ?' for name in delta)}", list(delta.values()))
+            continue
+
+        if changes['delete']:
+            db.executemany(f'DELETE FROM {table} WHERE {_where(table)}', changes['delete'])
+        groups = {}
+        for key, delta in changes['update']:
+            groups.setdefault(tuple(delta), []).append(list(delta.values()) + list(key))
+        for names, params in groups.items():
+            db.executemany(f"UPDATE {table} SET {', '.join(f'{name} = ?' for name in names)} WHERE {_where(table)}",
+                           params)
+        groups = {}
+        for row in changes['create']:
+            groups.setdefault(tuple(row), []).append(row)
+        for names, rows in groups.items():
+            # Quotas point at a user id rather than a name
+            stored = [name for name in names if name != 'username']
+            targets = list(stored)
+            placeholders = ['?'] * len(stored)
+            if table == 'quotas':
+                targets.append('user_id')
+                placeholders.append('(SELECT id FROM users WHERE username = ?)')
+            elif table in ('shares', 'backups'):
+                targets.append('created_by')
+                placeholders.append('?')
+            params = []
+            for row in rows:
+                item = [row[name] for name in stored]
+                if table == 'quotas':
+                    item.append(row['username'])
+                elif table in ('shares', 'backups'):
+                    item.append(user_id)
+                params.append(item)
+            db.executemany(f"INSERT INTO {table} ({', '.join(targets)}) VALUES ({', '.join(placeholders)})", params)
+
+
+def _label(table, key):
+    return '/'.join(map(str, key)) if key is not None else table
+
+
+def summary(plan, limit=50):
+    # Counts per section plus the first limit keys of each kind of change
+    result = {}
+    for table, changes in plan.items():
+        keyed = SECTIONS[table] is not None
+        result[table] = {
+            'create': len(changes['create']),
+            'update': len(changes['update']),
+            'delete': len(changes['delete']),
+            'created': [_label(table, _key(table, row) if keyed else None) for row in changes['create'][:limit]],
+            'updated': [{'key': _label(table, key), 'fields': sorted(delta)} for key, delta in changes['update'][:limit]],
+            'deleted': [_label(table, key) for key in changes['delete'][:limit]]
+        }
+    return result
@@ -0,0 +1,149 @@
+import os
+import stat as stat_module
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from hashing import HashCache, file_digest, partial_digest
+from recycle import TRASH_DIR
+
+
+def walk_files(root, min_size=1, errors=None, skip=()):
+    # Unreadable directories and entries are skipped; when errors is a list,
+    # each one is appended to it as (path, message). Directories whose path
+    # is in skip are not entered.
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.path not in skip:
+                                stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            st = entry.stat(follow_symlinks=False)
+                            if stat_module.S_ISREG(st.st_mode) and st.st_size >= min_size:
+                                yield entry.path, st
+                    except OSError as e:
+                        if errors is not None:
+                            errors.append((entry.path, str(e)))
+                        continue
+        except OSError as e:
+            if errors is not None:
+                errors.append((directory, str(e)))
+            continue
+
+
+def _hash_groups(candidates, kind, cache, pool, job):
+    # candidates: lists of (share_id, path, st) that may match. Every file
+    # missing from the cache is submitted up front, so thousands of small
+    # groups still keep all workers busy. Returns the groups that still
+    # collide as (digest, [file, ...]).
+    groups = defaultdict(list)
+    todo = []
+    for i, files in enumerate(candidates):
+        for f in files:
+            digest = cache.get(f[2], kind)
+            if digest:
+                groups[(i, digest)].append(f)
+                if job is not None and kind == 'full':
+                    job.advance(f[2].st_size)
+            else:
+                todo.append((i, f))
+
+    io = job.io if job is not None else None
+    if kind == 'partial':
+        futures = [(i, f, pool.submit(partial_digest, f[1], f[2].st_size, io)) for i, f in todo]
+    else:
+        futures = [(i, f, pool.submit(file_digest, f[1], io)) for i, f in todo]
+    for i, f, future in futures:
+        if job is not None:
+            job.check_cancelled(pool)
+        try:
+            digest = future.result()
+        except OSError:
+            continue
+        cache.put(f[2], kind, digest)
+        groups[(i, digest)].append(f)
+        if job is not None and kind == 'full':
+            job.advance(f[2].st_size)
+    return [(digest, group) for (_, digest), group in groups.items() if len(group) > 1]
+
+
+def scan(db, shares, job=None, min_size=1, workers=None):
+    # shares: rows with id, name and path
+    cache = HashCache(db)
+    seen_inodes = set()
+    by_size = defaultdict(list)
+    share_totals = {share['id']: {'files': 0, 'bytes': 0} for share in shares}
+
+    # Pass 1: group by size; hard links to the same inode only count once.
+    # Deleted files waiting in a share's recycle bin aren't duplicates.
+    for share in shares:
+        if job is not None:
+            job.update(message=f"Scanning {share['name']}")
+        trash = os.path.join(share['path'], TRASH_DIR)
+        for path, st in walk_files(share['path'], min_size, skip={trash}):
+            if (st.st_dev, st.st_ino) in seen_inodes:
+                continue
+            seen_inodes.add((st.st_dev, st.st_ino))
+            by_size[st.st_size].append((share['id'], path, st))
+            share_totals[share['id']]['files'] += 1
+            share_totals[share['id']]['bytes'] += st.st_size
+    candidates = [files for files in by_size.values() if len(files) > 1]
+    del by_size, seen_inodes
+
+    workers = workers or min(8, (os.cpu_count() or 2) * 2)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dedupe',
+                            initializer=job.worker_init if job is not None else None) as pool:
+        # Pass 2: partial hash (head + tail) within each size group
+        if job is not None:
+            job.update(message='Comparing partial hashes')
+        full_candidates = [group for _, group in _hash_groups(candidates, 'partial', cache, pool, job)]
+        cache.flush()
+
+        # Pass 3: full hash only where size and partial hash both collide
+        if job is not None:
+            job.update(done=0, total=sum(f[2].st_size for group in full_candidates for f in group),
+                       message='Comparing full hashes')
+        duplicate_groups = _hash_groups(full_candidates, 'full', cache, pool, job)
+        cache.flush()
+
+    return build_report(shares, share_totals, duplicate_groups)
+
+
+def build_report(shares, share_totals, duplicate_groups, max_groups=100):
+    order = {share['id']: i for i, share in enumerate(shares)}
+    per_share = {share['id']: {'duplicateFiles': 0, 'reclaimableBytes': 0} for share in shares}
+    groups = []
+    for digest, files in duplicate_groups:
+        # Keep the copy in the first-listed share, count the rest as reclaimable
+        files.sort(key=lambda f: (order[f[0]], f[1]))
+        size = files[0][2].st_size
+        for share_id, _, _ in files[1:]:
+            per_share[share_id]['duplicateFiles'] += 1
+            per_share[share_id]['reclaimableBytes'] += size
+        groups.append({
+            'hash': digest,
+            'size': size,
+            'count': len(files),
+            'reclaimableBytes': size * (len(files) - 1),
+            'paths': [f[1] for f in files]
+        })
+    groups.sort(key=lambda g: g['reclaimableBytes'], reverse=True)
+
+    return {
+        'shares': [{
+            'id': share['id'],
+            'name': share['name'],
+            'path': share['path'],
+            'files': share_totals[share['id']]['files'],
+            'bytes': share_totals[share['id']]['bytes'],
+            'duplicateFiles': per_share[share['id']]['duplicateFiles'],
+            'reclaimableBytes': per_share[share['id']]['reclaimableBytes']
+        } for share in shares],
+        'duplicateGroups': len(groups),
+        'reclaimableBytes': sum(g['reclaimableBytes'] for g in groups),
+        'groups': groups[:max_groups]
+    }
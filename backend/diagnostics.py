@@ -0,0 +1,188 @@
+import mmap
+import os
+import random
+import tempfile
+import threading
+import time
+
+SEQ_BLOCK = 1024 * 1024
+RANDOM_BLOCK = 4096
+NET_CHUNK = 1024 * 1024
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def _open(path, flags):
+    # O_DIRECT bypasses the page cache so reads measure the disk, not RAM;
+    # filesystems without it (tmpfs, some FUSE) fall back to buffered I/O
+    direct = getattr(os, 'O_DIRECT', 0)
+    if direct:
+        try:
+            return os.open(path, flags | direct), True
+        except OSError:
+            pass
+    return os.open(path, flags), False
+
+
+def _drop_cache(fd):
+    if hasattr(os, 'posix_fadvise'):
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def _rate(nbytes, elapsed):
+    return round(nbytes / elapsed / 1024**2, 1) if elapsed else None
+
+
+def disk_bench(job, directory, size=256 * 1024**2, random_seconds=5.0):
+    # Sequential write/read of a size-byte temp file in 1 MiB blocks, then
+    # 4 KiB random reads and writes for random_seconds each
+    size -= size % SEQ_BLOCK
+    fd_tmp, path = tempfile.mkstemp(dir=directory, prefix='.flexnas-bench-')
+    os.close(fd_tmp)
+    # mmap memory is page aligned, as O_DIRECT requires
+    buf = mmap.mmap(-1, SEQ_BLOCK)
+    buf.write(os.urandom(SEQ_BLOCK))
+    small = mmap.mmap(-1, RANDOM_BLOCK)
+    small.write(os.urandom(RANDOM_BLOCK))
+    result = {'directory': directory, 'sizeBytes': size}
+    if job is not None:
+        job.update(done=0, total=size * 2, message='Sequential write')
+    try:
+        fd, direct = _open(path, os.O_WRONLY)
+        result['direct'] = direct
+        try:
+            started = time.perf_counter()
+            for offset in range(0, size, SEQ_BLOCK):
+                if job is not None:
+                    job.check_cancelled()
+                    job.advance(SEQ_BLOCK)
+                os.pwrite(fd, buf, offset)
+            os.fsync(fd)
+            result['seqWriteMBps'] = _rate(size, time.perf_counter() - started)
+            if not direct:
+                _drop_cache(fd)
+        finally:
+            os.close(fd)
+
+        if job is not None:
+            job.update(message='Sequential read')
+        fd, _ = _open(path, os.O_RDONLY)
+        try:
+            started = time.perf_counter()
+            for offset in range(0, size, SEQ_BLOCK):
+                if job is not None:
+                    job.check_cancelled()
+                    job.advance(SEQ_BLOCK)
+                os.preadv(fd, [buf], offset)
+            result['seqReadMBps'] = _rate(size, time.perf_counter() - started)
+        finally:
+            os.close(fd)
+
+        blocks = size // RANDOM_BLOCK
+        for name, flags in (('randRead', os.O_RDONLY), ('randWrite', os.O_WRONLY)):
+            if job is not None:
+                job.update(message=f"Random {'read' if name == 'randRead' else 'write'}")
+            fd, _ = _open(path, flags)
+            latencies = []
+            try:
+                started = time.perf_counter()
+                deadline = started + random_seconds
+                now = started
+                while now < deadline:
+                    if job is not None and len(latencies) % 256 == 0:
+                        job.check_cancelled()
+                    offset = random.randrange(blocks) * RANDOM_BLOCK
+                    if flags == os.O_RDONLY:
+                        os.preadv(fd, [small], offset)
+                    else:
+                        os.pwrite(fd, small, offset)
+                    done = time.perf_counter()
+                    latencies.append(done - now)
+                    now = done
+                if flags != os.O_RDONLY:
+                    os.fsync(fd)
+                elapsed = time.perf_counter() - started
+            finally:
+                os.close(fd)
+            result[f'{name}Iops'] = round(len(latencies) / elapsed)
+            result[f'{name}MBps'] = _rate(len(latencies) * RANDOM_BLOCK, elapsed)
+            result[f'{name}LatencyMs'] = {'p50': round(_percentile(latencies, 50) * 1000, 3),
+                                          'p99': round(_percentile(latencies, 99) * 1000, 3)}
+        return result
+    finally:
+        buf.close()
+        small.close()
+        os.unlink(path)
+
+
+class NetBench:
+    # The browser drives the transfers (download then upload); the job waits
+    # for both and times them on the server side. The client can post its
+    # own timings, which are stored next to the server's.
+
+    def __init__(self, size, timeout=120):
+        self.size = size
+        self.timeout = timeout
+        self.result = {'sizeBytes': size}
+        self.client = None
+        self._phases = set()
+        self._done = threading.Event()
+
+    def download(self, job):
+        chunk = os.urandom(NET_CHUNK)  # incompressible, so gzip can't flatter the number
+        started = time.perf_counter()
+        sent = 0
+        try:
+            while sent < self.size:
+                if job.cancelled:
+                    return
+                part = chunk[:min(NET_CHUNK, self.size - sent)]
+                sent += len(part)
+                job.advance(len(part))
+                yield part
+            self.result['downloadMBps'] = _rate(sent, time.perf_counter() - started)
+            self._finish('download')
+        finally:
+            self.result['downloadBytes'] = sent
+
+    def upload(self, job, stream):
+        started = time.perf_counter()
+        received = 0
+        while True:
+            if job.cancelled:
+                break
+            chunk = stream.read(NET_CHUNK)
+            if not chunk:
+                break
+            received += len(chunk)
+            job.advance(len(chunk))
+        self.result['uploadBytes'] = received
+        self.result['uploadMBps'] = _rate(received, time.perf_counter() - started)
+        self._finish('upload')
+        return received
+
+    def report(self, client_result):
+        self.client = client_result
+        self._finish('client')
+
+    def _finish(self, phase):
+        self._phases.add(phase)
+        if {'download', 'upload'} <= self._phases:
+            self._done.set()
+
+    def wait(self, job):
+        deadline = time.monotonic() + self.timeout
+        while not self._done.wait(0.5):
+            job.check_cancelled()
+            if time.monotonic() > deadline:
+                raise TimeoutError('The client did not finish the transfers in time')
+        # Give the client a moment to post its own timings
+        if 'client' not in self._phases:
+            time.sleep(1.0)
+        return dict(self.result, client=self.client)
@@ -0,0 +1,282 @@
+import http.client
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+VIEWS = {
+    'system-status': '/api/system-status',
+    'volumes': '/api/volumes',
+    'shares': '/api/shares',
+    'backups': '/api/backups'
+}
+
+
+class NodeError(Exception):
+    pass
+
+
+class ConnectionPool:
+    # Keep-alive HTTP connections to one node, reused most recent first.
+    # A connection the peer closed while idle fails on its next use; that
+    # request is retried once on a fresh connection.
+
+    def __init__(self, url, size=4, timeout=5.0):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f"{url} is not an http(s) URL")
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            try:
+                conn, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                conn, reused = self.connection_class(self.host, self.port, timeout=self.timeout), False
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                try:
+                    self._idle.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+            return response.status, data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class Node:
+    # A peer backend. Only a refresh token is kept: each refresh rotates it,
+    # and the new one is handed to on_token to be stored. The old token is
+    # kept until a new one has arrived; if the peer rejects it (a rotation
+    # whose reply was lost revokes it anyway) the node needs a new login,
+    # and no further refreshes are sent until it gets one.
+
+    def __init__(self, row, on_token, timeout=3.0, pool_size=4):
+        self.id = row['id']
+        self.name = row['name']
+        self.url = row['url']
+        self.created_at = row['created_at']
+        self.refresh_token = row['refresh_token']
+        self.access_token = None
+        self.on_token = on_token
+        self.pool = ConnectionPool(row['url'], pool_size, timeout)
+        self.last_seen = None
+        self.last_error = None
+        self.needs_login = False
+        self._lock = threading.Lock()
+
+    def _refresh(self, stale):
+        with self._lock:
+            # Someone else already refreshed while we waited for the lock
+            if self.access_token is not None and self.access_token != stale:
+                return
+            if self.needs_login:
+                raise NodeError('The node rejected its refresh token; log in to it again')
+            status, body = self.pool.request('POST', '/api/token/refresh',
+                                             headers={'Authorization': f'Bearer {self.refresh_token}'})
+            if status in (401, 422):
+                self.needs_login = True
+                self.access_token = None
+                raise NodeError('The node rejected its refresh token; log in to it again')
+            if status != 200:
+                raise NodeError(f"Token refresh failed with HTTP {status}")
+            tokens = json.loads(body)
+            self.access_token = tokens['access_token']
+            self.refresh_token = tokens['refresh_token']
+            self.on_token(self.id, self.refresh_token)
+
+    def set_refresh_token(self, refresh_token):
+        with self._lock:
+            self.refresh_token = refresh_token
+            self.access_token = None
+            self.needs_login = False
+
+    def get(self, path):
+        for attempt in range(2):
+            token = self.access_token
+            if token is None:
+                self._refresh(None)
+                token = self.access_token
+            status, body = self.pool.request('GET', path, headers={'Authorization': f'Bearer {token}'})
+            if status == 401 and attempt == 0:
+                self._refresh(token)
+                continue
+            if status != 200:
+                raise NodeError(f"HTTP {status}")
+            return json.loads(body)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'url': self.url,
+            'createdAt': self.created_at,
+            'lastSeen': self.last_seen,
+            'lastError': self.last_error,
+            'needsLogin': self.needs_login
+        }
+
+
+def login(url, username, password, timeout=5.0):
+    # Returns a refresh token for the peer; the password is not kept
+    pool = ConnectionPool(url, 1, timeout)
+    try:
+        status, body = pool.request('POST', '/api/login', {'username': username, 'password': password})
+    finally:
+        pool.close()
+    if status != 200:
+        raise NodeError(f"Login to {url} failed with HTTP {status}")
+    return json.loads(body)['refresh_token']
+
+
+class Federation:
+    # Fans a view out to every peer at once and answers within timeout
+    # seconds whatever happens. Each node request may take up to
+    # node_timeout, which is longer; a node that hasn't replied in time is
+    # reported with its last known result; its request keeps running and
+    # refreshes the cache when it lands, and no second request is sent to
+    # it for that view in the meantime. Results younger than cache_ttl are
+    # served without asking the node again.
+
+    def __init__(self, get_db, timeout=3.0, node_timeout=10.0, cache_ttl=5.0, workers=16, pool_size=4):
+        self.get_db = get_db
+        self.timeout = timeout
+        self.node_timeout = node_timeout
+        self.cache_ttl = cache_ttl
+        self.pool_size = pool_size
+        self.nodes = {}
+        self._cache = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='federation')
+
+    def load(self):
+        with self.get_db() as db:
+            rows = db.execute('SELECT * FROM federation_nodes WHERE enabled = 1 ORDER BY name').fetchall()
+        with self._lock:
+            # Unchanged nodes keep their connections and access token
+            nodes = {}
+            for row in rows:
+                node = self.nodes.get(row['id'])
+                if node is None or node.url != row['url']:
+                    node = Node(row, self._store_token, self.node_timeout, self.pool_size)
+                nodes[row['id']] = node
+            for node_id, node in self.nodes.items():
+                if nodes.get(node_id) is not node:
+                    node.pool.close()
+            self.nodes = nodes
+            self._cache = {key: value for key, value in self._cache.items() if key[0] in nodes}
+
+    def _store_token(self, node_id, refresh_token):
+        with self.get_db() as db:
+            db.execute('UPDATE federation_nodes SET refresh_token = ? WHERE id = ?', (refresh_token, node_id))
+            db.commit()
+
+    def register(self, name, url, username, password, user_id=None):
+        refresh_token = login(url, username, password, self.node_timeout)
+        with self.get_db() as db:
+            node_id = db.execute('''
+                INSERT INTO federation_nodes (name, url, refresh_token, created_by) VALUES (?, ?, ?, ?)
+            ''', (name, url.rstrip('/'), refresh_token, user_id)).lastrowid
+            db.commit()
+        self.load()
+        return self.nodes[node_id]
+
+    def relogin(self, node_id, username, password):
+        # A fresh refresh token for a node that lost its own, without
+        # removing and registering it again
+        node = self.nodes[node_id]
+        refresh_token = login(node.url, username, password, self.node_timeout)
+        self._store_token(node_id, refresh_token)
+        node.set_refresh_token(refresh_token)
+        node.last_error = None
+        return node
+
+    def remove(self, node_id):
+        with self.get_db() as db:
+            db.execute('DELETE FROM federation_nodes WHERE id = ?', (node_id,))
+            db.commit()
+        self.load()
+
+    def _fetch(self, node, view):
+        try:
+            data = node.get(VIEWS[view])
+        except Exception as e:
+            node.last_error = str(e) or type(e).__name__
+            with self._lock:
+                entry = self._cache.setdefault((node.id, view), {'data': None, 'fetchedAt': None})
+                entry['error'] = node.last_error
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop((node.id, view), None)
+        node.last_seen = time.time()
+        node.last_error = None
+        with self._lock:
+            self._cache[(node.id, view)] = {'data': data, 'fetchedAt': node.last_seen, 'error': None}
+        return data
+
+    def query(self, view):
+        now = time.time()
+        pending = {}
+        with self._lock:
+            nodes = list(self.nodes.values())
+            for node in nodes:
+                key = (node.id, view)
+                cached = self._cache.get(key)
+                if cached and cached['fetchedAt'] and now - cached['fetchedAt'] < self.cache_ttl and not cached['error']:
+                    continue
+                if key not in self._inflight:
+                    self._inflight[key] = self._pool.submit(self._fetch, node, view)
+                pending[node.id] = self._inflight[key]
+        if pending:
+            wait(pending.values(), timeout=self.timeout)
+
+        results = []
+        for node in nodes:
+            future = pending.get(node.id)
+            status, error = 'ok', None
+            if future is not None:
+                if not future.done():
+                    status, error = 'timeout', f"No reply within {self.timeout:g} s"
+                elif future.exception() is not None:
+                    status, error = 'error', str(future.exception()) or type(future.exception()).__name__
+            cached = self._cache.get((node.id, view)) or {}
+            if status != 'ok' and cached.get('data') is not None:
+                status = 'stale'
+            fetched = cached.get('fetchedAt')
+            results.append({
+                'node': node.to_dict(),
+                'status': status,
+                'error': error,
+                'fetchedAt': fetched,
+                'ageSeconds': round(time.time() - fetched, 1) if fetched else None,
+                'data': cached.get('data')
+            })
+        return results
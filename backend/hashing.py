@@ -0,0 +1,106 @@
+import hashlib
+import mmap
+import os
+
+ALGORITHM = 'blake2b-256'
+CHUNK_SIZE = 8 * 1024 * 1024
+PARTIAL_SIZE = 64 * 1024
+
+
+def new_hash():
+    return hashlib.blake2b(digest_size=32)
+
+
+def file_digest(path, io=None):
+    h = new_hash()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return h.hexdigest()
+        try:
+            # hashlib releases the GIL for large buffers, so slices of a
+            # mapping hash in parallel across threads without extra copies
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                if hasattr(m, 'madvise'):
+                    m.madvise(mmap.MADV_SEQUENTIAL)
+                view = memoryview(m)
+                try:
+                    for offset in range(0, size, CHUNK_SIZE):
+                        if io is not None:
+                            io(min(CHUNK_SIZE, size - offset))
+                        h.update(view[offset:offset + CHUNK_SIZE])
+                finally:
+                    view.release()
+        except (ValueError, OSError):
+            # Some filesystems (FUSE, procfs) can't be mapped
+            f.seek(0)
+            while True:
+                block = f.read(CHUNK_SIZE)
+                if not block:
+                    break
+                if io is not None:
+                    io(len(block))
+                h.update(block)
+    return h.hexdigest()
+
+
+def partial_digest(path, size, io=None):
+    # Head and tail of the file; cheap filter before a full hash
+    if io is not None:
+        io(min(size, 2 * PARTIAL_SIZE), 2)
+    h = new_hash()
+    with open(path, 'rb') as f:
+        h.update(f.read(PARTIAL_SIZE))
+        if size > 2 * PARTIAL_SIZE:
+            f.seek(-PARTIAL_SIZE, os.SEEK_END)
+            h.update(f.read(PARTIAL_SIZE))
+        elif size > PARTIAL_SIZE:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+class HashCache:
+    # Hashes stored by (device, inode) and only trusted while size and
+    # mtime still match, so rescans only hash files that changed
+
+    def __init__(self, db):
+        self.db = db
+        self._pending = {}
+
+    def get(self, st, kind):
+        key = (st.st_dev, st.st_ino)
+        row = self._pending.get(key)
+        if row is None:
+            row = self.db.execute('''
+                SELECT size, mtime_ns, partial_hash, full_hash FROM file_hashes
+                WHERE device = ? AND inode = ? AND algorithm = ?
+            ''', (st.st_dev, st.st_ino, ALGORITHM)).fetchone()
+            if row is None:
+                return None
+            row = dict(zip(('size', 'mtime_ns', 'partial_hash', 'full_hash'), row))
+        if row['size'] != st.st_size or row['mtime_ns'] != st.st_mtime_ns:
+            return None
+        return row[f'{kind}_hash']
+
+    def put(self, st, kind, digest):
+        key = (st.st_dev, st.st_ino)
+        row = self._pending.get(key)
+        if row is None or row['size'] != st.st_size or row['mtime_ns'] != st.st_mtime_ns:
+            row = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                   'partial_hash': self.get(st, 'partial'), 'full_hash': self.get(st, 'full')}
+            self._pending[key] = row
+        row[f'{kind}_hash'] = digest
+        if len(self._pending) >= 5000:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        self.db.executemany('''
+            INSERT OR REPLACE INTO file_hashes
+                (device, inode, algorithm, size, mtime_ns, partial_hash, full_hash, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', [(dev, ino, ALGORITHM, row['size'], row['mtime_ns'], row['partial_hash'], row['full_hash'])
+              for (dev, ino), row in self._pending.items()])
+        self.db.commit()
+        self._pending.clear()
@@ -0,0 +1,147 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind, params=None, user_id=None, throttle=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params or {}
+        self.user_id = user_id
+        self.status = 'queued'
+        self.done = 0
+        self.total = None
+        self.message = ''
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self.throttle = throttle
+        self.limiter = throttle.limiter(kind) if throttle is not None else None
+
+    def update(self, done=None, total=None, message=None):
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+
+    def advance(self, amount=1):
+        self.done += amount
+
+    def io(self, nbytes, ops=1):
+        # Every background read/write goes through the shared throttle
+        if self.limiter is not None:
+            self.limiter.consume(nbytes, ops)
+
+    def worker_init(self):
+        # Initializer for a job's own worker pools
+        if self.throttle is not None:
+            self.throttle.lower_priority()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self, pool=None):
+        # Workers call this between units of work to stop promptly; queued
+        # work in the given executor is dropped rather than waited for
+        if self._cancel.is_set():
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+            raise JobCancelled()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'params': self.params,
+            'status': self.status,
+            'done': self.done,
+            'total': self.total,
+            'percent': round(100.0 * self.done / self.total, 1) if self.total else None,
+            'message': self.message,
+            'result': self.result,
+            'error': self.error,
+            'ioBytes': self.limiter.io_bytes if self.limiter else None,
+            'throttledSeconds': round(self.limiter.waited, 2) if self.limiter else None,
+            'createdAt': self.created_at,
+            'startedAt': self.started_at,
+            'finishedAt': self.finished_at
+        }
+
+
+class JobManager:
+    def __init__(self, max_workers=2, keep_finished=200, throttle=None):
+        self.throttle = throttle
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='job',
+            initializer=throttle.lower_priority if throttle is not None else None
+        )
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self.keep_finished = keep_finished
+
+    def submit(self, kind, fn, *args, params=None, user_id=None, executor=None, **kwargs):
+        # executor runs the job somewhere other than the shared, low-priority
+        # pool, e.g. benchmarks that must not be throttled
+        job = Job(kind, params, user_id, self.throttle if executor is None else None)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        (executor or self._pool).submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancelled:
+            job.status = 'cancelled'
+            job.finished_at = time.time()
+            return
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = 'completed'
+        except JobCancelled:
+            job.status = 'cancelled'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            traceback.print_exc()
+        finally:
+            job.finished_at = time.time()
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job.status in ('completed', 'failed', 'cancelled')]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list(self, kind=None):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job for job in jobs if kind is None or job.kind == kind]
+
+    def running(self, kind):
+        return [job for job in self.list(kind) if job.status in ('queued', 'running')]
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        job._cancel.set()
+        return job
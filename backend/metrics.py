@@ -0,0 +1,97 @@
+import threading
+import time
+import traceback
+
+
+class MetricsSampler:
+    # One sampler feeds every consumer (alerts, history, dashboards), so the
+    # cost doesn't grow with the number of readers
+
+    def __init__(self, interval=10):
+        self.interval = interval
+        self.latest = {}
+        self.latest_at = None
+        self._sources = []
+        self._subscribers = []
+        self._counters = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_source(self, fn):
+        # fn() -> {metric: value}; extra gauges like RAID or SMART state
+        self._sources.append(fn)
+
+    def subscribe(self, fn):
+        # fn(ts, samples) is called after every sample
+        self._subscribers.append(fn)
+
+    def start(self):
+        if self._thread is None:
+            import psutil
+            psutil.cpu_percent()  # prime the counter so the first sample is real
+            self._thread = threading.Thread(target=self._run, name='metrics-sampler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while not self._stop.is_set():
+            self.sample()
+            next_tick += self.interval
+            self._stop.wait(max(0, next_tick - time.monotonic()))
+
+    def _rate(self, key, value, now):
+        previous = self._counters.get(key)
+        self._counters[key] = (now, value)
+        if previous is None or now <= previous[0] or value < previous[1]:
+            return None
+        return (value - previous[1]) / (now - previous[0])
+
+    def collect(self, now):
+        import psutil
+        samples = {
+            'cpu': psutil.cpu_percent(),
+            'memory': psutil.virtual_memory().percent,
+            'disk': psutil.disk_usage('/').percent
+        }
+        for partition in psutil.disk_partitions():
+            try:
+                samples[f'disk:{partition.mountpoint}'] = psutil.disk_usage(partition.mountpoint).percent
+            except OSError:
+                continue
+
+        net = psutil.net_io_counters()
+        if net is not None:
+            for key, value in (('net:rx', net.bytes_recv), ('net:tx', net.bytes_sent)):
+                rate = self._rate(key, value, now)
+                if rate is not None:
+                    samples[key] = rate
+
+        for disk, io in (psutil.disk_io_counters(perdisk=True) or {}).items():
+            if disk.startswith(('loop', 'ram')):
+                continue
+            for key, value in ((f'io:{disk}:read', io.read_bytes), (f'io:{disk}:write', io.write_bytes)):
+                rate = self._rate(key, value, now)
+                if rate is not None:
+                    samples[key] = rate
+
+        for source in self._sources:
+            try:
+                samples.update(source())
+            except Exception:
+                traceback.print_exc()
+        return samples
+
+    def sample(self):
+        now = time.time()
+        samples = self.collect(now)
+        self.latest = samples
+        self.latest_at = now
+        for fn in self._subscribers:
+            try:
+                fn(now, samples)
+            except Exception:
+                traceback.print_exc()
+        return samples
@@ -0,0 +1,275 @@
+import errno
+import os
+import stat as stat_module
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from jobs import JobCancelled
+
+CHECKPOINT_INTERVAL = 5.0
+# Entries are changed through descriptors opened without following links
+OPEN_DIR = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC
+OPEN_FILE = os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK | os.O_CLOEXEC
+
+
+def resolve_user(owner):
+    # Username or numeric uid; None leaves ownership as it is
+    if owner is None or owner == '':
+        return None
+    if isinstance(owner, int) or str(owner).isdigit():
+        return int(owner)
+    import pwd
+    try:
+        return pwd.getpwnam(owner).pw_uid
+    except KeyError:
+        raise ValueError(f"Unknown user {owner}")
+
+
+def resolve_group(group):
+    if group is None or group == '':
+        return None
+    if isinstance(group, int) or str(group).isdigit():
+        return int(group)
+    import grp
+    try:
+        return grp.getgrnam(group).gr_gid
+    except KeyError:
+        raise ValueError(f"Unknown group {group}")
+
+
+def target_for(share, uid=None, gid=None):
+    # Owner always has full access. The group gets read-only or read-write
+    # access to match the share, and others get the same only on public
+    # shares. Directories are setgid so new files inherit the group.
+    group_dir = 0o5 if share['read_only'] else 0o7
+    group_file = 0o4 if share['read_only'] else 0o6
+    public = bool(share['is_public'])
+    return {
+        'uid': uid,
+        'gid': gid,
+        'dirMode': 0o2700 | group_dir << 3 | (group_dir if public else 0),
+        'fileMode': 0o600 | group_file << 3 | (group_file if public else 0)
+    }
+
+
+def _wanted_mode(target, st):
+    if stat_module.S_ISDIR(st.st_mode):
+        return target['dirMode']
+    mode = target['fileMode']
+    if st.st_mode & stat_module.S_IXUSR:
+        # Executables stay executable for everyone who can read them
+        mode |= (mode & 0o444) >> 2
+    return mode
+
+
+def _owner_change(target, st):
+    uid = -1 if target['uid'] is None or st.st_uid == target['uid'] else target['uid']
+    gid = -1 if target['gid'] is None or st.st_gid == target['gid'] else target['gid']
+    return uid, gid
+
+
+def _fix_fd(fd, target):
+    changed = False
+    st = os.fstat(fd)
+    uid, gid = _owner_change(target, st)
+    if uid != -1 or gid != -1:
+        os.fchown(fd, uid, gid)
+        changed = True
+        # chown clears setuid/setgid bits, so the mode has to be checked afresh
+        st = os.fstat(fd)
+    mode = _wanted_mode(target, st)
+    if stat_module.S_IMODE(st.st_mode) != mode:
+        os.fchmod(fd, mode)
+        changed = True
+    return changed
+
+
+def fix_entry(dir_fd, name, st, target):
+    # Compares first so a tree that already matches costs one stat per entry.
+    # Symlinks are only ever lchowned; devices, FIFOs and sockets are left
+    # alone. Anything else is opened without following links and must still
+    # be the entry that was listed, so swapping it for a link in between
+    # can't redirect the change.
+    uid, gid = _owner_change(target, st)
+    if stat_module.S_ISLNK(st.st_mode):
+        if uid == -1 and gid == -1:
+            return False
+        os.chown(name, uid, gid, dir_fd=dir_fd, follow_symlinks=False)
+        return True
+    is_dir = stat_module.S_ISDIR(st.st_mode)
+    if not is_dir and not stat_module.S_ISREG(st.st_mode):
+        return False
+    if uid == -1 and gid == -1 and stat_module.S_IMODE(st.st_mode) == _wanted_mode(target, st):
+        return False
+    fd = os.open(name, OPEN_DIR if is_dir else OPEN_FILE, dir_fd=dir_fd)
+    try:
+        now = os.fstat(fd)
+        if (now.st_dev, now.st_ino) != (st.st_dev, st.st_ino):
+            raise OSError(errno.ESTALE, 'Entry was replaced while being checked', name)
+        return _fix_fd(fd, target)
+    finally:
+        os.close(fd)
+
+
+def _open_under(root_fd, root, path):
+    # Opens a directory below root one component at a time, refusing links
+    # at every step, so a parent swapped for a symlink can't lead outside
+    rel = os.path.relpath(path, root)
+    fd = os.dup(root_fd)
+    if rel == os.curdir:
+        return fd
+    try:
+        for part in rel.split(os.sep):
+            if part in ('', os.curdir, os.pardir):
+                raise OSError(errno.EINVAL, 'Path is outside the share', path)
+            next_fd = os.open(part, OPEN_DIR, dir_fd=fd)
+            os.close(fd)
+            fd = next_fd
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+class _Frontier:
+    # Directories still to walk. A directory leaves the frontier only when
+    # its subdirectories have been added, so a snapshot is always enough to
+    # resume; directories in progress at the time are simply redone.
+
+    def __init__(self, pending):
+        self.stack = list(pending)
+        self.active = set()
+        self.scanned = 0
+        self.changed = 0
+        self.errors = 0
+        self.last_error = None
+        self.stopped = False
+        self._cond = threading.Condition()
+
+    def take(self):
+        with self._cond:
+            while not self.stack and self.active and not self.stopped:
+                self._cond.wait(0.5)
+            if not self.stack or self.stopped:
+                return None
+            path = self.stack.pop()
+            self.active.add(path)
+            return path
+
+    def finish(self, path, subdirs, scanned, changed, errors, last_error):
+        with self._cond:
+            self.active.discard(path)
+            self.stack.extend(subdirs)
+            self.scanned += scanned
+            self.changed += changed
+            self.errors += errors
+            if last_error:
+                self.last_error = last_error
+            self._cond.notify_all()
+
+    def stop(self):
+        with self._cond:
+            self.stopped = True
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            return {'pending': sorted(self.active) + self.stack, 'scanned': self.scanned,
+                    'changed': self.changed, 'errors': self.errors, 'lastError': self.last_error}
+
+
+def _walk_directory(root_fd, root, path, target, job):
+    subdirs, scanned, changed, errors, last_error = [], 0, 0, 0, None
+    try:
+        dir_fd = _open_under(root_fd, root, path)
+        try:
+            with os.scandir(dir_fd) as entries:
+                for entry in entries:
+                    if job is not None and job.cancelled:
+                        raise JobCancelled()
+                    entry_path = os.path.join(path, entry.name)
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                        if fix_entry(dir_fd, entry.name, st, target):
+                            changed += 1
+                            if job is not None:
+                                job.io(0)
+                        if stat_module.S_ISDIR(st.st_mode):
+                            subdirs.append(entry_path)
+                    except OSError as e:
+                        errors += 1
+                        last_error = f"{entry_path}: {e.strerror or e}"
+                    scanned += 1
+        finally:
+            os.close(dir_fd)
+    except OSError as e:
+        errors += 1
+        last_error = f"{path}: {e.strerror or e}"
+    return subdirs, scanned, changed, errors, last_error
+
+
+def apply(root, target, job=None, pending=None, workers=None, checkpoint=None,
+          checkpoint_interval=CHECKPOINT_INTERVAL):
+    # Walks root with parallel scandir workers. pending is the frontier from
+    # an earlier checkpoint; checkpoint(state) is called every
+    # checkpoint_interval seconds and once at the end.
+    try:
+        root_fd = os.open(root, OPEN_DIR)
+    except NotADirectoryError:
+        raise ValueError(f"{root} is not a directory")
+    except OSError as e:
+        if e.errno == errno.ELOOP:
+            raise ValueError(f"{root} is a symlink")
+        raise
+    try:
+        return _apply(root_fd, root, target, job, pending, workers, checkpoint, checkpoint_interval)
+    finally:
+        os.close(root_fd)
+
+
+def _apply(root_fd, root, target, job, pending, workers, checkpoint, checkpoint_interval):
+    if pending is None:
+        _fix_fd(root_fd, target)
+        pending = [root]
+    frontier = _Frontier(pending)
+    workers = workers or min(8, (os.cpu_count() or 2) * 2)
+
+    def worker():
+        while True:
+            path = frontier.take()
+            if path is None:
+                return
+            try:
+                frontier.finish(path, *_walk_directory(root_fd, root, path, target, job))
+            except JobCancelled:
+                frontier.stop()
+                return
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='permissions',
+                            initializer=job.worker_init if job is not None else None) as pool:
+        futures = [pool.submit(worker) for _ in range(workers)]
+        last = time.monotonic()
+        while True:
+            finished, running = wait(futures, timeout=1.0)
+            state = frontier.snapshot()
+            if job is not None:
+                job.update(done=state['scanned'],
+                           message=f"{state['scanned']} checked, {state['changed']} changed, "
+                                   f"{len(state['pending'])} directories pending")
+                if job.cancelled:
+                    frontier.stop()
+            if not running:
+                break
+            if checkpoint is not None and time.monotonic() - last >= checkpoint_interval:
+                checkpoint(state)
+                last = time.monotonic()
+        for future in futures:
+            future.result()
+
+    state = frontier.snapshot()
+    if checkpoint is not None:
+        checkpoint(state)
+    if job is not None and job.cancelled:
+        raise JobCancelled()
+    return state
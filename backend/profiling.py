@@ -0,0 +1,85 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+SORT_KEYS = ('cumulative', 'tottime', 'calls')
+REPORT_LINES = 60
+
+
+class RequestProfile:
+    # cProfile for one request. It hooks only the thread that enables it, so
+    # other requests served at the same time are neither slowed nor counted.
+
+    def __init__(self, sort='cumulative'):
+        self.sort = sort if sort in SORT_KEYS else 'cumulative'
+        self.profiler = cProfile.Profile()
+        self.started = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+        return time.perf_counter() - self.started
+
+    def report(self, lines=REPORT_LINES):
+        out = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=out)
+        stats.strip_dirs().sort_stats(self.sort).print_stats(lines)
+        return out.getvalue()
+
+
+def _label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample(job, seconds, interval=0.005):
+    # Wall-clock sampling of every thread in the process: each tick walks
+    # the current frame of each thread, so time spent waiting on locks,
+    # sockets and SQLite shows up as well as time on the CPU. Returns
+    # Counter of 'thread;outer;...;inner' stacks.
+    counts = Counter()
+    me = threading.get_ident()
+    names = {}
+    deadline = time.monotonic() + seconds
+    ticks = 0
+    while time.monotonic() < deadline:
+        if job is not None and ticks % 100 == 0:
+            job.check_cancelled()
+            job.update(done=round(seconds - (deadline - time.monotonic()), 1))
+        if ticks % 200 == 0:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f'thread-{ident}'))
+            counts[';'.join(reversed(stack))] += 1
+        ticks += 1
+        time.sleep(interval)
+    return counts
+
+
+def collapsed(counts):
+    # The folded format flamegraph.pl, speedscope and inferno read
+    return ''.join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+def top_frames(counts, limit=20):
+    # Innermost frames by share of samples
+    inner = Counter()
+    for stack, count in counts.items():
+        inner[stack.rsplit(';', 1)[-1]] += count
+    total = sum(counts.values()) or 1
+    return [{'frame': frame, 'samples': count, 'percent': round(count * 100 / total, 1)}
+            for frame, count in inner.most_common(limit)]
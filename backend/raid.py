@@ -0,0 +1,136 @@
+import re
+import threading
+import time
+
+ARRAY_LINE = re.compile(r'^(md\w+)\s*:\s*(\w+)\s+(?:\((\w[\w-]*)\)\s+)?(?:(raid\d+|linear|multipath)\s+)?(.*)$')
+MEMBER = re.compile(r'(\w+)\[(\d+)\](?:\((\w)\))?')
+STATUS = re.compile(r'(\d+) blocks.*?\[(\d+)/(\d+)\]\s+\[([U_]+)\]')
+PROGRESS = re.compile(
+    r'(resync|recovery|reshape|check|repair)\s*=\s*([\d.]+)%\s*\((\d+)/(\d+)\)'
+    r'(?:\s*finish=([\d.]+)min)?(?:\s*speed=(\d+)K/sec)?'
+)
+DELAYED = re.compile(r'(resync|recovery|reshape|check)\s*=\s*(DELAYED|PENDING)')
+OPERATION_STATES = {
+    'recovery': 'rebuilding',
+    'reshape': 'reshaping',
+    'resync': 'resyncing',
+    'check': 'checking',
+    'repair': 'repairing'
+}
+
+
+def parse_mdstat(text):
+    arrays = []
+    current = None
+    for line in text.splitlines():
+        match = ARRAY_LINE.match(line)
+        if match:
+            name, activity, readonly, level, members = match.groups()
+            current = {
+                'name': name,
+                'active': activity == 'active',
+                'readOnly': readonly in ('read-only', 'auto-read-only'),
+                'level': level,
+                'members': [{'device': dev, 'slot': int(slot),
+                             'state': {'F': 'faulty', 'S': 'spare', 'W': 'write-mostly'}.get(flag, 'active')}
+                            for dev, slot, flag in MEMBER.findall(members)],
+                'blocks': None,
+                'raidDisks': None,
+                'activeDisks': None,
+                'layout': None,
+                'operation': None,
+                'progress': None,
+                'speed': None,
+                'eta': None
+            }
+            arrays.append(current)
+            continue
+        if current is None:
+            continue
+        match = STATUS.search(line)
+        if match:
+            current['blocks'] = int(match.group(1))
+            current['raidDisks'] = int(match.group(2))
+            current['activeDisks'] = int(match.group(3))
+            current['layout'] = match.group(4)
+            continue
+        match = PROGRESS.search(line)
+        if match:
+            operation, percent, _, _, finish, speed = match.groups()
+            current['operation'] = operation
+            current['progress'] = float(percent)
+            current['eta'] = round(float(finish) * 60) if finish else None
+            current['speed'] = int(speed) * 1024 if speed else None
+            continue
+        match = DELAYED.search(line)
+        if match:
+            current['operation'] = match.group(1)
+            current['progress'] = 0.0
+        elif not line.strip():
+            current = None
+
+    for array in arrays:
+        array['degraded'] = any(m['state'] == 'faulty' for m in array['members']) or \
+            bool(array['raidDisks'] and array['activeDisks'] < array['raidDisks'])
+        array['state'] = array_state(array)
+    return arrays
+
+
+def array_state(array):
+    if not array['active']:
+        return 'inactive'
+    if array['operation'] == 'recovery':
+        return 'rebuilding'
+    if array['degraded']:
+        return 'degraded'
+    return OPERATION_STATES.get(array['operation'], 'clean')
+
+
+class ArrayMonitor:
+    def __init__(self, path='/proc/mdstat', interval=1.0, on_change=None):
+        self.path = path
+        self.interval = interval
+        self.on_change = on_change
+        self.arrays = []
+        self.available = False
+        self.updated_at = None
+        self._raw = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='mdstat-monitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.interval)
+
+    def refresh(self):
+        try:
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+        except OSError:
+            self.available = False
+            return False
+        self.available = True
+        self.updated_at = time.time()
+        # The common case is an unchanged file: one read and one compare
+        if raw == self._raw:
+            return False
+        self._raw = raw
+        arrays = parse_mdstat(raw.decode('utf-8', 'replace'))
+        previous = {array['name']: array['state'] for array in self.arrays}
+        self.arrays = arrays
+        if self.on_change is not None:
+            for array in arrays:
+                if previous.get(array['name']) != array['state']:
+                    self.on_change(array, previous.get(array['name']))
+            for name in previous.keys() - {array['name'] for array in arrays}:
+                self.on_change({'name': name, 'state': 'removed'}, previous[name])
+        return True
@@ -0,0 +1,173 @@
+import os
+import stat as stat_module
+import threading
+import time
+import traceback
+import uuid
+
+TRASH_DIR = '.recycle'
+
+
+class RecycleBin:
+    # Deletes are a rename into <share>/.recycle, recorded in the recycle_bin
+    # table; listing and restore only ever read that table. A background
+    # purger sizes new entries, expires old ones, keeps each share's bin
+    # under max_bytes and removes trees a batch at a time through the I/O
+    # throttle.
+
+    def __init__(self, get_db, throttle=None, max_age_days=30, max_bytes=None, interval=60, batch=2000):
+        self.get_db = get_db
+        self.throttle = throttle
+        self.limiter = throttle.limiter('recycle_purge') if throttle is not None else None
+        self.max_age = max_age_days * 86400 if max_age_days else None
+        self.max_bytes = max_bytes or None
+        self.interval = interval
+        self.batch = batch
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def trash_path(self, share_path):
+        return os.path.join(share_path, TRASH_DIR)
+
+    def delete(self, share, path, user_id=None):
+        trash = self.trash_path(share['path'])
+        os.makedirs(trash, mode=0o700, exist_ok=True)
+        st = os.lstat(path)
+        name = uuid.uuid4().hex
+        # Same filesystem, so this is O(1) however big the tree is; a path on
+        # another mount fails with EXDEV instead of turning into a copy
+        os.rename(path, os.path.join(trash, name))
+        is_dir = stat_module.S_ISDIR(st.st_mode)
+        with self.get_db() as db:
+            item_id = db.execute('''
+                INSERT INTO recycle_bin (share_id, trash_path, original_path, is_dir, size, deleted_by, deleted_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (share['id'], os.path.join(trash, name), path, int(is_dir),
+                  None if is_dir else st.st_size, user_id, time.time())).lastrowid
+            db.commit()
+            return db.execute('SELECT * FROM recycle_bin WHERE id = ?', (item_id,)).fetchone()
+
+    def restore(self, item, target=None):
+        target = target or item['original_path']
+        if os.path.lexists(target):
+            raise FileExistsError(target)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.rename(item['trash_path'], target)
+        with self.get_db() as db:
+            db.execute('DELETE FROM recycle_bin WHERE id = ?', (item['id'],))
+            db.commit()
+        return target
+
+    def purge(self, item_id):
+        # Queues the item for removal by the purger
+        with self.get_db() as db:
+            db.execute("UPDATE recycle_bin SET status = 'purging' WHERE id = ?", (item_id,))
+            db.commit()
+        self._wake.set()
+
+    def _consume(self, ops=1):
+        if self.limiter is not None:
+            self.limiter.consume(0, ops)
+
+    def _measure(self, path):
+        total = 0
+        stack = [path]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        self._consume()
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            else:
+                                total += entry.stat(follow_symlinks=False).st_size
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return total
+
+    def _remove_some(self, path, budget):
+        # Deletes up to budget entries, deepest first; True once path is gone
+        if not os.path.lexists(path):
+            return True
+        if not stat_module.S_ISDIR(os.lstat(path).st_mode):
+            os.unlink(path)
+            return True
+        removed = 0
+        for root, dirs, files in os.walk(path, topdown=False):
+            for name in files + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+                os.unlink(os.path.join(root, name))
+                self._consume()
+                removed += 1
+                if removed >= budget:
+                    return False
+            os.rmdir(root)
+            removed += 1
+        return True
+
+    def run_once(self):
+        now = time.time()
+        with self.get_db() as db:
+            for item in db.execute("SELECT id, trash_path FROM recycle_bin WHERE size IS NULL AND status = 'trashed'").fetchall():
+                db.execute('UPDATE recycle_bin SET size = ? WHERE id = ?', (self._measure(item['trash_path']), item['id']))
+                db.commit()
+
+            if self.max_age:
+                db.execute("UPDATE recycle_bin SET status = 'purging' WHERE status = 'trashed' AND deleted_at < ?",
+                           (now - self.max_age,))
+            if self.max_bytes:
+                # Oldest first until every share's bin fits again
+                for share in db.execute('''
+                    SELECT share_id, SUM(size) AS used FROM recycle_bin WHERE status = 'trashed'
+                    GROUP BY share_id HAVING SUM(size) > ?
+                ''', (self.max_bytes,)).fetchall():
+                    used = share['used']
+                    for item in db.execute('''
+                        SELECT id, size FROM recycle_bin WHERE share_id = ? AND status = 'trashed' ORDER BY deleted_at
+                    ''', (share['share_id'],)).fetchall():
+                        if used <= self.max_bytes:
+                            break
+                        db.execute("UPDATE recycle_bin SET status = 'purging' WHERE id = ?", (item['id'],))
+                        used -= item['size'] or 0
+            db.commit()
+
+            budget = self.batch
+            for item in db.execute("SELECT id, trash_path FROM recycle_bin WHERE status = 'purging' ORDER BY id").fetchall():
+                try:
+                    done = self._remove_some(item['trash_path'], budget)
+                except OSError as e:
+                    db.execute('UPDATE recycle_bin SET last_error = ? WHERE id = ?', (str(e), item['id']))
+                    db.commit()
+                    continue
+                if not done:
+                    # Out of budget for this round; the rest goes next time
+                    return True
+                db.execute('DELETE FROM recycle_bin WHERE id = ?', (item['id'],))
+                db.commit()
+        return False
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='recycle-purger', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        if self.throttle is not None:
+            self.throttle.lower_priority()
+        while not self._stop.is_set():
+            try:
+                more = self.run_once()
+            except Exception:
+                traceback.print_exc()
+                more = False
+            # Unfinished removals continue right away, still paced by the throttle
+            if not more:
+                self._wake.wait(self.interval)
+                self._wake.clear()
@@ -0,0 +1,501 @@
+import fcntl
+import hashlib
+import json
+import lzma
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from dedupe import walk_files
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is used without it
+    zstandard = None
+
+REPO_PREFIX = 'repo:'
+REPO_VERSION = 1
+MIN_CHUNK = 128 * 1024
+MAX_CHUNK = 2 * 1024 * 1024
+ANCHOR_RUN = 18  # ~384 KiB average chunk on high-entropy data
+READ_SIZE = 16 * 1024 * 1024
+PACK_SIZE = 64 * 1024 * 1024
+REPACK_BELOW = 0.5  # repack packs that are less than half live
+INDEX_RECORD = struct.Struct('<32sIQII')  # hash, pack, offset, stored, raw
+MAX_LISTED = 1000
+
+CODEC_TAGS = {'zstd': b'z', 'zlib': b'Z', 'lzma': b'x', 'none': b'n'}
+
+# Content-defined chunking without a per-byte Python loop: every byte value
+# is mapped to 0 or 1 by a fixed pseudo-random table, and a chunk ends after
+# the first run of ANCHOR_RUN ones past MIN_CHUNK. translate() and find()
+# run in C, and a boundary depends only on the bytes right before it, so an
+# insertion early in a file only changes the chunks around it.
+ANCHOR_TABLE = bytes(hashlib.blake2b(bytes([b]), key=b'flexnas-cdc').digest()[0] & 1
+                     for b in range(256))
+ANCHOR = b'\x01' * ANCHOR_RUN
+
+
+def is_repository(destination):
+    return destination.startswith(REPO_PREFIX)
+
+
+def repository_path(destination):
+    return destination[len(REPO_PREFIX):]
+
+
+def default_compression():
+    return 'zstd' if zstandard is not None else 'zlib'
+
+
+def chunk_stream(f, io=None):
+    buf = b''
+    pos = 0
+    eof = False
+    while not eof:
+        data = f.read(READ_SIZE)
+        eof = not data
+        if io is not None and data:
+            io(len(data))
+        buf = buf[pos:] + data
+        anchors = buf.translate(ANCHOR_TABLE)
+        pos = 0
+        while pos < len(buf):
+            limit = min(len(buf), pos + MAX_CHUNK)
+            i = anchors.find(ANCHOR, pos + MIN_CHUNK - ANCHOR_RUN, limit)
+            if i != -1:
+                end = i + ANCHOR_RUN
+            elif limit == pos + MAX_CHUNK or eof:
+                end = limit
+            else:
+                break  # need more data to decide
+            yield buf[pos:end]
+            pos = end
+
+
+_local = threading.local()
+
+
+def _compress(codec, data):
+    if codec == 'zstd':
+        if not hasattr(_local, 'zstd'):
+            _local.zstd = zstandard.ZstdCompressor(level=3)
+        out = _local.zstd.compress(data)
+    elif codec == 'zlib':
+        out = zlib.compress(data, 3)
+    elif codec == 'lzma':
+        out = lzma.compress(data, preset=1)
+    else:
+        out = None
+    if out is None or len(out) >= len(data):
+        return b'n' + data
+    return CODEC_TAGS[codec] + out
+
+
+def _decompress(blob):
+    tag, payload = blob[:1], blob[1:]
+    if tag == b'n':
+        return payload
+    if tag == b'Z':
+        return zlib.decompress(payload)
+    if tag == b'x':
+        return lzma.decompress(payload)
+    if tag == b'z':
+        if zstandard is None:
+            raise RuntimeError('Chunk is zstd-compressed but zstandard is not installed')
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise ValueError(f"Unknown chunk codec {tag!r}")
+
+
+class Repository:
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, 'config.json')) as f:
+            self.config = json.load(f)
+        self.index = {}  # hash -> (pack, offset, stored, raw)
+        self._pack = None
+        self._pack_id = None
+        self._lock_file = open(os.path.join(root, 'lock'), 'a+')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        self._load_index()
+
+    @classmethod
+    def open(cls, root, create=False, compression=None):
+        if not os.path.exists(os.path.join(root, 'config.json')):
+            if not create:
+                raise FileNotFoundError(f"No backup repository at {root}")
+            for name in ('packs', 'snapshots'):
+                os.makedirs(os.path.join(root, name), exist_ok=True)
+            with open(os.path.join(root, 'config.json'), 'w') as f:
+                json.dump({
+                    'version': REPO_VERSION,
+                    'id': uuid.uuid4().hex,
+                    'compression': compression or default_compression(),
+                    'chunker': {'min': MIN_CHUNK, 'max': MAX_CHUNK, 'anchor': ANCHOR_RUN}
+                }, f)
+        return cls(root)
+
+    def close(self):
+        if self._pack is not None:
+            self._finish_pack()
+        self._lock_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Chunk index
+
+    def _index_path(self):
+        return os.path.join(self.root, 'index')
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # A torn trailing record from a crash is ignored
+        usable = len(data) - len(data) % INDEX_RECORD.size
+        for digest, pack, offset, stored, raw in INDEX_RECORD.iter_unpack(data[:usable]):
+            self.index[digest] = (pack, offset, stored, raw)
+
+    def _pack_path(self, pack_id):
+        return os.path.join(self.root, 'packs', f"{pack_id:08d}.pack")
+
+    def _next_pack_id(self):
+        ids = [int(name.split('.')[0]) for name in os.listdir(os.path.join(self.root, 'packs'))
+               if name.endswith('.pack')]
+        return max(ids, default=0) + 1
+
+    def _open_pack(self):
+        self._pack_id = self._next_pack_id()
+        self._pack = open(self._pack_path(self._pack_id), 'ab')
+        self._pending_records = []
+
+    def _finish_pack(self):
+        # Pack data is durable before the index points at it
+        self._pack.flush()
+        os.fsync(self._pack.fileno())
+        self._pack.close()
+        self._pack = None
+        if self._pending_records:
+            with open(self._index_path(), 'ab') as f:
+                f.write(b''.join(self._pending_records))
+                f.flush()
+                os.fsync(f.fileno())
+        self._pending_records = []
+
+    def put(self, digest, blob, raw_len):
+        if digest in self.index:
+            return False
+        if self._pack is None:
+            self._open_pack()
+        offset = self._pack.tell()
+        self._pack.write(blob)
+        record = (self._pack_id, offset, len(blob), raw_len)
+        self.index[digest] = record
+        self._pending_records.append(INDEX_RECORD.pack(digest, *record))
+        if offset + len(blob) >= PACK_SIZE:
+            self._finish_pack()
+        return True
+
+    def flush(self):
+        if self._pack is not None:
+            self._finish_pack()
+
+    def read(self, digest, handles=None):
+        pack, offset, stored, _ = self.index[digest]
+        if handles is not None and pack in handles:
+            f = handles[pack]
+        else:
+            f = open(self._pack_path(pack), 'rb')
+            if handles is not None:
+                handles[pack] = f
+        try:
+            f.seek(offset)
+            return _decompress(f.read(stored))
+        finally:
+            if handles is None:
+                f.close()
+
+    # Snapshots
+
+    def snapshots(self, backup_id=None):
+        result = []
+        for name in os.listdir(os.path.join(self.root, 'snapshots')):
+            if name.endswith('.tmp'):
+                continue
+            snapshot = self.load_snapshot(name)
+            if backup_id is None or snapshot['backupId'] == backup_id:
+                result.append(snapshot)
+        return sorted(result, key=lambda snapshot: snapshot['time'])
+
+    def load_snapshot(self, snapshot_id):
+        with open(os.path.join(self.root, 'snapshots', snapshot_id), 'rb') as f:
+            return json.loads(zlib.decompress(f.read()))
+
+    def save_snapshot(self, snapshot):
+        # Chunks first, then the snapshot that references them
+        self.flush()
+        path = os.path.join(self.root, 'snapshots', snapshot['id'])
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(zlib.compress(json.dumps(snapshot, separators=(',', ':')).encode('utf-8')))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+
+    def delete_snapshot(self, snapshot_id):
+        os.remove(os.path.join(self.root, 'snapshots', snapshot_id))
+
+    def prune(self, backup_id, retention_days, now=None):
+        now = now or time.time()
+        snapshots = self.snapshots(backup_id)
+        removed = []
+        # The newest snapshot is always kept, however old it is
+        for snapshot in snapshots[:-1]:
+            if now - snapshot['time'] > retention_days * 86400:
+                self.delete_snapshot(snapshot['id'])
+                removed.append(snapshot['id'])
+        return removed
+
+    def gc(self):
+        self.flush()
+        live = set()
+        for snapshot in self.snapshots():
+            for entry in snapshot['files'].values():
+                live.update(bytes.fromhex(h) for h in entry[3])
+
+        pack_live, pack_total = {}, {}
+        for digest, (pack, _, stored, _) in self.index.items():
+            pack_total[pack] = pack_total.get(pack, 0) + stored
+            if digest in live:
+                pack_live[pack] = pack_live.get(pack, 0) + stored
+
+        # Mostly-dead packs have their live chunks copied forward
+        repack = {pack for pack, total in pack_total.items()
+                  if pack_live.get(pack, 0) < total * REPACK_BELOW}
+        dead_chunks = len(self.index) - len(live & self.index.keys())
+        by_pack = {}
+        for digest, record in self.index.items():
+            if record[0] in repack and digest in live:
+                by_pack.setdefault(record[0], []).append((digest, record))
+        moved = 0
+        for pack, records in by_pack.items():
+            with open(self._pack_path(pack), 'rb') as f:
+                for digest, (_, offset, stored, raw) in sorted(records, key=lambda r: r[1][1]):
+                    f.seek(offset)
+                    blob = f.read(stored)
+                    del self.index[digest]
+                    self.put(digest, blob, raw)
+                    moved += 1
+        self.flush()
+
+        # Rewrite the index with live chunks only, then drop old packs
+        self.index = {digest: record for digest, record in self.index.items() if digest in live}
+        tmp = f"{self._index_path()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(b''.join(INDEX_RECORD.pack(digest, *record)
+                             for digest, record in self.index.items()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._index_path())
+        freed = 0
+        for pack in repack:
+            path = self._pack_path(pack)
+            freed += os.path.getsize(path)
+            os.remove(path)
+        return {'removedChunks': dead_chunks, 'repackedChunks': moved,
+                'removedPacks': len(repack), 'freedBytes': freed}
+
+    def stats(self):
+        stored = sum(record[2] for record in self.index.values())
+        raw = sum(record[3] for record in self.index.values())
+        return {'chunks': len(self.index), 'storedBytes': stored, 'rawBytes': raw}
+
+
+def _prepare_chunk(repo, chunk, codec):
+    # Worker side: hash, and compress only chunks the repository lacks
+    digest = hashlib.blake2b(chunk, digest_size=32).digest()
+    if digest in repo.index:
+        return digest, None, len(chunk)
+    return digest, _compress(codec, chunk), len(chunk)
+
+
+def ingest(repo, source, backup_id, previous=None, full=False, job=None, workers=None):
+    codec = repo.config['compression']
+    previous_files = previous['files'] if previous and not full else {}
+    files = {}
+    stats = {'files': 0, 'bytes': 0, 'readBytes': 0, 'newChunks': 0, 'newBytes': 0, 'storedBytes': 0}
+    unreadable = []
+    errors = []
+    workers = workers or min(8, (os.cpu_count() or 2) * 2)
+    in_flight = deque()
+
+    def drain(limit):
+        while len(in_flight) > limit:
+            chunks, future = in_flight.popleft()
+            digest, blob, raw_len = future.result()
+            if blob is not None and repo.put(digest, blob, raw_len):
+                stats['newChunks'] += 1
+                stats['newBytes'] += raw_len
+                stats['storedBytes'] += len(blob)
+            chunks.append(digest.hex())
+            if job is not None:
+                job.advance(raw_len)
+
+    io = job.io if job is not None else None
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='repo',
+                            initializer=job.worker_init if job is not None else None) as pool:
+        for path, st in walk_files(source, min_size=0, errors=unreadable):
+            if job is not None:
+                job.check_cancelled(pool)
+            rel = os.path.relpath(path, source)
+            stats['files'] += 1
+            stats['bytes'] += st.st_size
+            old = previous_files.get(rel)
+            if old and old[0] == st.st_size and old[1] == st.st_mtime_ns \
+                    and all(bytes.fromhex(h) in repo.index for h in old[3]):
+                files[rel] = old
+                if job is not None:
+                    job.advance(st.st_size)
+                continue
+
+            chunks = []
+            files[rel] = [st.st_size, st.st_mtime_ns, st.st_mode & 0o7777, chunks]
+            try:
+                with open(path, 'rb') as f:
+                    for chunk in chunk_stream(f, io):
+                        stats['readBytes'] += len(chunk)
+                        in_flight.append((chunks, pool.submit(_prepare_chunk, repo, chunk, codec)))
+                        # Bounded pipeline: reading overlaps hashing and compression
+                        drain(workers * 2)
+            except OSError as e:
+                del files[rel]
+                errors.append({'path': rel, 'error': str(e)})
+        drain(0)
+    repo.flush()
+
+    # Whatever sat under a path the walk could not read is carried over
+    # from the previous snapshot rather than dropped from this one
+    skipped = {os.path.relpath(path, source) for path, _ in unreadable}
+    prefixes = tuple(os.path.join(rel, '') for rel in skipped)
+    for rel, old in (previous['files'] if previous else {}).items():
+        if rel not in files and (rel in skipped or rel.startswith(prefixes)) \
+                and all(bytes.fromhex(h) in repo.index for h in old[3]):
+            files[rel] = old
+    errors[:0] = [{'path': os.path.relpath(path, source), 'error': message} for path, message in unreadable]
+    stats['errors'] = errors[:MAX_LISTED]
+    return files, stats
+
+
+def run(db, backup, job=None, workers=None):
+    source = backup['source_path']
+    if not os.path.isdir(source):
+        raise FileNotFoundError(f"Source path {source} does not exist")
+    root = repository_path(backup['destination_path'])
+    started = time.time()
+    with Repository.open(root, create=True) as repo:
+        existing = repo.snapshots(backup['id'])
+        previous = existing[-1] if existing else None
+        if job is not None:
+            job.update(done=0, total=sum(st.st_size for _, st in walk_files(source, min_size=0)),
+                       message='Chunking and compressing')
+        files, stats = ingest(repo, source, backup['id'], previous,
+                              full=backup['type'] == 'full', job=job, workers=workers)
+        snapshot_id = f"{int(started)}-{backup['id']}-{uuid.uuid4().hex[:6]}"
+        repo.save_snapshot({
+            'id': snapshot_id,
+            'backupId': backup['id'],
+            'time': started,
+            'source': source,
+            'type': backup['type'],
+            'files': files
+        })
+        retention = backup['retention_days'] if backup['retention_days'] is not None else 30
+        pruned = repo.prune(backup['id'], retention)
+        gc = repo.gc() if pruned else None
+        elapsed = max(time.time() - started, 1e-9)
+        stats.update({
+            'snapshot': snapshot_id,
+            'prunedSnapshots': pruned,
+            'gc': gc,
+            'seconds': round(elapsed, 3),
+            'ingestMBps': round(stats['readBytes'] / elapsed / 1e6, 1),
+            'dedupRatio': round(stats['bytes'] / stats['storedBytes'], 2) if stats['storedBytes'] else None,
+            'repository': repo.stats()
+        })
+    return stats
+
+
+def restore(repo, snapshot, target):
+    handles = {}
+    try:
+        for rel, (size, mtime_ns, mode, chunks) in snapshot['files'].items():
+            dst = os.path.join(target, rel)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            with open(dst, 'wb') as f:
+                for h in chunks:
+                    f.write(repo.read(bytes.fromhex(h), handles))
+            os.chmod(dst, mode)
+            os.utime(dst, ns=(mtime_ns, mtime_ns))
+    finally:
+        for f in handles.values():
+            f.close()
+
+
+def verify(db, backup, job=None, deep=False, workers=None):
+    # Without deep, only chunk presence is checked; deep re-reads and
+    # re-hashes every chunk the latest snapshot references
+    root = repository_path(backup['destination_path'])
+    with Repository.open(root) as repo:
+        snapshots = repo.snapshots(backup['id'])
+        if not snapshots:
+            raise FileNotFoundError(f"No snapshots for backup {backup['id']} in {root}")
+        snapshot = snapshots[-1]
+        referenced = {h for entry in snapshot['files'].values() for h in entry[3]}
+        missing = sorted(h for h in referenced if bytes.fromhex(h) not in repo.index)
+        corrupt = []
+        if deep:
+            todo = sorted((h for h in referenced if bytes.fromhex(h) in repo.index),
+                          key=lambda h: repo.index[bytes.fromhex(h)][:2])
+            if job is not None:
+                job.update(done=0, total=len(todo), message='Re-hashing chunks')
+
+            def check(h):
+                if job is not None:
+                    job.io(repo.index[bytes.fromhex(h)][2])
+                try:
+                    data = repo.read(bytes.fromhex(h))
+                except Exception:
+                    return False
+                return hashlib.blake2b(data, digest_size=32).hexdigest() == h
+
+            with ThreadPoolExecutor(max_workers=workers or 4, thread_name_prefix='verify',
+                                    initializer=job.worker_init if job is not None else None) as pool:
+                for h, ok in zip(todo, pool.map(check, todo)):
+                    if job is not None:
+                        job.check_cancelled(pool)
+                        job.advance()
+                    if not ok:
+                        corrupt.append(h)
+
+        bad = set(missing) | set(corrupt)
+        damaged = sorted(rel for rel, entry in snapshot['files'].items() if bad & set(entry[3]))
+        return {
+            'ok': not bad,
+            'snapshot': snapshot['id'],
+            'files': len(snapshot['files']),
+            'chunks': len(referenced),
+            'missingChunks': len(missing),
+            'corruptChunks': len(corrupt),
+            'changedCount': len(damaged),
+            'changed': damaged[:MAX_LISTED]
+        }
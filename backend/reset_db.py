@@ -21,7 +21,8 @@ def reset_database():
         password_hash TEXT NOT NULL,
         role TEXT NOT NULL DEFAULT 'user',
         status TEXT NOT NULL DEFAULT 'active',
-        permissions TEXT NOT NULL DEFAULT 'read_files'
+        permissions TEXT NOT NULL DEFAULT 'read_files',
+        last_login DATETIME
     )
     ''')
     
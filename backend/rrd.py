@@ -0,0 +1,156 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from urllib.parse import quote, unquote
+
+MAGIC = b'FNRRD\x00\x01\x00'
+HEADER_SIZE = 64
+# (step seconds, rows): 1 day at 10 s, 7 days at 1 min, 30 days at 5 min, 366 days at 1 h
+ARCHIVES = ((10, 8640), (60, 10080), (300, 8640), (3600, 8784))
+# Each row is five doubles: slot timestamp, avg, min, max, count
+ROW = 5
+FIELDS = {'avg': 1, 'min': 2, 'max': 3}
+
+
+class RoundRobinFile:
+    # A fixed-size file per metric; every archive is a ring indexed by
+    # (ts // step) % rows, so writes are in place and the size never grows
+
+    def __init__(self, path, archives=ARCHIVES):
+        self.path = path
+        self.archives = archives
+        header = MAGIC + struct.pack('<I', len(archives)) + b''.join(
+            struct.pack('<II', step, rows) for step, rows in archives)
+        size = HEADER_SIZE + sum(rows for _, rows in archives) * ROW * 8
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            existing = os.pread(fd, len(header), 0)
+            if existing != header or os.fstat(fd).st_size != size:
+                # New file, or the layout changed: start over (sparse, all zero)
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, header, 0)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.view = memoryview(self._mmap)[HEADER_SIZE:].cast('d')
+
+        self.layout = []
+        base = 0
+        for step, rows in archives:
+            self.layout.append((step, rows, base))
+            base += rows * ROW
+
+    def update(self, ts, value):
+        view = self.view
+        for step, rows, base in self.layout:
+            slot = ts // step
+            i = base + (slot % rows) * ROW
+            slot_ts = slot * step
+            if view[i] != slot_ts:
+                # Slot last used a full ring ago (or never): reset it
+                view[i] = slot_ts
+                view[i + 1] = view[i + 2] = view[i + 3] = value
+                view[i + 4] = 1
+                continue
+            count = view[i + 4] + 1
+            view[i + 1] += (value - view[i + 1]) / count
+            if value < view[i + 2]:
+                view[i + 2] = value
+            if value > view[i + 3]:
+                view[i + 3] = value
+            view[i + 4] = count
+
+    def pick(self, start, end, now, max_points=None):
+        # Finest archive still holding `start`, and coarse enough for max_points
+        for step, rows, base in self.layout:
+            if start < now - step * rows:
+                continue
+            if max_points and (end - start) / step > max_points:
+                continue
+            return step, rows, base
+        return self.layout[-1]
+
+    def segments(self, archive, start, end):
+        # Zero-copy slices of the ring covering [start, end], oldest first
+        step, rows, base = archive
+        first, last = int(start // step), int(end // step)
+        if last - first >= rows:
+            first = last - rows + 1
+        a, b = first % rows, last % rows
+        if a <= b:
+            return [self.view[base + a * ROW:base + (b + 1) * ROW]]
+        return [self.view[base + a * ROW:base + rows * ROW], self.view[base:base + (b + 1) * ROW]]
+
+    def read(self, start, end, cf='avg', max_points=None, now=None):
+        now = time.time() if now is None else now
+        archive = self.pick(start, end, now, max_points)
+        offset = FIELDS[cf]
+        first = start - start % archive[0]
+        points = []
+        for segment in self.segments(archive, start, end):
+            # Rows whose timestamp falls outside the window are stale ring entries
+            for i in range(0, len(segment), ROW):
+                ts = segment[i]
+                if first <= ts <= end:
+                    points.append([int(ts), segment[i + offset]])
+            segment.release()
+        return archive[0], points
+
+    def flush(self):
+        self._mmap.flush()
+
+    def close(self):
+        self.view.release()
+        self._mmap.close()
+
+
+class RoundRobinStore:
+    def __init__(self, directory, archives=ARCHIVES):
+        self.directory = os.path.abspath(directory)
+        self.archives = archives
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def _file(self, metric):
+        rrd = self._files.get(metric)
+        if rrd is None:
+            # The directory appears with the first sample, not at construction
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, quote(metric, safe='') + '.rrd')
+            rrd = self._files[metric] = RoundRobinFile(path, self.archives)
+        return rrd
+
+    def record(self, ts, samples):
+        ts = int(ts)
+        with self._lock:
+            for metric, value in samples.items():
+                if value is not None:
+                    self._file(metric).update(ts, float(value))
+
+    def metrics(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(unquote(name[:-4]) for name in os.listdir(self.directory) if name.endswith('.rrd'))
+
+    def query(self, metric, start, end=None, cf='avg', max_points=None):
+        end = time.time() if end is None else end
+        if metric not in self._files and metric not in self.metrics():
+            return None
+        with self._lock:
+            step, points = self._file(metric).read(start, end, cf, max_points)
+        return {'metric': metric, 'step': step, 'cf': cf, 'points': points}
+
+    def flush(self):
+        with self._lock:
+            for rrd in self._files.values():
+                rrd.flush()
+
+    def close(self):
+        with self._lock:
+            for rrd in self._files.values():
+                rrd.close()
+            self._files.clear()
@@ -0,0 +1,316 @@
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+
+PORTS = {'smb': 445, 'nfs': 2049}
+SS_COUNTER = re.compile(r'\b(bytes_acked|bytes_received):(\d+)')
+
+
+class CommandSource:
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+
+    def _run(self, argv):
+        return subprocess.run(argv, capture_output=True, text=True, timeout=self.timeout, check=True).stdout
+
+    def smbstatus(self):
+        return json.loads(self._run(['smbstatus', '--json']))
+
+    def nfsd(self):
+        with open('/proc/net/rpc/nfsd') as f:
+            return f.read()
+
+    def nfs_clients(self):
+        clients = []
+        root = '/proc/fs/nfsd/clients'
+        for name in os.listdir(root) if os.path.isdir(root) else []:
+            try:
+                with open(os.path.join(root, name, 'info')) as f:
+                    clients.append(f.read())
+            except OSError:
+                continue
+        return clients
+
+    def connections(self, ports):
+        query = ' or '.join(f'sport = :{port}' for port in ports)
+        return self._run(['ss', '-tinH', 'state', 'established', f'( {query} )'])
+
+
+class FixtureSource:
+    # Reads smbstatus.json, nfsd, ss.txt and nfsd-clients/*/info from a
+    # directory; missing files behave like a protocol that isn't running
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _read(self, *parts):
+        with open(os.path.join(self.directory, *parts)) as f:
+            return f.read()
+
+    def smbstatus(self):
+        return json.loads(self._read('smbstatus.json'))
+
+    def nfsd(self):
+        return self._read('nfsd')
+
+    def nfs_clients(self):
+        root = os.path.join(self.directory, 'nfsd-clients')
+        if not os.path.isdir(root):
+            return []
+        return [self._read('nfsd-clients', name, 'info') for name in sorted(os.listdir(root))]
+
+    def connections(self, ports):
+        return self._read('ss.txt')
+
+
+def _host(address):
+    host = address.rsplit(':', 1)[0].strip('[]')
+    return host[7:] if host.startswith('::ffff:') else host
+
+
+def parse_ss(text):
+    connections = []
+    current = None
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if not line[0].isspace():
+            fields = line.split()
+            if len(fields) < 4:
+                current = None
+                continue
+            local, peer = fields[2], fields[3]
+            current = {'local': local, 'peer': peer, 'port': int(local.rsplit(':', 1)[1]),
+                       'client': _host(peer), 'sent': 0, 'received': 0}
+            connections.append(current)
+        elif current is not None:
+            counters = dict(SS_COUNTER.findall(line))
+            current['sent'] = int(counters.get('bytes_acked', 0))
+            current['received'] = int(counters.get('bytes_received', 0))
+    return connections
+
+
+def parse_smbstatus(data, share_paths=None):
+    sessions = []
+    for session in (data.get('sessions') or {}).values():
+        sessions.append({
+            'sessionId': session.get('session_id'),
+            'user': session.get('username'),
+            'group': session.get('groupname'),
+            'client': _host(session.get('remote_machine') or ''),
+            'hostname': session.get('hostname'),
+            'dialect': session.get('session_dialect'),
+            'encryption': (session.get('encryption') or {}).get('cipher') or None,
+            'signing': (session.get('signing') or {}).get('cipher') or None
+        })
+    shares = {}
+    for tcon in (data.get('tcons') or {}).values():
+        share = shares.setdefault(tcon.get('service'), {'clients': set(), 'openFiles': 0})
+        share['clients'].add(_host(tcon.get('machine') or ''))
+    # Open files only carry the share's path; map it back to the share name
+    share_paths = share_paths or {}
+    for open_file in (data.get('open_files') or {}).values():
+        path = (open_file.get('service_path') or '').rstrip('/')
+        share = shares.setdefault(share_paths.get(path, path), {'clients': set(), 'openFiles': 0})
+        share['openFiles'] += len(open_file.get('opens') or {})
+    return sessions, shares
+
+
+def parse_nfsd(text):
+    stats = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == 'io':
+            stats['readBytes'], stats['writeBytes'] = int(fields[1]), int(fields[2])
+        elif fields[0] == 'th':
+            stats['threads'] = int(fields[1])
+        elif fields[0] == 'rpc':
+            stats['calls'] = int(fields[1])
+            stats['badCalls'] = int(fields[2])
+    return stats
+
+
+def parse_nfs_client(text):
+    info = {}
+    for line in text.splitlines():
+        key, _, value = line.partition(':')
+        info[key.strip()] = value.strip().strip('"')
+    return {
+        'clientId': info.get('clientid'),
+        'client': _host(info.get('address', '')),
+        'name': info.get('name'),
+        'status': info.get('status'),
+        'minorVersion': int(info['minor version']) if info.get('minor version', '').isdigit() else None
+    }
+
+
+class Throughput:
+    # Current rate plus a rolling average over the last `window` seconds
+
+    def __init__(self, window):
+        self.window = window
+        self.rx_bytes = 0
+        self.tx_bytes = 0
+        self.rx_rate = 0.0
+        self.tx_rate = 0.0
+        self._points = deque()
+
+    def add(self, now, rx, tx, elapsed):
+        self.rx_bytes += rx
+        self.tx_bytes += tx
+        self.rx_rate = rx / elapsed if elapsed else 0.0
+        self.tx_rate = tx / elapsed if elapsed else 0.0
+        self._points.append((now, rx, tx))
+        while self._points and self._points[0][0] < now - self.window:
+            self._points.popleft()
+
+    def to_dict(self, now):
+        span = max(self.window, 1)
+        recent = [p for p in self._points if p[0] >= now - self.window]
+        return {
+            'rxBytes': int(self.rx_bytes),
+            'txBytes': int(self.tx_bytes),
+            'rxRate': round(self.rx_rate, 1),
+            'txRate': round(self.tx_rate, 1),
+            'rxAvg': round(sum(p[1] for p in recent) / span, 1),
+            'txAvg': round(sum(p[2] for p in recent) / span, 1)
+        }
+
+
+class SessionMonitor:
+    # Polled once per metrics tick and read by every request from the
+    # snapshot, so the page costs nothing extra per viewer
+
+    def __init__(self, source, enabled=lambda protocol: True, share_paths=dict, window=60):
+        self.source = source
+        self.enabled = enabled
+        self.share_paths = share_paths
+        self.window = window
+        self.snapshots = {}
+        self._connections = {}
+        self._clients = {}
+        self._shares = {}
+        self._nfsd = None
+        self._last = None
+        self._lock = threading.Lock()
+
+    def collect(self):
+        # Metrics-sampler source: refreshes the snapshots and returns gauges
+        now = time.time()
+        elapsed = now - self._last if self._last else None
+        self._last = now
+        protocols = [name for name in PORTS if self.enabled(name)]
+        gauges = {}
+
+        deltas = {}
+        try:
+            connections = parse_ss(self.source.connections([PORTS[name] for name in protocols])) if protocols else []
+        except (OSError, subprocess.SubprocessError):
+            connections = []
+        seen = {}
+        for conn in connections:
+            key = (conn['local'], conn['peer'])
+            seen[key] = conn
+            previous = self._connections.get(key)
+            # A connection seen for the first time is only a baseline
+            if previous is not None:
+                rx = max(0, conn['received'] - previous['received'])
+                tx = max(0, conn['sent'] - previous['sent'])
+                client = deltas.setdefault((conn['port'], conn['client']), [0, 0])
+                client[0] += rx
+                client[1] += tx
+        self._connections = seen
+
+        snapshots = {}
+        for name in protocols:
+            port = PORTS[name]
+            snapshot = {'protocol': name, 'available': True, 'updatedAt': now, 'error': None}
+            try:
+                if name == 'smb':
+                    self._collect_smb(snapshot, now, elapsed, deltas, port)
+                    gauges['smb:sessions'] = len(snapshot['sessions'])
+                else:
+                    self._collect_nfs(snapshot, now, elapsed, deltas, port)
+                    gauges['nfs:clients'] = len(snapshot['sessions'])
+                    if 'readRate' in snapshot['totals']:
+                        gauges['nfs:read'] = snapshot['totals']['readRate']
+                        gauges['nfs:write'] = snapshot['totals']['writeRate']
+                clients = snapshot['clients']
+                gauges[f'{name}:rx'] = sum(c['rxRate'] for c in clients)
+                gauges[f'{name}:tx'] = sum(c['txRate'] for c in clients)
+            except FileNotFoundError:
+                snapshot.update(available=False, sessions=[], clients=[], shares=[], totals={})
+            except (OSError, ValueError, subprocess.SubprocessError) as e:
+                snapshot.update(available=False, error=str(e), sessions=[], clients=[], shares=[], totals={})
+            snapshots[name] = snapshot
+        with self._lock:
+            self.snapshots = snapshots
+        return gauges
+
+    def _client_throughput(self, name, now, elapsed, deltas, port, addresses):
+        clients = []
+        for address in sorted(addresses | {client for p, client in deltas if p == port}):
+            counter = self._clients.setdefault((name, address), Throughput(self.window))
+            if elapsed:
+                rx, tx = deltas.get((port, address), (0, 0))
+                counter.add(now, rx, tx, elapsed)
+            clients.append(dict(counter.to_dict(now), client=address))
+        # Forget clients that went away
+        active = {(name, c['client']) for c in clients}
+        for key in [key for key in self._clients if key[0] == name and key not in active]:
+            del self._clients[key]
+        return clients
+
+    def _collect_smb(self, snapshot, now, elapsed, deltas, port):
+        sessions, shares = parse_smbstatus(self.source.smbstatus(), self.share_paths())
+        clients = self._client_throughput('smb', now, elapsed, deltas, port, {s['client'] for s in sessions})
+        by_client = {c['client']: c for c in clients}
+        share_count = {}
+        for share in shares.values():
+            for client in share['clients']:
+                share_count[client] = share_count.get(client, 0) + 1
+
+        share_list = []
+        for share_name, share in sorted(shares.items()):
+            # SMB has no per-share byte counters; a client's traffic is split
+            # evenly across the shares it has connected
+            rx = tx = 0
+            if elapsed:
+                for client in share['clients']:
+                    delta = deltas.get((port, client), (0, 0))
+                    rx += delta[0] / share_count[client]
+                    tx += delta[1] / share_count[client]
+            counter = self._shares.setdefault(('smb', share_name), Throughput(self.window))
+            if elapsed:
+                counter.add(now, rx, tx, elapsed)
+            share_list.append(dict(counter.to_dict(now), name=share_name, clients=sorted(share['clients']),
+                                   openFiles=share['openFiles'], estimated=True))
+        for key in [key for key in self._shares if key[0] == 'smb' and key[1] not in shares]:
+            del self._shares[key]
+
+        snapshot.update(sessions=sessions, clients=[dict(c, sessions=sum(1 for s in sessions if s['client'] == c['client']))
+                                                    for c in by_client.values()],
+                        shares=share_list, totals={})
+
+    def _collect_nfs(self, snapshot, now, elapsed, deltas, port):
+        stats = parse_nfsd(self.source.nfsd())
+        totals = dict(stats)
+        previous, self._nfsd = self._nfsd, stats
+        if previous and elapsed and 'readBytes' in stats:
+            totals['readRate'] = max(0, stats['readBytes'] - previous['readBytes']) / elapsed
+            totals['writeRate'] = max(0, stats['writeBytes'] - previous['writeBytes']) / elapsed
+            totals['callRate'] = max(0, stats.get('calls', 0) - previous.get('calls', 0)) / elapsed
+        sessions = [parse_nfs_client(text) for text in self.source.nfs_clients()]
+        clients = self._client_throughput('nfs', now, elapsed, deltas, port, {s['client'] for s in sessions})
+        # nfsd keeps no per-export counters, so NFS has no share breakdown
+        snapshot.update(sessions=sessions, clients=clients, shares=[], totals=totals)
+
+    def sessions(self, protocol):
+        with self._lock:
+            return self.snapshots.get(protocol)
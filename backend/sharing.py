@@ -0,0 +1,455 @@
+import difflib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import traceback
+
+from commands import CommandFailed, systemctl
+
+HEADER = '# Generated by FlexNAS from the services and shares tables; manual edits are overwritten\n'
+# A file found without the header is copied here before it's first replaced
+ORIGINAL_SUFFIX = '.pre-flexnas'
+
+# Each file maps to the cheapest action that makes the daemon pick it up
+PROTOCOLS = {
+    'smb': {
+        'unit': 'smbd',
+        'files': {'/etc/samba/smb.conf': 'reload'},
+        'reload': ['smbcontrol', 'smbd', 'reload-config']
+    },
+    'nfs': {
+        'unit': 'nfs-server',
+        'files': {'/etc/exports': 'reload', '/etc/nfs.conf.d/flexnas.conf': 'restart'},
+        'reload': ['exportfs', '-ra']
+    },
+    'ftp': {
+        # vsftpd has no reload; any change needs a restart
+        'unit': 'vsftpd',
+        'files': {'/etc/vsftpd.conf': 'restart'},
+        'reload': None
+    }
+}
+ACTION_COST = {None: 0, 'reload': 1, 'restart': 2}
+
+# Parameters the API may set, per protocol and per share. The daemons run
+# as root, so anything that runs commands, changes the account files are
+# accessed as or widens what is exported is left out.
+SMB_GLOBAL_PARAMS = {
+    'workgroup', 'server string', 'netbios name', 'security', 'map to guest', 'guest account',
+    'server min protocol', 'server max protocol', 'server signing', 'smb encrypt',
+    'server multi channel support', 'disable netbios', 'interfaces', 'bind interfaces only',
+    'hosts allow', 'hosts deny', 'load printers', 'log level', 'max log size', 'deadtime',
+    'max connections', 'use sendfile', 'aio read size', 'aio write size', 'socket options'
+}
+SMB_SHARE_PARAMS = {
+    'enabled', 'browseable', 'create mask', 'directory mask', 'force create mode', 'force directory mode',
+    'inherit permissions', 'inherit acls', 'hide dot files', 'hide unreadable', 'veto files',
+    'delete veto files', 'oplocks', 'level2 oplocks', 'strict locking', 'case sensitive', 'preserve case',
+    'hosts allow', 'hosts deny', 'read list', 'write list', 'invalid users', 'access based share enum',
+    'smb encrypt', 'ea support', 'store dos attributes', 'max connections'
+}
+FTP_PARAMS = {
+    'anonymous_enable', 'local_enable', 'write_enable', 'local_umask', 'anon_umask', 'anon_upload_enable',
+    'anon_mkdir_write_enable', 'dirmessage_enable', 'xferlog_enable', 'connect_from_port_20',
+    'idle_session_timeout', 'data_connection_timeout', 'max_clients', 'max_per_ip', 'pasv_enable',
+    'pasv_address', 'passive_ports_min', 'passive_ports_max', 'ssl_enable', 'force_local_logins_ssl',
+    'force_local_data_ssl', 'chroot_local_user', 'allow_writeable_chroot', 'local_max_rate',
+    'anon_max_rate', 'ftpd_banner', 'use_localtime'
+}
+NFS_PARAMS = {'threads', 'udp', 'nfs_version', 'allow_insecure_locks'}
+NFS_SHARE_PARAMS = {'enabled', 'options', 'clients'}
+NFS_OPTIONS = {
+    'ro', 'rw', 'sync', 'async', 'subtree_check', 'no_subtree_check', 'root_squash', 'all_squash',
+    'secure', 'insecure', 'wdelay', 'no_wdelay', 'hide', 'nohide', 'crossmnt', 'secure_locks',
+    'insecure_locks'
+}
+NFS_OPTION_RE = re.compile(r'^(anonuid|anongid|fsid)=\d+$|^sec=(sys|krb5|krb5i|krb5p)(:(sys|krb5|krb5i|krb5p))*$')
+NFS_CLIENT_RE = re.compile(r'^[A-Za-z0-9.*?:/_@\[\]-]+$')
+NFS_VERSIONS = ('', '3', '4', '4.0', '4.1', '4.2')
+PARAMS = {
+    'smb': (SMB_GLOBAL_PARAMS, SMB_SHARE_PARAMS),
+    'nfs': (NFS_PARAMS, NFS_SHARE_PARAMS),
+    'ftp': (FTP_PARAMS, {'enabled'})
+}
+
+
+def _clean(value):
+    return ' '.join(str(value).split())
+
+
+def _smb_key(key):
+    return _clean(str(key).replace('_', ' ')).lower()
+
+
+def _has_control(value):
+    return any(ord(c) < 32 or ord(c) == 127 for c in str(value))
+
+
+def _param_error(protocol, key, value, share=False):
+    # Why key = value can't be rendered for this protocol, or None
+    allowed = PARAMS[protocol][1 if share else 0]
+    name = _smb_key(key) if protocol == 'smb' else key
+    if not isinstance(key, str) or _has_control(key) or name not in allowed:
+        return f"{key!r} is not a supported {protocol} {'share ' if share else ''}parameter"
+    values = value if isinstance(value, list) else [value]
+    if not all(isinstance(v, (str, int, float, bool)) for v in values) or any(_has_control(v) for v in values):
+        return f"{key} must be a string, number or boolean without control characters"
+    if protocol == 'smb' and name == 'guest account' and _clean(value) in ('root', '0'):
+        return 'guest account may not be root'
+    if protocol == 'nfs':
+        if key == 'threads' and (isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= 256):
+            return 'threads must be an integer from 1 to 256'
+        if key == 'nfs_version' and str(value).strip() not in NFS_VERSIONS:
+            return f"nfs_version must be one of {', '.join(v for v in NFS_VERSIONS if v)}"
+        if key == 'options':
+            options = value.split(',') if isinstance(value, str) else values
+            bad = [str(o) for o in options if o not in NFS_OPTIONS and not NFS_OPTION_RE.match(str(o))]
+            if bad:
+                return f"Unsupported NFS export options: {', '.join(bad)}"
+        if key == 'clients':
+            clients = value.split() if isinstance(value, str) else values
+            bad = [str(c) for c in clients if not NFS_CLIENT_RE.match(str(c))]
+            if bad:
+                return f"Invalid NFS clients: {', '.join(bad)}"
+    return None
+
+
+def check_share_name(name):
+    # Share names become smb.conf section headers and export comments
+    if not isinstance(name, str) or not name.strip():
+        return 'Share name is required'
+    if len(name) > 80 or _has_control(name) or any(c in name for c in '[]/\\'):
+        return 'Share name must be at most 80 characters without control characters, brackets or slashes'
+    return None
+
+
+def check_share_settings(protocol, settings):
+    # Problems with one share's protocol settings; empty when all is well
+    if protocol not in PARAMS:
+        return []
+    if not isinstance(settings, dict):
+        return ['Share settings must be an object']
+    return [error for key, value in settings.items()
+            for error in [_param_error(protocol, key, value, share=True)] if error]
+
+
+def check_service_config(protocol, config):
+    # Problems with a protocol's config, including its per-share settings
+    if not isinstance(config, dict):
+        return ['config must be an object']
+    if protocol not in PARAMS:
+        return [f"{key!r} contains control characters" for key, value in config.items()
+                if _has_control(key) or _has_control(value)]
+    errors = []
+    for key, value in config.items():
+        if key == 'shares':
+            if not isinstance(value, dict):
+                errors.append('shares must be an object')
+                continue
+            for share, settings in value.items():
+                errors.extend(f"{share}: {error}" for error in check_share_settings(protocol, settings))
+            continue
+        error = _param_error(protocol, key, value)
+        if error:
+            errors.append(error)
+    return errors
+
+
+def _params(protocol, settings, share=False):
+    # Only what passes the checks reaches a config file, whatever is stored
+    return [(key, value) for key, value in settings.items()
+            if key not in ('shares', 'enabled') and _param_error(protocol, key, value, share) is None]
+
+
+def _smb_value(value):
+    if isinstance(value, bool):
+        return 'yes' if value else 'no'
+    if isinstance(value, (list, tuple)):
+        return ' '.join(_clean(v) for v in value)
+    return _clean(value)
+
+
+def _share_settings(service_config, share):
+    shares = service_config.get('shares')
+    settings = shares.get(share['name'], {}) if isinstance(shares, dict) else {}
+    return settings if isinstance(settings, dict) else {}
+
+
+def _exported(service_config, shares):
+    # A name or path with a line break could start a section of its own
+    return [(share, settings) for share in shares
+            for settings in [_share_settings(service_config, share)]
+            if settings.get('enabled', True) and not _has_control(share['name']) and not _has_control(share['path'])]
+
+
+def render_smb(service, shares):
+    config = service['config']
+    lines = [HEADER, '[global]']
+    lines.append(f"   smb ports = {service['port'] or 445}")
+    for key, value in _params('smb', config):
+        lines.append(f"   {_smb_key(key)} = {_smb_value(value)}")
+
+    for share, settings in _exported(config, shares):
+        lines.append('')
+        lines.append(f"[{_clean(share['name']).replace(']', '')}]")
+        lines.append(f"   path = {_clean(share['path'])}")
+        if share['description']:
+            lines.append(f"   comment = {_clean(share['description'])}")
+        lines.append(f"   read only = {_smb_value(bool(share['read_only']))}")
+        lines.append(f"   guest ok = {_smb_value(bool(share['is_public']))}")
+        if share['allowed_users'] and not share['is_public']:
+            lines.append(f"   valid users = {_smb_value(share['allowed_users'].split(','))}")
+        for key, value in _params('smb', settings, share=True):
+            lines.append(f"   {_smb_key(key)} = {_smb_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+def render_exports(service, shares):
+    lines = [HEADER.rstrip('\n')]
+    for share, settings in _exported(service['config'], shares):
+        settings = dict(_params('nfs', settings, share=True))
+        options = settings.get('options') or ['sync', 'no_subtree_check', 'root_squash']
+        if isinstance(options, str):
+            options = options.split(',')
+        options = ['ro' if share['read_only'] else 'rw'] + [o for o in options if o not in ('ro', 'rw')]
+        clients = settings.get('clients') or ['*']
+        if isinstance(clients, str):
+            clients = clients.split()
+        path = json.dumps(share['path']) if len(share['path'].split()) != 1 else share['path']
+        lines.append(f"{path} " + ' '.join(f"{_clean(client)}({','.join(options)})" for client in clients))
+    return '\n'.join(lines) + '\n'
+
+
+def render_nfs_conf(service, shares):
+    config = dict(_params('nfs', service['config']))
+    flag = lambda value: 'y' if value else 'n'  # noqa: E731
+    lines = [HEADER, '[nfsd]', f"threads={int(config.get('threads', 8))}",
+             f"udp={flag(config.get('udp', False))}", f"port={service['port'] or 2049}"]
+    version = str(config.get('nfs_version', '')).strip()
+    if version:
+        lines.append(f"vers{version}=y")
+    return '\n'.join(lines) + '\n'
+
+
+FTP_KEYS = {'passive_ports_min': 'pasv_min_port', 'passive_ports_max': 'pasv_max_port'}
+
+
+def render_vsftpd(service, shares):
+    lines = [HEADER, 'listen=YES', f"listen_port={service['port'] or 21}"]
+    if service['config'].get('passive_ports_min'):
+        lines.append('pasv_enable=YES')
+    for key, value in _params('ftp', service['config']):
+        if isinstance(value, bool):
+            value = 'YES' if value else 'NO'
+        lines.append(f"{FTP_KEYS.get(key, key)}={_clean(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+RENDERERS = {
+    '/etc/samba/smb.conf': render_smb,
+    '/etc/exports': render_exports,
+    '/etc/nfs.conf.d/flexnas.conf': render_nfs_conf,
+    '/etc/vsftpd.conf': render_vsftpd
+}
+
+
+def write_atomic(path, text):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.flexnas-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            os.chmod(tmp, os.stat(path).st_mode & 0o7777)
+        else:
+            os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+class ConfigApplier:
+    # Renders daemon configs from the database and applies only what changed.
+    # With a dry-run root, files go under that directory and commands are
+    # recorded instead of run.
+
+    def __init__(self, get_db, executor, root=None, delay=1.0, on_apply=None):
+        self.get_db = get_db
+        self.executor = executor
+        self.root = root
+        self.delay = delay
+        self.on_apply = on_apply
+        self.last_result = None
+        self._enabled = {}
+        # Daemons started through here, the only ones an apply may stop on
+        # its own; others are stopped only when a stop was asked for
+        self._started = set()
+        self._restart = set()
+        self._stop = set()
+        self._timer = None
+        self._lock = threading.Lock()
+        self._apply_lock = threading.Lock()
+
+    @property
+    def dry_run(self):
+        return self.root is not None
+
+    def _path(self, path):
+        return os.path.join(self.root, path.lstrip('/')) if self.root else path
+
+    def request_apply(self, restart=None, stop=None):
+        # Bursts of edits reset the timer, so they end up in a single apply
+        with self._lock:
+            if restart:
+                self._restart.add(restart)
+            if stop:
+                self._stop.add(stop)
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.delay, self._apply_scheduled)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _apply_scheduled(self):
+        try:
+            self.apply()
+        except Exception:
+            traceback.print_exc()
+
+    def _snapshot(self):
+        with self.get_db() as db:
+            services = {row['name']: {'port': row['port'], 'enabled': bool(row['enabled']),
+                                      'config': json.loads(row['config']) if row['config'] else {}}
+                        for row in db.execute("SELECT * FROM services WHERE type = 'file_sharing'").fetchall()}
+            shares = [dict(row) for row in db.execute('SELECT * FROM shares ORDER BY name').fetchall()]
+        return services, shares
+
+    def _read(self, path):
+        try:
+            with open(self._path(path)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def plan(self, restart=(), stop=()):
+        services, shares = self._snapshot()
+        plans = {}
+        for name, spec in PROTOCOLS.items():
+            service = services.get(name)
+            if service is None:
+                continue
+            files, changed, action = {}, [], None
+            for path, file_action in spec['files'].items():
+                text = RENDERERS[path](service, shares)
+                current = self._read(path)
+                files[path] = text
+                if current != text:
+                    changed.append({'path': path, 'diff': ''.join(difflib.unified_diff(
+                        (current or '').splitlines(True), text.splitlines(True),
+                        fromfile=path, tofile=f"{path} (new)"))})
+                    if ACTION_COST[file_action] > ACTION_COST[action]:
+                        action = file_action
+            # File changes on a running daemon keep their reload or
+            # restart; a daemon whose state can't be told is left as is.
+            # A disabled daemon started outside this code keeps running
+            # unless a stop was asked for.
+            running = self._running(name)
+            if not service['enabled']:
+                action = 'stop' if running and (name in self._started or name in stop) else None
+            elif running is False:
+                action = 'start'
+            elif name in restart:
+                action = 'restart'
+            plans[name] = {'enabled': service['enabled'], 'files': files, 'changed': changed, 'action': action}
+        return plans
+
+    def _running(self, name):
+        # As last started or stopped through here; otherwise systemd is
+        # asked once. None when that can't be told, as in a dry run.
+        if name not in self._enabled and not self.dry_run:
+            try:
+                returncode, _, _ = self.executor.runner.run(systemctl('is-active', PROTOCOLS[name]['unit']), 10)
+            except (OSError, subprocess.SubprocessError):
+                return None
+            self._enabled[name] = returncode == 0
+        return self._enabled.get(name)
+
+    def _keep_original(self, path):
+        # Hand-written configs are copied aside once rather than lost
+        current = self._read(path)
+        backup = self._path(path) + ORIGINAL_SUFFIX
+        if current is None or current.startswith(HEADER.rstrip('\n')) or os.path.exists(backup):
+            return None
+        shutil.copy2(self._path(path), backup)
+        return backup
+
+    def _command(self, name, action):
+        spec = PROTOCOLS[name]
+        if action == 'reload' and spec['reload']:
+            return spec['reload']
+        return systemctl('restart' if action == 'reload' else action, spec['unit'])
+
+    def set_state(self, name, enabled):
+        # The daemon was started or stopped directly; don't repeat it on apply
+        with self._apply_lock:
+            self._enabled[name] = enabled
+            if enabled:
+                self._started.add(name)
+            else:
+                self._started.discard(name)
+
+    def apply(self):
+        with self._apply_lock:
+            with self._lock:
+                # Anything pending is covered by the snapshot taken below
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                restart, self._restart = self._restart, set()
+                stop, self._stop = self._stop, set()
+            plans = self.plan(restart, stop)
+
+            result = {'appliedAt': time.time(), 'dryRun': self.dry_run, 'protocols': {}, 'errors': []}
+            for name, plan in plans.items():
+                entry = {'changed': [change['path'] for change in plan['changed']],
+                         'diff': ''.join(change['diff'] for change in plan['changed']),
+                         'action': plan['action'], 'command': None}
+                result['protocols'][name] = entry
+                try:
+                    for change in plan['changed']:
+                        backup = self._keep_original(change['path'])
+                        if backup:
+                            entry.setdefault('backups', []).append(backup)
+                        write_atomic(self._path(change['path']), plan['files'][change['path']])
+                    if plan['action']:
+                        entry['command'] = self._command(name, plan['action'])
+                        if not self.dry_run:
+                            self.executor.run(f"{name}_{plan['action']}", entry['command'])
+                        if plan['action'] == 'start':
+                            self._started.add(name)
+                        elif plan['action'] == 'stop':
+                            self._started.discard(name)
+                    if plan['action'] is not None or plan['enabled']:
+                        self._enabled[name] = plan['enabled']
+                except (OSError, CommandFailed) as e:
+                    result['errors'].append(f"{name}: {e}")
+            self.last_result = result
+        if self.on_apply is not None:
+            self.on_apply(result)
+        return result
+
+    def preview(self):
+        return {name: {'changed': [change['path'] for change in plan['changed']],
+                       'diff': ''.join(change['diff'] for change in plan['changed']),
+                       'action': plan['action']}
+                for name, plan in self.plan().items()}
@@ -0,0 +1,211 @@
+import json
+import os
+import subprocess
+import threading
+import time
+import traceback
+
+# Standby disks make smartctl exit with this code instead of waking them
+STANDBY_EXIT = 7
+
+# ATA attribute ids worth keeping history for
+ATA_ATTRIBUTES = {
+    5: 'reallocated_sectors',
+    9: 'power_on_hours',
+    187: 'reported_uncorrectable',
+    188: 'command_timeout',
+    190: 'airflow_temperature',
+    194: 'temperature',
+    197: 'pending_sectors',
+    198: 'offline_uncorrectable',
+    199: 'crc_errors'
+}
+NVME_FIELDS = {
+    'critical_warning': 'critical_warning',
+    'temperature': 'temperature',
+    'percentage_used': 'percentage_used',
+    'media_errors': 'media_errors',
+    'power_on_hours': 'power_on_hours',
+    'unsafe_shutdowns': 'unsafe_shutdowns'
+}
+# Any increase in these counters is a warning
+WARNING_COUNTERS = ('reallocated_sectors', 'pending_sectors', 'offline_uncorrectable',
+                    'reported_uncorrectable', 'media_errors')
+
+
+class SmartctlCollector:
+    def __init__(self, binary='smartctl', timeout=30):
+        self.binary = binary
+        self.timeout = timeout
+
+    def list_disks(self):
+        out = subprocess.run([self.binary, '--scan-open', '-j'], capture_output=True,
+                             text=True, timeout=self.timeout)
+        devices = json.loads(out.stdout or '{}').get('devices', [])
+        return [{'name': d['name'], 'type': d.get('type')} for d in devices]
+
+    def read(self, disk):
+        cmd = [self.binary, '-j', '-a', '-n', f'standby,{STANDBY_EXIT}']
+        if disk.get('type'):
+            cmd += ['-d', disk['type']]
+        out = subprocess.run(cmd + [disk['name']], capture_output=True, text=True, timeout=self.timeout)
+        if out.returncode == STANDBY_EXIT:
+            return None
+        return json.loads(out.stdout)
+
+
+class FixtureCollector:
+    # Reads <name>.json smartctl output from a directory; a fixture holding
+    # {"standby": true} behaves like a sleeping disk
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def list_disks(self):
+        return [{'name': f"/dev/{name[:-5]}", 'type': None}
+                for name in sorted(os.listdir(self.directory)) if name.endswith('.json')]
+
+    def read(self, disk):
+        with open(os.path.join(self.directory, f"{os.path.basename(disk['name'])}.json")) as f:
+            data = json.load(f)
+        if data.get('standby'):
+            return None
+        return data
+
+
+def parse_smart(data):
+    metrics = {}
+    for attr in data.get('ata_smart_attributes', {}).get('table', []):
+        name = ATA_ATTRIBUTES.get(attr.get('id'))
+        if name:
+            # Temperature raw values pack min/max into the high bytes
+            raw = attr.get('raw', {}).get('value', 0)
+            metrics[name] = raw & 0xFF if 'temperature' in name else raw
+    nvme = data.get('nvme_smart_health_information_log', {})
+    for field, name in NVME_FIELDS.items():
+        if field in nvme:
+            metrics[name] = nvme[field]
+    if 'temperature' in data and 'current' in data['temperature']:
+        metrics['temperature'] = data['temperature']['current']
+    if 'power_on_time' in data and 'hours' in data['power_on_time']:
+        metrics['power_on_hours'] = data['power_on_time']['hours']
+
+    passed = data.get('smart_status', {}).get('passed')
+    if passed is False or metrics.get('critical_warning'):
+        status = 'failing'
+    elif any(metrics.get(name) for name in WARNING_COUNTERS):
+        status = 'warning'
+    else:
+        status = 'healthy'
+    return {
+        'model': data.get('model_name') or data.get('model_family'),
+        'serial': data.get('serial_number'),
+        'capacity': data.get('user_capacity', {}).get('bytes'),
+        'smartPassed': passed,
+        'status': status,
+        'metrics': metrics
+    }
+
+
+class DiskHealthMonitor:
+    def __init__(self, collector, get_db, enabled=lambda: True, interval=1800):
+        self.collector = collector
+        self.get_db = get_db
+        self.enabled = enabled
+        self.interval = interval
+        self.results = {}
+        self._last_values = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load(self):
+        with self.get_db() as db:
+            self.results = {row['disk']: json.loads(row['summary'])
+                            for row in db.execute('SELECT * FROM disk_health').fetchall()}
+            for row in db.execute('''
+                SELECT s.disk, s.metric, s.value FROM disk_health_series s
+                JOIN (SELECT disk, metric, MAX(ts) AS ts FROM disk_health_series GROUP BY disk, metric) m
+                  ON s.disk = m.disk AND s.metric = m.metric AND s.ts = m.ts
+            ''').fetchall():
+                self._last_values[(row['disk'], row['metric'])] = row['value']
+
+    def start(self):
+        if self._thread is None:
+            self.load()
+            self._thread = threading.Thread(target=self._run, name='smart-monitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            if self.enabled():
+                try:
+                    disks = self.collector.list_disks()
+                except Exception:
+                    traceback.print_exc()
+                    disks = []
+                # Spread the disks evenly across the interval rather than
+                # waking every controller at once
+                slot = self.interval / max(len(disks), 1)
+                for i, disk in enumerate(disks):
+                    if self._stop.wait(max(0, started + i * slot - time.monotonic())):
+                        return
+                    self.poll(disk)
+            self._stop.wait(max(1, started + self.interval - time.monotonic()))
+
+    def poll(self, disk):
+        name = disk['name']
+        previous = self.results.get(name, {})
+        try:
+            data = self.collector.read(disk)
+        except Exception as e:
+            result = dict(previous, disk=name, error=str(e), checkedAt=time.time())
+            self._save(name, result, {})
+            return result
+        if data is None:
+            # Asleep: keep the last reading and don't wake the disk
+            result = dict(previous, disk=name, standby=True, checkedAt=time.time())
+            self._save(name, result, {})
+            return result
+        result = parse_smart(data)
+        result.update({'disk': name, 'standby': False, 'error': None,
+                       'checkedAt': time.time(), 'polledAt': time.time()})
+        self._save(name, result, result['metrics'])
+        return result
+
+    def _save(self, name, result, metrics):
+        # Replaced rather than updated in place, so requests can iterate
+        # the dict they picked up while the poller moves on
+        self.results = {**self.results, name: result}
+        now = int(time.time())
+        # Change-only series: a value is stored when it differs from the last one
+        changed = [(name, metric, now, value) for metric, value in metrics.items()
+                   if isinstance(value, (int, float)) and self._last_values.get((name, metric)) != value]
+        with self.get_db() as db:
+            db.execute('''
+                INSERT OR REPLACE INTO disk_health (disk, status, summary, checked_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (name, result.get('status'), json.dumps(result)))
+            db.executemany('''
+                INSERT OR REPLACE INTO disk_health_series (disk, metric, ts, value)
+                VALUES (?, ?, ?, ?)
+            ''', changed)
+            db.commit()
+        for disk, metric, _, value in changed:
+            self._last_values[(disk, metric)] = value
+
+    def history(self, disk, metric=None, since=0):
+        with self.get_db() as db:
+            query = 'SELECT metric, ts, value FROM disk_health_series WHERE disk = ? AND ts >= ?'
+            params = [disk, since]
+            if metric:
+                query += ' AND metric = ?'
+                params.append(metric)
+            rows = db.execute(query + ' ORDER BY metric, ts', params).fetchall()
+        series = {}
+        for row in rows:
+            series.setdefault(row['metric'], []).append([row['ts'], row['value']])
+        return series
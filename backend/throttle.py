@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+DEFAULT_POLICY = {
+    'globalMBps': 200,
+    'globalIops': 2000,
+    'jobMBps': 100,
+    'jobIops': 1000,
+    'kinds': {},       # per job kind overrides, e.g. {'backup': {'jobMBps': 300}}
+    'nice': 10,
+    'ioClass': 'idle',  # idle, best-effort or none
+    'schedule': [
+        {'start': '01:00', 'end': '06:00', 'unthrottled': True}
+    ]
+}
+
+# psutil constant name and priority value per ioClass
+IO_CLASSES = {
+    'idle': ('IOPRIO_CLASS_IDLE', None),
+    'best-effort': ('IOPRIO_CLASS_BE', 7)
+}
+
+
+LIMIT_KEYS = ('globalMBps', 'globalIops', 'jobMBps', 'jobIops')
+KIND_KEYS = ('jobMBps', 'jobIops')
+
+
+def _check_limit(name, value):
+    if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+        raise ValueError(f"{name} must be a non-negative number or null")
+
+
+def validate_policy(policy):
+    for key in LIMIT_KEYS:
+        _check_limit(key, policy.get(key))
+    kinds = policy.get('kinds') or {}
+    if not isinstance(kinds, dict):
+        raise ValueError('kinds must be an object of per job kind overrides')
+    for kind, overrides in kinds.items():
+        if not isinstance(overrides, dict):
+            raise ValueError(f"kinds.{kind} must be an object")
+        for key, value in overrides.items():
+            if key not in KIND_KEYS:
+                raise ValueError(f"kinds.{kind} may only set {' or '.join(KIND_KEYS)}")
+            _check_limit(f"kinds.{kind}.{key}", value)
+    if policy.get('ioClass', 'none') not in ('idle', 'best-effort', 'none'):
+        raise ValueError('ioClass must be idle, best-effort or none')
+    for window in policy.get('schedule', []):
+        for key in ('start', 'end'):
+            datetime.strptime(window[key], '%H:%M')
+    return policy
+
+
+def _minutes(hhmm):
+    hours, minutes = hhmm.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def active_window(policy, now=None):
+    now = now or datetime.now()
+    current = now.hour * 60 + now.minute
+    for window in policy.get('schedule', []):
+        start, end = _minutes(window['start']), _minutes(window['end'])
+        # Windows may wrap midnight, e.g. 22:00-06:00
+        if (start <= current < end) if start <= end else (current >= start or current < end):
+            return window
+    return None
+
+
+def effective_limits(policy, kind=None, now=None):
+    limits = {key: policy.get(key) for key in LIMIT_KEYS}
+    overrides = (policy.get('kinds') or {}).get(kind, {})
+    limits.update({key: value for key, value in overrides.items() if key in KIND_KEYS})
+    window = active_window(policy, now)
+    if window:
+        if window.get('unthrottled'):
+            return dict.fromkeys(limits)
+        limits.update({key: window[key] for key in limits if key in window})
+    return limits
+
+
+class TokenBucket:
+    def __init__(self, rate=None):
+        self._lock = threading.Lock()
+        self.rate = None
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self._lock:
+            rate = rate or None
+            if rate == self.rate:
+                return
+            if self.rate is None:
+                # Start with one second of burst
+                self.tokens = rate
+                self.updated = time.monotonic()
+            elif rate is not None:
+                self.tokens = min(self.tokens, rate)
+            self.rate = rate
+
+    def reserve(self, amount):
+        # Take the tokens now (going into debt if needed) and return how long
+        # the caller must wait, so large reads are never starved
+        with self._lock:
+            if self.rate is None:
+                return 0.0
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class JobLimiter:
+    def __init__(self, throttle, kind):
+        self.throttle = throttle
+        self.kind = kind
+        self.bytes = TokenBucket()
+        self.ops = TokenBucket()
+        self.waited = 0.0
+        self.io_bytes = 0
+
+    def consume(self, nbytes, ops=1):
+        limits = self.throttle.limits(self.kind)
+        self.bytes.set_rate(limits['jobMBps'] and limits['jobMBps'] * 1024 * 1024)
+        self.ops.set_rate(limits['jobIops'])
+        wait = max(
+            self.bytes.reserve(nbytes),
+            self.ops.reserve(ops),
+            self.throttle.bytes.reserve(nbytes),
+            self.throttle.ops.reserve(ops)
+        )
+        self.io_bytes += nbytes
+        if wait > 0:
+            self.waited += wait
+            time.sleep(wait)
+
+
+class Throttle:
+    def __init__(self, policy=None):
+        self.bytes = TokenBucket()
+        self.ops = TokenBucket()
+        self._cache = {}
+        self.set_policy(policy or DEFAULT_POLICY)
+
+    def set_policy(self, policy):
+        self.policy = validate_policy(dict(DEFAULT_POLICY, **policy))
+        self._cache = {}
+
+    def limits(self, kind=None):
+        # The schedule is re-evaluated at most every 30 seconds
+        cached = self._cache.get(kind)
+        now = time.monotonic()
+        if cached is None or now - cached[0] > 30:
+            limits = effective_limits(self.policy, kind)
+            self._cache[kind] = cached = (now, limits)
+            self.bytes.set_rate(limits['globalMBps'] and limits['globalMBps'] * 1024 * 1024)
+            self.ops.set_rate(limits['globalIops'])
+        return cached[1]
+
+    def limiter(self, kind):
+        return JobLimiter(self, kind)
+
+    def lower_priority(self):
+        # Used as a thread/process pool initializer; on Linux nice and the
+        # I/O class apply to the calling thread only
+        tid = threading.get_native_id()
+        try:
+            os.setpriority(os.PRIO_PROCESS, tid, self.policy.get('nice') or 0)
+        except (AttributeError, OSError):
+            pass
+        io_class, value = IO_CLASSES.get(self.policy.get('ioClass'), (None, None))
+        if io_class is None:
+            return
+        import psutil
+        io_class = getattr(psutil, io_class, None)
+        if io_class is not None:
+            try:
+                psutil.Process(tid).ionice(io_class, value)
+            except (psutil.Error, OSError, ValueError):
+                pass
+
+    def status(self):
+        limits = self.limits()
+        window = active_window(self.policy)
+        return {'policy': self.policy, 'limits': limits, 'activeWindow': window}
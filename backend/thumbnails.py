@@ -0,0 +1,184 @@
+import hashlib
+import importlib.util
+import os
+import shutil
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tif', '.tiff'}
+VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.mov', '.avi', '.webm', '.m4v', '.wmv'}
+THUMBNAIL_SIZES = (128, 256, 512)
+
+
+@lru_cache(maxsize=1)
+def _has_pillow():
+    # Pillow is optional (images are skipped without it) and only imported
+    # by the worker processes that render
+    return importlib.util.find_spec('PIL') is not None
+
+
+@lru_cache(maxsize=1)
+def _has_ffmpeg():
+    return shutil.which('ffmpeg') is not None
+
+
+def media_kind(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in IMAGE_EXTENSIONS and _has_pillow():
+        return 'image'
+    if ext in VIDEO_EXTENSIONS and _has_ffmpeg():
+        return 'video'
+    return None
+
+
+def cache_key(path, stat, size):
+    # Content-addressed by source identity, so a changed file gets a new key
+    raw = f"{os.path.abspath(path)}\0{stat.st_mtime_ns}\0{stat.st_size}\0{size}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _render(src, dst, size, kind):
+    # Runs in a worker process
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    try:
+        if kind == 'video':
+            subprocess.run([
+                'ffmpeg', '-nostdin', '-loglevel', 'error', '-y',
+                '-ss', '1', '-i', src, '-frames:v', '1',
+                '-vf', f'scale={size}:{size}:force_original_aspect_ratio=decrease',
+                '-f', 'image2', '-c:v', 'mjpeg', tmp
+            ], check=True, timeout=60)
+        else:
+            from PIL import Image, ImageOps
+            with Image.open(src) as img:
+                img.draft('RGB', (size, size))
+                img = ImageOps.exif_transpose(img)
+                img.thumbnail((size, size))
+                if img.mode not in ('RGB', 'L'):
+                    img = img.convert('RGB')
+                img.save(tmp, 'JPEG', quality=80, optimize=True)
+        os.replace(tmp, dst)
+        return os.path.getsize(dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class ThumbnailCache:
+    def __init__(self, cache_dir, max_bytes, workers=None):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()  # key -> bytes, oldest first
+        self._total = 0
+        self._pending = {}
+        self._pool = None
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        found = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith('.jpg'):
+                    continue
+                st = os.stat(os.path.join(root, name))
+                found.append((st.st_atime, name[:-4], st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total += size
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.jpg")
+
+    def lookup(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._total -= self._entries.pop(key, 0)
+            return None
+        return path
+
+    def submit(self, src, size=256):
+        stat = os.stat(src)
+        kind = media_kind(src)
+        if kind is None:
+            raise ValueError('Unsupported media type')
+        key = cache_key(src, stat, size)
+        with self._lock:
+            if key in self._entries:
+                return key, None
+            future = self._pending.get(key)
+            if future is None:
+                dst = self.path_for(key)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                future = self._get_pool().submit(_render, src, dst, size, kind)
+                self._pending[key] = future
+                future.add_done_callback(lambda f, k=key: self._finished(k, f))
+        return key, future
+
+    def _finished(self, key, future):
+        with self._lock:
+            self._pending.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                return
+            self._entries[key] = future.result()
+            self._total += self._entries[key]
+            self._evict()
+
+    def _evict(self):
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+
+    def get(self, src, size=256, timeout=30):
+        for _ in range(2):
+            key, future = self.submit(src, size)
+            if future is not None:
+                future.result(timeout=timeout)
+                # The done callback may not have registered the entry yet
+                path = self.path_for(key)
+                return key, path if os.path.exists(path) else None
+            path = self.lookup(key)
+            if path is not None:
+                return key, path
+            # The file was removed behind the index; lookup dropped the
+            # entry, so the next submit renders it again
+        return key, None
+
+    def prefetch(self, paths, size=256):
+        keys = {}
+        for src in paths:
+            try:
+                keys[src] = self.submit(src, size)[0]
+            except (OSError, ValueError):
+                continue
+        return keys
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total,
+                'maxBytes': self.max_bytes,
+                'pending': len(self._pending)
+            }
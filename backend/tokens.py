@@ -0,0 +1,110 @@
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+from flask_jwt_extended import JWTManager
+
+
+class CachingJWTManager(JWTManager):
+    # Signature verification and claim parsing run once per token; later
+    # requests with the same token get the claims from memory until it
+    # expires. Keyed by the whole encoded token, so a changed payload never
+    # matches an entry.
+
+    def __init__(self, app=None, cache_size=10000, **kwargs):
+        self.cache_size = cache_size
+        self._claims = OrderedDict()
+        self._claims_lock = threading.Lock()
+        super().__init__(app, **kwargs)
+
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        if csrf_value is not None or allow_expired:
+            return super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+        with self._claims_lock:
+            cached = self._claims.get(encoded_token)
+            if cached is not None:
+                if cached.get('exp') is None or cached['exp'] > time.time():
+                    self._claims.move_to_end(encoded_token)
+                    return dict(cached)
+                del self._claims[encoded_token]
+        claims = super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+        with self._claims_lock:
+            self._claims[encoded_token] = claims
+            while len(self._claims) > self.cache_size:
+                self._claims.popitem(last=False)
+        return dict(claims)
+
+
+class RevocationList:
+    # Revoked token ids live in the revoked_tokens table and in a set that
+    # every request checks. The set is loaded on start and then follows the
+    # table by row id, so revocations from other workers arrive within one
+    # sync interval without a query per request.
+
+    def __init__(self, get_db, interval=2.0, purge_interval=3600):
+        self.get_db = get_db
+        self.interval = interval
+        self.purge_interval = purge_interval
+        self._revoked = {}
+        self._last_id = 0
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def is_revoked(self, jti):
+        return jti in self._revoked
+
+    def __len__(self):
+        return len(self._revoked)
+
+    def revoke(self, jti, token_type, user, expires_at):
+        with self.get_db() as db:
+            db.execute('''
+                INSERT OR IGNORE INTO revoked_tokens (jti, token_type, username, expires_at)
+                VALUES (?, ?, ?, ?)
+            ''', (jti, token_type, user, expires_at))
+            db.commit()
+        # Visible in this process right away; the next sync picks up the row id
+        self._revoked[jti] = expires_at
+
+    def sync(self):
+        with self._lock:
+            with self.get_db() as db:
+                rows = db.execute('''
+                    SELECT id, jti, expires_at FROM revoked_tokens
+                    WHERE id > ? AND (expires_at IS NULL OR expires_at > ?)
+                    ORDER BY id
+                ''', (self._last_id, time.time())).fetchall()
+            for row in rows:
+                self._revoked[row['jti']] = row['expires_at']
+            if rows:
+                self._last_id = rows[-1]['id']
+            if time.time() - self._last_purge >= self.purge_interval:
+                self.purge()
+
+    def purge(self):
+        # Expired tokens are rejected by their exp claim anyway
+        now = time.time()
+        self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp is None or exp > now}
+        with self.get_db() as db:
+            db.execute('DELETE FROM revoked_tokens WHERE expires_at <= ?', (now,))
+            db.commit()
+        self._last_purge = now
+
+    def start(self):
+        if self._thread is None:
+            self.sync()
+            self._thread = threading.Thread(target=self._run, name='token-revocations', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync()
+            except Exception:
+                traceback.print_exc()
@@ -0,0 +1,201 @@
+import base64
+import csv
+import io
+import json
+import multiprocessing
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+ROLES = ('admin', 'user')
+PERMISSIONS = ('read_files', 'write_files', 'delete_files', 'manage_users', 'manage_system', 'view_logs')
+MAX_BULK_USERS = 5000
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+# Sort key -> column expression; each one has a matching (expression, id) index
+SORTS = {
+    'id': 'id',
+    'username': 'username',
+    'email': 'email',
+    'lastLogin': "COALESCE(last_login, '')"
+}
+COLUMNS = 'id, username, email, role, status, permissions, last_login'
+
+
+def hash_password(password):
+    import bcrypt
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+
+
+class PasswordHasher:
+    # bcrypt is deliberately slow and holds the GIL for part of each hash,
+    # so bulk imports spread it across processes
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+
+    def _get_pool(self):
+        # Forking a process that already runs pollers, timers and job
+        # threads can copy a held lock into the child; start clean instead
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return self._pool
+
+    def hash_many(self, passwords):
+        if len(passwords) < 2 or self.workers == 1:
+            return [hash_password(password) for password in passwords]
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self._get_pool().map(hash_password, passwords, chunksize=chunksize))
+
+
+def parse_csv(text):
+    # Header row: username,email,password[,role][,permissions]; permissions
+    # are separated by spaces or semicolons inside the field
+    rows = []
+    for row in csv.DictReader(io.StringIO(text)):
+        row = {(key or '').strip(): (value or '').strip() for key, value in row.items()}
+        if row.get('permissions'):
+            row['permissions'] = row['permissions'].replace(';', ' ').split()
+        else:
+            row.pop('permissions', None)
+        if not row.get('role'):
+            row.pop('role', None)
+        rows.append(row)
+    return rows
+
+
+def validate(row):
+    if not isinstance(row, dict):
+        return 'Row must be an object'
+    for field in ('username', 'email', 'password'):
+        if not isinstance(row.get(field), str) or not row[field].strip():
+            return f"{field} is required"
+    if row.get('role', 'user') not in ROLES:
+        return f"role must be one of {', '.join(ROLES)}"
+    permissions = row.get('permissions', ['read_files'])
+    if isinstance(permissions, str):
+        permissions = permissions.split(',')
+    unknown = [p for p in permissions if p not in PERMISSIONS]
+    if unknown:
+        return f"Unknown permissions: {', '.join(unknown)}"
+    return None
+
+
+def _existing(db, column, values):
+    found = set()
+    values = list(values)
+    for i in range(0, len(values), 500):
+        chunk = values[i:i + 500]
+        found.update(row[0] for row in db.execute(
+            f"SELECT {column} FROM users WHERE {column} IN ({','.join('?' * len(chunk))})", chunk))
+    return found
+
+
+def bulk_create(db, rows, hasher):
+    # Validates everything up front so no password is hashed for a row that
+    # can't be inserted, then writes all rows in a single transaction
+    results = [{'row': i, 'username': row.get('username') if isinstance(row, dict) else None,
+                'status': 'error', 'error': validate(row)} for i, row in enumerate(rows)]
+    pending = [i for i, result in enumerate(results) if result['error'] is None]
+
+    taken_names = _existing(db, 'username', (rows[i]['username'].strip() for i in pending))
+    taken_emails = _existing(db, 'email', (rows[i]['email'].strip() for i in pending))
+    valid = []
+    for i in pending:
+        username, email = rows[i]['username'].strip(), rows[i]['email'].strip()
+        if username in taken_names:
+            results[i]['error'] = 'Username already exists'
+        elif email in taken_emails:
+            results[i]['error'] = 'Email already exists'
+        else:
+            taken_names.add(username)
+            taken_emails.add(email)
+            valid.append(i)
+
+    hashes = hasher.hash_many([rows[i]['password'] for i in valid])
+    for i, password_hash in zip(valid, hashes):
+        row = rows[i]
+        permissions = row.get('permissions', ['read_files'])
+        if isinstance(permissions, str):
+            permissions = permissions.split(',')
+        try:
+            cursor = db.execute('''
+                INSERT INTO users (username, email, password_hash, role, status, permissions)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (row['username'].strip(), row['email'].strip(), password_hash, row.get('role', 'user'),
+                  'active', ','.join(permissions)))
+            results[i].update(status='created', id=cursor.lastrowid, error=None)
+        except sqlite3.IntegrityError as e:
+            results[i]['error'] = str(e)
+    db.commit()
+    return results
+
+
+def encode_cursor(value, user_id):
+    return base64.urlsafe_b64encode(json.dumps([value, user_id]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        value, user_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(user_id, int):
+        raise ValueError('Invalid cursor')
+    return value, user_id
+
+
+def _like_prefix(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def page(db, search=None, role=None, status=None, sort='username', order='asc', limit=DEFAULT_PAGE_SIZE, cursor=None):
+    # Keyset pagination: each page continues after the last (sort key, id)
+    # seen, so deep pages cost the same as the first one
+    if sort not in SORTS:
+        raise ValueError(f"sort must be one of {', '.join(SORTS)}")
+    if order not in ('asc', 'desc'):
+        raise ValueError('order must be asc or desc')
+    expr = SORTS[sort]
+    where, params = [], []
+    if search:
+        # Prefix match, served by the NOCASE indexes on username and email
+        where.append("(username LIKE ? ESCAPE '\\' OR email LIKE ? ESCAPE '\\')")
+        params += [_like_prefix(search)] * 2
+    if role:
+        where.append('role = ?')
+        params.append(role)
+    if status:
+        where.append('status = ?')
+        params.append(status)
+    direction = order.upper()
+
+    def fetch(condition, values, count, order_by=f"{expr} {direction}, id {direction}"):
+        clauses = where + [condition] if condition else where
+        sql = f"SELECT {COLUMNS}, {expr} AS sort_key FROM users"
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += f" ORDER BY {order_by} LIMIT ?"
+        return db.execute(sql, params + values + [count]).fetchall()
+
+    op = '>' if order == 'asc' else '<'
+    if not cursor:
+        rows = fetch(None, [], limit + 1)
+    elif sort == 'id':
+        rows = fetch(f"id {op} ?", [decode_cursor(cursor)[1]], limit + 1)
+    else:
+        # Rest of the current sort value first, then the values after it.
+        # Two index ranges instead of one (key, id) comparison, which SQLite
+        # can't turn into a range when many rows share a key.
+        value, last_id = decode_cursor(cursor)
+        rows = fetch(f"{expr} = ? AND id {op} ?", [value, last_id], limit + 1, f"id {direction}")
+        if len(rows) <= limit:
+            rows += fetch(f"{expr} {op} ?", [value], limit + 1 - len(rows))
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['sort_key'], rows[-1]['id'])
+    return rows, next_cursor